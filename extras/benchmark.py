@@ -0,0 +1,154 @@
+import argparse
+import io
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from readport import Format, Item, Parser, load_config, save_npz
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Typical messages from the devices of the shipped configuration files
+SAMPLES = {
+    "extras/debug.conf": b"01 RH= +000.079 %RH T= +000.095 'C ID=0000001\r\n",
+    "extras/readport_gill.conf": (
+        b"\x02Q,+000.079,-000.102,+000.095,M,+014.94,0000001,\x030F\r\n"
+    ),
+    "readport_4002.conf": b"x= 0.079 y= -0.102 z= 0.095 T= 14.94\r\n",
+    "readport_4004.conf": (
+        b"TA1=25.2,TA2=22.2,TA3=21.1,RH1=34.7,RH2=41.8,RH3=38.3,DP1=8.5,DP2=8.6,"
+        b"DP3=6.3,WC1=17.2,PA=1015.5,QFE=1015.7,QFF=1036.9,QNH=1037.6,PTEND=0.2,"
+        b"SR=486.0,SR1H=459.8,SR24H=256.5,SO2=0.1,NO2=0.2,CO=0.3,H2S=0.4,PM2.5=12,"
+        b"PM10=21,WS1AVG1=5.7,WD1AVG1=79,STATUS=0\r\n"
+    ),
+}
+
+# The same messages split without a regex, see the format option
+FORMATS = {
+    "extras/readport_gill.conf": Format("csv", dict(u=1, v=2, w=3, temp=5), b","),
+    "readport_4002.conf": Format("csv", dict(u=1, v=3, w=5, temp=7)),
+    "readport_4004.conf": Format(
+        "kv",
+        {
+            key.replace(b".", b"").decode(): key
+            for key, _ in (
+                pair.split(b"=") for pair in SAMPLES["readport_4004.conf"].split(b",")
+            )
+        },
+        b",",
+    ),
+}
+
+
+def reference_extract(parser, item):
+    """The original implementation of Parser.extract(), for comparison"""
+    match = re.match(parser.regex, item.data)
+    extracted = {
+        key: parser._cast[key](value)
+        for key, value in match.groupdict().items()
+        if value is not None and value != b"///"
+    }
+    extracted["time"] = item.timestamp
+    logging.debug(f"Got {extracted}")
+    return extracted
+
+
+def measure(extract, parser, item, number):
+    """Return the time per call of extract(parser, item), in microseconds"""
+    started = time.perf_counter()
+    for _ in range(number):
+        extract(parser, item)
+    return (time.perf_counter() - started) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the per-message cost of extracting the variables"
+    )
+    parser.add_argument(
+        "-n", "--number", type=int, default=100000, help="messages per measurement"
+    )
+    args = parser.parse_args()
+
+    print(f"{'config':<28}{'reference, us':>16}{'extract, us':>14}{'speedup':>10}")
+    parsers = {}
+    for name, data in SAMPLES.items():
+        with open(ROOT / name) as f:
+            conf = load_config(f)
+        device = parsers[name] = Parser.from_config(conf)
+        item = Item(data, time.time(), False)
+        expected = reference_extract(device, item)
+        assert expected.items() <= device.extract(item).items()
+
+        before = measure(reference_extract, device, item, args.number)
+        after = measure(Parser.extract, device, item, args.number)
+        print(f"{name:<28}{before:>16.2f}{after:>14.2f}{before / after:>9.1f}x")
+
+    print(
+        f"\n{'config':<28}{'format':>8}{'regex, us':>12}{'format, us':>12}{'speedup':>10}"
+    )
+    for name, message_format in FORMATS.items():
+        device = parsers[name]
+        delimited = Parser(
+            b"",
+            device.group,
+            device._buffer.pack_length,
+            device.dest,
+            dtypes=device.dtypes,
+            missing="fill" if device._fill is not None else "reject",
+            message_format=message_format,
+        )
+        item = Item(SAMPLES[name], time.time(), False)
+        assert device.extract(item) == delimited.extract(item)
+
+        before = measure(Parser.extract, device, item, args.number)
+        after = measure(Parser.extract, delimited, item, args.number)
+        print(
+            f"{name:<28}{message_format.kind:>8}{before:>12.2f}{after:>12.2f}"
+            f"{before / after:>9.1f}x"
+        )
+
+    print(f"\n{'config':<28}{'extract, us':>14}{'extract_many, us':>18}{'speedup':>10}")
+    for name, device in parsers.items():
+        items = [Item(SAMPLES[name], time.time(), False)] * 10000
+        repeat = max(args.number // len(items), 1)
+        started = time.perf_counter()
+        for _ in range(repeat):
+            for item in items:
+                device.extract(item)
+        before = (time.perf_counter() - started) / repeat / len(items) * 1e6
+        started = time.perf_counter()
+        for _ in range(repeat):
+            device.extract_many(items)
+        after = (time.perf_counter() - started) / repeat / len(items) * 1e6
+        print(f"{name:<28}{before:>14.2f}{after:>18.2f}{before / after:>9.1f}x")
+
+    # A pack of 9 noisy variables, as saved by a sonic anemometer
+    rng = np.random.default_rng(0)
+    pack = {f"var{i}": rng.normal(size=12000).cumsum().round(3) for i in range(8)}
+    pack["time"] = time.time() + np.arange(12000) / 20
+    repeat = 5
+    started = time.perf_counter()
+    for _ in range(repeat):
+        np.savez_compressed(io.BytesIO(), **pack)
+    before = (time.perf_counter() - started) / repeat * 1e3
+
+    print(
+        f"\n{'workers':<28}{'savez_compressed, ms':>22}{'save_npz, ms':>14}{'speedup':>10}"
+    )
+    for workers in range(2, max(os.cpu_count() or 1, 2) + 1):
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            started = time.perf_counter()
+            for _ in range(repeat):
+                save_npz(io.BytesIO(), pack, pool=pool)
+            after = (time.perf_counter() - started) / repeat * 1e3
+        print(f"{workers:<28}{before:>22.1f}{after:>14.1f}{before / after:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
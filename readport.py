@@ -1,13 +1,25 @@
 #!/usr/bin/env python
 
 import argparse
+import asyncio
+import bz2
 import configparser
+import glob
+import io
+import json
 import logging
 import logging.config
+import lzma
+import mmap
+import select
 import signal
 import socket
+import struct
 import sys
+import threading
 import time
+import zipfile
+import zlib
 
 try:
     # To enable advanced regular expressions: `pip install regex`
@@ -15,14 +27,39 @@ try:
 except ImportError:
     import re
 
+try:
+    # Shared memory is available in Python 3.8 or later
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
 from ast import literal_eval
 from collections import defaultdict, namedtuple
+from concurrent.futures import Executor, ThreadPoolExecutor
 from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from functools import partial
 from ipaddress import ip_address
-from multiprocessing import Process, Queue, Event
+from operator import itemgetter
+from multiprocessing import Event, Process, Queue, Semaphore
 from pathlib import Path
 from queue import Empty, Full
-from typing import AbstractSet, Any, Dict, Iterator, Optional, TextIO, Tuple, Union
+from typing import (
+    AbstractSet,
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    TextIO,
+    Tuple,
+    Union,
+)
 from urllib.parse import urlparse
 
 import numpy as np
@@ -36,6 +73,27 @@ processes = []
 # A data structure passed between processes
 Item = namedtuple("Item", ["data", "timestamp", "fresh_connection"])
 
+# How often (in seconds) the asyncio tasks check the shutdown flag while idle
+POLL_INTERVAL = 1
+
+# Kernel receive timestamps with nanosecond resolution (Linux). The control message
+# type equals the option name. It carries a struct timespec of two native longs.
+SO_TIMESTAMPNS = getattr(socket, "SO_TIMESTAMPNS", 35)
+_timespec = struct.Struct("@ll")
+
+# The beginning of the files recorded by --echo in the timestamped format
+CAPTURE_MAGIC = b"TOWERCAP1\n"
+
+# The raw values that stand for a missing value, besides capture groups that don't
+# match and absent keys, e.g. an empty csv column
+MISSING_VALUES = (b"", b"///")
+
+# The records of a zip file: the local file header, the central directory file header
+# and the end of central directory record
+_zip_local = struct.Struct("<4s5H3L2H")
+_zip_central = struct.Struct("<4s6H3L5H2L")
+_zip_end = struct.Struct("<4s4H2LH")
+
 
 class ConfigurationError(Exception):
     """An exception thrown when the config file is incorrectly specified"""
@@ -61,23 +119,132 @@ def signal_handler(sig, frame) -> None:  # noqa
         shutdown.set()
 
 
+class Metrics:
+    """A collection of named measurements, periodically written to the log"""
+
+    def __init__(self, interval: Optional[float] = 60, name: str = "") -> None:
+        """Initialize the metrics
+
+        Args:
+            interval: the number of seconds between reports. None or 0 disables
+                reporting (default: 60)
+            name: what is measured, e.g. a device, if there are several (default: "")
+        """
+        self.interval = interval
+        self.name = name
+        self._values = {}
+        self._samples = {}
+        self._watched = {}
+        self._reported = time.monotonic()
+
+    def set(self, name: str, value: Any) -> None:
+        """Record the current value of a measurement
+
+        Args:
+            name: the name of the measurement
+            value: the current value
+        """
+        self._values[name] = value
+
+    def observe(self, name: str, value: float) -> None:
+        """Record a sample of a measurement. The mean and the maximum of the samples
+        since the last report are reported as <name>_mean and <name>_max.
+
+        Args:
+            name: the name of the measurement
+            value: the sampled value
+        """
+        count, total, maximum = self._samples.get(name, (0, 0.0, value))
+        self._samples[name] = (count + 1, total + value, max(maximum, value))
+
+    def watch(self, name: str, func: Callable[[], Any]) -> None:
+        """Register a function that computes the value of a measurement. The function
+        is only called when the metrics are reported.
+
+        Args:
+            name: the name of the measurement
+            func: a function without arguments returning the current value
+        """
+        self._watched[name] = func
+
+    def get(self, name: str, default: Any = None) -> Any:
+        """Obtain the current value of a measurement
+
+        Args:
+            name: the name of the measurement
+            default: the value to return if the measurement is unknown (default: None)
+
+        Returns:
+            value: the current value
+        """
+        if name in self._watched:
+            return self._watched[name]()
+        return self._values.get(name, default)
+
+    def report(self) -> None:
+        """Log the current values if the reporting interval has passed"""
+        if not self.interval or not (self._values or self._samples or self._watched):
+            return
+
+        now = time.monotonic()
+        if now - self._reported < self.interval:
+            return
+        self._reported = now
+
+        values = dict(self._values)
+        values.update((name, func()) for name, func in self._watched.items())
+        # Samples may be observed from other threads, e.g. the background writer
+        samples, self._samples = self._samples, {}
+        for name, (count, total, maximum) in samples.items():
+            values[f"{name}_mean"] = total / count
+            values[f"{name}_max"] = maximum
+        logging.info(
+            (f"Metrics of {self.name}: " if self.name else "Metrics: ")
+            + ", ".join(
+                f"{name}={value:.4g}" if isinstance(value, float) else f"{name}={value}"
+                for name, value in sorted(values.items())
+            )
+        )
+
+
+# Measurements of the current process
+metrics = Metrics()
+
+
 class TCPClient:
     """A TCP socket connection that reads newline-delimited messages."""
 
-    def __init__(self, host: str, port: int, timeout: Optional[float] = None) -> None:
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        timeout: Optional[float] = None,
+        bufsize: int = 65536,
+        kernel_timestamps: bool = False,
+    ) -> None:
         """Initialize the socket connection class.
 
         Args:
             host: IP address of the device
             port: integer port number to listen to
             timeout: a timeout in seconds for connecting and reading data (default: None)
+            bufsize: the initial size of the receive buffer in bytes (default: 65536)
+            kernel_timestamps: ask the kernel to timestamp the received data, see the
+                timestamp property (default: False)
         """
         self.host = host
         self.port = port
         self.timeout = timeout
+        self.kernel_timestamps = kernel_timestamps
         self._sock = None
-        self._fd = None
         self._fresh = None
+        self._timestamp = None
+        # A reusable receive buffer. Bytes in [_start, _end) hold an incomplete message
+        # carried over to the next read.
+        self._buf = bytearray(bufsize)
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
 
     def __enter__(self):
         return self
@@ -92,6 +259,14 @@ class TCPClient:
         """
         return self._fresh
 
+    @property
+    def timestamp(self) -> Optional[float]:
+        """The time the kernel received the data that completed the most recently read
+        messages, in seconds since the Unix epoch. None unless kernel_timestamps is
+        enabled and supported, and the kernel timestamped that data.
+        """
+        return self._timestamp
+
     def connect(self) -> None:
         """Establish socket connection, retrying if necessary"""
         # Close any previously open socket-associated file descriptors
@@ -100,6 +275,8 @@ class TCPClient:
         logging.info(f"Attempting to connect to socket at {self.host}:{self.port}...")
         self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self._sock.settimeout(self.timeout)
+        if self.kernel_timestamps:
+            self._sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
 
         while not shutdown.is_set():
             try:
@@ -111,30 +288,29 @@ class TCPClient:
                     f"Connected to {self.host}:{self.port}. "
                     f"Ready to receive device data..."
                 )
-                # Obtain a file descriptor capable of reading line by line
-                self._fd = self._sock.makefile(mode="rb")
+                # Discard any leftovers from the previous connection
+                self._start = self._end = 0
                 # Mark that the connection has just been created
                 self._fresh = True
                 return
 
         # Shutting down before connection could be established
 
-    def readline(self) -> bytes:
-        """Read complete messages ending in "\n". If a partial message is received,
-        buffer and wait for the remainder before continuing. If multiple joined
-        messages are obtained, split them into individual records.
+    def readlines(self) -> List[bytes]:
+        """Read all of the complete messages ending in "\n" that are available. If a
+        partial message is received, buffer and wait for the remainder before
+        continuing. If multiple joined messages are obtained, split them into
+        individual records.
 
         Returns:
-            data: a binary string
+            records: a non-empty list of binary strings, in the order of arrival
 
         Raises:
             OSError: propagate errors and empty messages as exceptions. There is no such
                 thing as an empty message in TCP, so zero length means a peer disconnect.
         """
         try:
-            data = self._fd.readline()
-            if not data:
-                raise ConnectionResetError("The device has closed the connection")
+            records = self._receive()
         except Exception as e:
             # Make the timeout message more elaborate instead of the default "timed out"
             if isinstance(e, socket.timeout):
@@ -146,23 +322,539 @@ class TCPClient:
         # Mark that some data has been successfully received over this connection.
         self._fresh = False
 
-        return data
+        return records
+
+    def wait(self, timeout: float) -> bool:
+        """Wait until more data can be read from the socket
+
+        Args:
+            timeout: the maximum number of seconds to wait
+
+        Returns:
+            ready: True if data (or a disconnect) is pending, False if timed out
+        """
+        try:
+            ready, _, _ = select.select([self._sock], [], [], timeout)
+        except (OSError, ValueError):
+            # Let the subsequent read handle the broken connection
+            return True
+        return bool(ready)
+
+    def _receive(self) -> List[bytes]:
+        """Receive data into the buffer until at least one complete message is found,
+        then split out all of the complete messages at once.
+
+        Returns:
+            records: a non-empty list of binary strings
+        """
+        while True:
+            if self._end == len(self._buf):
+                self._compact()
+
+            if self.kernel_timestamps:
+                n, ancdata, _, _ = self._sock.recvmsg_into(
+                    [self._view[self._end :]], socket.CMSG_SPACE(_timespec.size)
+                )
+                # Not to pass on the time of an earlier read
+                self._timestamp = None
+                for level, kind, data in ancdata:
+                    if level == socket.SOL_SOCKET and kind == SO_TIMESTAMPNS:
+                        sec, nsec = _timespec.unpack(data[: _timespec.size])
+                        self._timestamp = sec + nsec * 1e-9
+            else:
+                n = self._sock.recv_into(self._view[self._end :])
+
+            if not n:
+                if self._end > self._start:
+                    # Pass on the incomplete message received before the disconnect
+                    data = self._view[self._start : self._end].tobytes()
+                    self._start = self._end = 0
+                    return [data]
+                raise ConnectionResetError("The device has closed the connection")
+
+            # The carried over message has no newlines, so only the new data is searched
+            pos, self._end = self._end, self._end + n
+            start = self._start
+            records = []
+            newline = self._buf.find(b"\n", pos, self._end)
+            while newline >= 0:
+                records.append(self._view[start : newline + 1].tobytes())
+                start = newline + 1
+                newline = self._buf.find(b"\n", start, self._end)
+
+            if start == self._end:
+                # No incomplete messages left, start over from the beginning
+                self._start = self._end = 0
+            else:
+                self._start = start
+
+            if records:
+                return records
+
+    def _compact(self) -> None:
+        """Move the incomplete message to the beginning of the buffer to make room for
+        more data. If the message takes up the whole buffer, double the buffer size.
+        """
+        size = self._end - self._start
+        if size == len(self._buf):
+            # A bytearray cannot be resized while a memoryview of it exists
+            self._view.release()
+            self._buf.extend(bytes(size))
+            self._view = memoryview(self._buf)
+        else:
+            self._buf[:size] = self._view[self._start : self._end].tobytes()
+            self._start, self._end = 0, size
 
     def close(self) -> None:
         """Close all socket-associated handles."""
         try:
-            if self._fd:
-                self._fd.close()
             if self._sock:
                 self._sock.shutdown(socket.SHUT_RDWR)
                 self._sock.close()
         except OSError:
             pass
         finally:
-            self._fd = None
             self._sock = None
 
 
+class SharedRing:
+    """A single-producer/single-consumer ring buffer in shared memory that passes
+    messages between processes without pickling. Used in place of
+    multiprocessing.Queue, supporting the subset of its interface used here.
+
+    The shared memory holds a header with the read and write positions, a fixed-width
+    index of messages (the timestamp, the offset and length of the data, and the fresh
+    connection flag), and a region of raw message bytes. A pair of semaphores counts the
+    used and free index entries, which also orders the memory accesses between
+    processes.
+    """
+
+    _header = struct.Struct("<QQ")
+    _entry = struct.Struct("<dQI?")
+
+    def __init__(self, size: int, slots: Optional[int] = None) -> None:
+        """Create the ring buffer. Must be called before the processes are launched.
+
+        Args:
+            size: the size of the message data region in bytes
+            slots: the maximum number of messages in the buffer (default: size // 32)
+
+        Raises:
+            ConfigurationError: if shared memory isn't supported by Python
+        """
+        if shared_memory is None:
+            raise ConfigurationError("shared memory requires Python 3.8 or later")
+
+        self.size = size
+        self.slots = slots or max(size // 32, 1)
+        self._index_offset = self._header.size
+        self._data_offset = self._index_offset + self.slots * self._entry.size
+        self._shm = shared_memory.SharedMemory(
+            create=True, size=self._data_offset + size
+        )
+        self._buf = self._shm.buf
+        self._header.pack_into(self._buf, 0, 0, 0)
+        self._used = Semaphore(0)
+        self._free = Semaphore(self.slots)
+        # Private to the producer: the absolute write position and the index entry
+        self._wpos = 0
+        self._head = 0
+        # Private to the consumer: the index entry to read next
+        self._tail = 0
+
+    @property
+    def occupancy(self) -> float:
+        """The fraction of the message data region in use"""
+        rpos, wpos = self._header.unpack_from(self._buf, 0)
+        return (wpos - rpos) / self.size
+
+    def put(self, obj: Union[Item, List[Item]], block: bool = False) -> None:
+        """Copy a message, or a batch of messages, into the buffer. Never blocks.
+
+        Args:
+            obj: an Item or a list of Items
+            block: unused, for compatibility with multiprocessing.Queue
+
+        Raises:
+            Full: if there is no room for a message
+        """
+        for item in obj if isinstance(obj, list) else [obj]:
+            self._put(item)
+
+    def _put(self, item: Item) -> None:
+        """Copy a single message into the buffer"""
+        length = len(item.data)
+        if length > self.size or not self._free.acquire(False):
+            raise Full
+
+        # Messages are never split. Skip the end of the region if there's no room.
+        offset = self._wpos
+        pos = offset % self.size
+        if pos + length > self.size:
+            offset += self.size - pos
+            pos = 0
+
+        rpos, _ = self._header.unpack_from(self._buf, 0)
+        if offset + length - rpos > self.size:
+            self._free.release()
+            raise Full
+
+        start = self._data_offset + pos
+        self._buf[start : start + length] = item.data
+        self._entry.pack_into(
+            self._buf,
+            self._index_offset + (self._head % self.slots) * self._entry.size,
+            item.timestamp,
+            offset,
+            length,
+            item.fresh_connection,
+        )
+        self._head += 1
+        self._wpos = offset + length
+        struct.pack_into("<Q", self._buf, 8, self._wpos)
+        self._used.release()
+
+    def get(self, timeout: Optional[float] = None) -> Item:
+        """Take the next message from the buffer
+
+        Args:
+            timeout: the maximum number of seconds to wait for a message (default: None)
+
+        Returns:
+            item: the message
+
+        Raises:
+            Empty: if no message arrived within the timeout
+        """
+        if not self._used.acquire(timeout=timeout):
+            raise Empty
+
+        timestamp, offset, length, fresh = self._entry.unpack_from(
+            self._buf, self._index_offset + (self._tail % self.slots) * self._entry.size
+        )
+        start = self._data_offset + offset % self.size
+        data = self._buf[start : start + length].tobytes()
+        self._tail += 1
+        struct.pack_into("<Q", self._buf, 0, offset + length)
+        self._free.release()
+        return Item(data, timestamp, fresh)
+
+    def empty(self) -> bool:
+        """Check whether the buffer has no messages"""
+        rpos, wpos = self._header.unpack_from(self._buf, 0)
+        return rpos == wpos
+
+    def close(self) -> None:
+        """Release the shared memory. Must be called once all processes have exited."""
+        self._buf.release()
+        self._shm.close()
+        self._shm.unlink()
+
+
+class SpillQueue:
+    """The producer side of a bounded queue that spills overflow to an append-only
+    journal on disk, and replays the journal into the queue once the consumer catches
+    up. Memory use is capped by the size of the queue, and no messages are dropped.
+    The consumer reads from the wrapped queue directly.
+
+    A journal left over from a previous run is replayed before any new messages.
+    """
+
+    _record = struct.Struct("<dI?")
+
+    def __init__(
+        self,
+        queue: Union[Queue, SharedRing],
+        path: Union[str, Path],
+        replay_batch: int = 100,
+    ) -> None:
+        """Initialize the queue
+
+        Args:
+            queue: a bounded queue or a shared memory ring buffer to wrap
+            path: the filename of the journal
+            replay_batch: the number of messages replayed per queue operation
+                (default: 100)
+        """
+        self.queue = queue
+        self.path = Path(path)
+        self.replay_batch = replay_batch
+        # A ring buffer accepts batches partially, so send the messages one by one
+        self._ring = isinstance(queue, SharedRing)
+        self._writer = self.path.open("ab")
+        self._reader = self.path.open("rb")
+        self._read_pos = 0
+        self._size = self._writer.tell()
+        if self._size:
+            logging.info(f"Replaying {self._size:,} bytes of messages from '{path}'")
+
+    @property
+    def spilled(self) -> int:
+        """The number of bytes in the journal waiting to be replayed"""
+        return self._size - self._read_pos
+
+    def put(self, obj: Union[Item, List[Item]], block: bool = False) -> None:
+        """Send a message or a batch of messages to the queue, or append them to the
+        journal if the queue is full or older messages are still waiting on disk.
+        Never blocks.
+
+        Args:
+            obj: an Item or a list of Items
+            block: unused, for compatibility with multiprocessing.Queue
+
+        Raises:
+            Full: if the messages can be neither queued nor written to the journal
+        """
+        self.replay()
+        items = obj if isinstance(obj, list) else [obj]
+        if not self.spilled:
+            try:
+                if self._ring:
+                    while items:
+                        self.queue.put(items[0], block=False)
+                        items = items[1:]
+                else:
+                    self.queue.put(obj, block=False)
+                    items = []
+            except Full:
+                pass
+
+        if not items:
+            return
+
+        try:
+            for item in items:
+                self._writer.write(
+                    self._record.pack(
+                        item.timestamp, len(item.data), item.fresh_connection
+                    )
+                )
+                self._writer.write(item.data)
+            self._writer.flush()
+        except OSError as e:
+            logging.error(f"Failed to write to '{self.path}': {e}")
+            raise Full
+        self._size = self._writer.tell()
+
+    def replay(self) -> None:
+        """Move as many messages as possible from the journal back to the queue"""
+        batch = 1 if self._ring else self.replay_batch
+        while self.spilled:
+            self._reader.seek(self._read_pos)
+            items = []
+            pos = self._read_pos
+            while len(items) < batch and pos < self._size:
+                header = self._reader.read(self._record.size)
+                if len(header) < self._record.size:
+                    break
+                timestamp, length, fresh = self._record.unpack(header)
+                data = self._reader.read(length)
+                if len(data) < length:
+                    break
+                items.append(Item(data, timestamp, fresh))
+                pos += self._record.size + length
+
+            if not items:
+                # A message cut short, e.g. by a power loss. Skip the rest of the file.
+                logging.warning(f"Discarding an incomplete message in '{self.path}'")
+                self._size = self._read_pos
+                break
+
+            try:
+                self.queue.put(items if len(items) > 1 else items[0], block=False)
+            except Full:
+                return
+            self._read_pos = pos
+
+        if self._size or self._writer.tell():
+            # Everything has been replayed, start the journal over
+            self._writer.truncate(0)
+            self._writer.seek(0)
+            self._read_pos = self._size = 0
+
+
+class Journal:
+    """A write-ahead journal of the received messages for crash recovery. The listener
+    appends every message to memory-mapped segment files of a fixed size. The parser
+    deletes a segment once all of its messages have been saved to disk, and replays
+    the remaining segments after a restart.
+
+    Each segment is named after the sequence number of its first message. A message is
+    stored as a header (data length, CRC32 of the data, timestamp, fresh connection
+    flag) followed by the data. A zero length marks the end of the segment.
+    """
+
+    _record = struct.Struct("<IIdB")
+    _suffix = ".wal"
+
+    def __init__(
+        self,
+        directory: Union[str, Path],
+        segment_size: int = 4194304,
+        sync_interval: float = 1.0,
+    ) -> None:
+        """Initialize the journal. No files are opened until the first append().
+
+        Args:
+            directory: the directory where the segment files are kept
+            segment_size: the size of each segment file in bytes (default: 4194304)
+            sync_interval: the maximum number of seconds between flushing the appended
+                messages to disk. 0 flushes after every message (default: 1.0)
+        """
+        self.directory = Path(directory)
+        self.segment_size = segment_size
+        self.sync_interval = sync_interval
+        # The sequence number of the next appended message
+        self.next_seq = 0
+        self._file = None
+        self._mm = None
+        self._pos = 0
+        self._synced = time.monotonic()
+        # Whether some of the appended messages haven't been flushed yet
+        self.unsynced = False
+
+    def recover(self) -> int:
+        """Find the sequence number of the next message after a restart. Must be called
+        before the processes are launched.
+
+        Returns:
+            next_seq: the sequence number following the last valid journaled message
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.next_seq = 0
+        segments = self.segments()
+        if segments:
+            first, path = segments[-1]
+            count = sum(1 for _ in self._read(path))
+            self.next_seq = first + count
+            if not count:
+                # A new segment will start at the same number
+                path.unlink()
+        return self.next_seq
+
+    def segments(self) -> List[Tuple[int, Path]]:
+        """List the segment files
+
+        Returns:
+            segments: a list of the first sequence numbers and the paths of the segments,
+                oldest first
+        """
+        return sorted(
+            (int(path.stem), path)
+            for path in self.directory.glob(f"*{self._suffix}")
+            if path.stem.isdigit()
+        )
+
+    def append(self, item: Item) -> None:
+        """Append a message to the current segment, starting a new one if necessary
+
+        Args:
+            item: the message to append
+        """
+        length = self._record.size + len(item.data)
+        # Leave room for the zero length that marks the end of the segment
+        if self._mm is None or self._pos + length + 4 > len(self._mm):
+            self._open(length + 4)
+
+        self._record.pack_into(
+            self._mm,
+            self._pos,
+            len(item.data),
+            zlib.crc32(item.data),
+            item.timestamp,
+            item.fresh_connection,
+        )
+        start = self._pos + self._record.size
+        self._mm[start : start + len(item.data)] = item.data
+        self._pos += length
+        self.next_seq += 1
+        self.unsynced = True
+
+        if time.monotonic() - self._synced >= self.sync_interval:
+            self.sync()
+
+    def _open(self, min_size: int) -> None:
+        """Close the current segment and start a new one"""
+        self.close()
+        size = max(self.segment_size, min_size)
+        path = self.directory / f"{self.next_seq:016d}{self._suffix}"
+        self._file = path.open("w+b")
+        self._file.truncate(size)
+        self._mm = mmap.mmap(self._file.fileno(), size)
+        self._pos = 0
+
+    def sync(self) -> None:
+        """Flush the appended messages to disk"""
+        if self._mm is not None:
+            self._mm.flush()
+        self._synced = time.monotonic()
+        self.unsynced = False
+
+    def close(self) -> None:
+        """Flush and close the current segment"""
+        if self._mm is not None:
+            self.sync()
+            self._mm.close()
+            self._file.close()
+            self._mm = self._file = None
+
+    def _read(self, path: Path) -> Iterator[Item]:
+        """Iterate over the valid messages of a segment"""
+        with path.open("rb") as f:
+            data = f.read()
+
+        pos = 0
+        while pos + self._record.size <= len(data):
+            length, crc, timestamp, fresh = self._record.unpack_from(data, pos)
+            start = pos + self._record.size
+            message = data[start : start + length]
+            if not length or len(message) < length or zlib.crc32(message) != crc:
+                # The end of the segment, or a message cut short by a crash
+                return
+            yield Item(message, timestamp, bool(fresh))
+            pos = start + length
+
+    def replay(self, until: int) -> Iterator[Tuple[int, Item]]:
+        """Iterate over the messages journaled before a restart
+
+        Args:
+            until: the sequence number to stop at, i.e. the first one of the new run
+
+        Yields:
+            seq: the sequence number of the message
+            item: the message
+        """
+        # Skip the messages that have already been saved to disk
+        watermark_file = self.directory / "watermark"
+        watermark = int(watermark_file.read_text()) if watermark_file.exists() else 0
+
+        for first, path in self.segments():
+            if first >= until:
+                return
+            for seq, item in enumerate(self._read(path), first):
+                if seq >= until:
+                    return
+                if seq >= watermark:
+                    yield seq, item
+
+    def commit(self, watermark: int) -> None:
+        """Delete the segments where all messages have been saved to disk
+
+        Args:
+            watermark: the sequence number of the oldest message not saved to disk yet
+        """
+        # Record the watermark first, so that the messages before it are never replayed
+        tmp_file = self.directory / "watermark.tmp"
+        tmp_file.write_text(str(watermark))
+        tmp_file.replace(self.directory / "watermark")
+
+        segments = self.segments()
+        for (_, path), (next_first, _) in zip(segments, segments[1:]):
+            if next_first > watermark:
+                break
+            path.unlink()
+
+
 class Group:
     """Encapsulation of group_by related settings"""
 
@@ -230,19 +922,252 @@ class Group:
                 )
 
 
+class Format:
+    """Encapsulation of the message format settings. Besides regular expressions,
+    messages can be split into delimited columns ("csv") or delimited key-value pairs
+    ("kv"), which is much faster."""
+
+    kinds = ("regex", "csv", "kv")
+
+    def __init__(
+        self,
+        kind: str = "regex",
+        fields: Optional[Dict[str, Union[int, bytes]]] = None,
+        delimiter: Optional[bytes] = None,
+        separator: bytes = b"=",
+    ) -> None:
+        """Initialize the Format
+
+        Args:
+            kind: one of "regex", "csv", or "kv" (default: "regex")
+            fields: the variable names mapped to the column numbers, counting from 0
+                (csv), or to the keys (kv). Unused with regex (default: None)
+            delimiter: the bytes between the columns or the pairs, or None to split on
+                whitespace (default: None)
+            separator: the bytes between the keys and the values (default: b"=")
+        """
+        self.kind = kind
+        self.fields = fields or {}
+        self.delimiter = delimiter
+        self.separator = separator
+
+    @classmethod
+    def from_config(
+        cls,
+        kind: str,
+        fields: Optional[str] = None,
+        delimiter: Optional[str] = None,
+        separator: Optional[str] = None,
+    ) -> "Format":
+        """Initialize the Format based on the configuration file values
+
+        Args:
+            kind: the format option value from the config
+            fields: the fields option value, e.g. "u:1, v:2" (csv) or "PM25:PM2.5" (kv)
+            delimiter: the delimiter option value, with escape sequences like "\\t"
+            separator: the separator option value
+
+        Returns:
+            format: an initialized instance of Format
+
+        Raises:
+            ConfigurationError: in case of an unknown kind or ill-formatted fields
+        """
+        if kind not in cls.kinds:
+            raise ConfigurationError(f"format must be one of: {', '.join(cls.kinds)}")
+        if kind == "regex":
+            return cls()
+
+        parsed = {}
+        for entry in (fields or "").split(","):
+            if not entry.strip():
+                continue
+            try:
+                var, field = (part.strip() for part in entry.split(":", 1))
+                parsed[var] = int(field) if kind == "csv" else field.encode()
+            except ValueError:
+                raise ConfigurationError(
+                    f"fields must be in the format <variable>:<"
+                    f"{'column' if kind == 'csv' else 'key'}>, ..."
+                )
+        if not parsed:
+            raise ConfigurationError(f"fields must be set for format = {kind}")
+
+        def unescape(value: Optional[str]) -> Optional[bytes]:
+            return literal_eval("b'{}'".format(value)) if value else None
+
+        return cls(kind, parsed, unescape(delimiter), unescape(separator) or b"=")
+
+    def __eq__(self, other: "Format"):
+        """Test Format objects for equality"""
+        if not isinstance(other, Format):
+            # don't attempt to compare against unrelated types
+            return NotImplemented
+        return (self.kind, self.fields, self.delimiter, self.separator) == (
+            other.kind,
+            other.fields,
+            other.delimiter,
+            other.separator,
+        )
+
+
+class Compression:
+    """Encapsulation of the codec and the level the saved variables are compressed
+    with. The files are .npz archives in every case, since zip files support all of
+    the codecs. With a zlib preset dictionary, the variables are stored as zlib streams
+    that need load_npz() to read."""
+
+    codecs = ("none", "zlib", "bz2", "lzma")
+    # The valid levels and the default level of each codec
+    levels = dict(zlib=(range(0, 10), 6), bz2=(range(1, 10), 9), lzma=(range(0, 10), 6))
+    # The compression methods of the codecs in a zip file, and the zip versions needed
+    # to extract them
+    methods = dict(none=(0, 10), zlib=(8, 20), bz2=(12, 46), lzma=(14, 63))
+
+    def __init__(
+        self,
+        codec: str = "zlib",
+        level: Optional[int] = None,
+        zdict: Optional[bytes] = None,
+    ) -> None:
+        """Initialize the Compression
+
+        Args:
+            codec: one of "none", "zlib", "bz2", or "lzma" (default: "zlib")
+            level: the compression level, or None for the default level of the codec.
+                Unused with "none" (default: None)
+            zdict: a preset dictionary for zlib, see train_zdict(). It improves the
+                compression of small packs (default: None)
+        """
+        self.codec = codec
+        self.level = level
+        if level is None and codec in self.levels:
+            self.level = self.levels[codec][1]
+        self.zdict = zdict
+
+    @property
+    def zdict_id(self) -> Optional[int]:
+        """The id of the preset dictionary, its Adler-32 checksum as in zlib streams"""
+        return zlib.adler32(self.zdict) if self.zdict is not None else None
+
+    @classmethod
+    def from_config(cls, value: str) -> "Compression":
+        """Initialize the Compression based on the configuration file value
+
+        Args:
+            value: the compression option value, e.g. "lzma" or "zlib:1"
+
+        Returns:
+            compression: an initialized instance of Compression
+
+        Raises:
+            ConfigurationError: in case of an unknown codec or an invalid level
+        """
+        codec, _, level = (part.strip() for part in value.partition(":"))
+        if codec not in cls.codecs:
+            raise ConfigurationError(
+                f"compression must be one of: {', '.join(cls.codecs)}"
+            )
+        if not level:
+            return cls(codec)
+
+        valid = cls.levels.get(codec, ([], None))[0]
+        if not level.isdigit() or int(level) not in valid:
+            raise ConfigurationError(
+                f"the level of {codec} must be from {valid[0]} to {valid[-1]}"
+                if valid
+                else f"{codec} has no levels"
+            )
+        return cls(codec, int(level))
+
+    def __eq__(self, other: "Compression"):
+        """Test Compression objects for equality"""
+        if not isinstance(other, Compression):
+            # don't attempt to compare against unrelated types
+            return NotImplemented
+        return (self.codec, self.level, self.zdict) == (
+            other.codec,
+            other.level,
+            other.zdict,
+        )
+
+    def __str__(self) -> str:
+        return self.codec if self.codec == "none" else f"{self.codec}:{self.level}"
+
+    def compress(self, data: bytes) -> Tuple[bytes, int]:
+        """Compress a zip file member
+
+        Args:
+            data: the uncompressed member
+
+        Returns:
+            compressed: the member data in the format of the zip compression method
+            flags: the general purpose flags of the member
+        """
+        if self.codec == "zlib" and self.zdict is not None:
+            # A zlib stream with a header, which identifies the dictionary
+            compressor = zlib.compressobj(
+                self.level, zlib.DEFLATED, zlib.MAX_WBITS, zdict=self.zdict
+            )
+            return compressor.compress(data) + compressor.flush(), 0
+        if self.codec == "zlib":
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS)
+            return compressor.compress(data) + compressor.flush(), 0
+        if self.codec == "bz2":
+            return bz2.compress(data, self.level), 0
+        if self.codec == "lzma":
+            # A raw LZMA stream, preceded by the LZMA SDK version and the properties:
+            # lc = 3, lp = 0, pb = 2 and the dictionary size. Flag bit 1 marks the end
+            # of the stream with a marker.
+            dict_size = 1 << 23
+            properties = struct.pack("<BL", (2 * 5 + 0) * 9 + 3, dict_size)
+            lzma_filter = dict(
+                id=lzma.FILTER_LZMA1, preset=self.level, dict_size=dict_size
+            )
+            compressed = lzma.compress(
+                data, format=lzma.FORMAT_RAW, filters=[lzma_filter]
+            )
+            header = struct.pack("<BBH", 9, 4, len(properties)) + properties
+            return header + compressed, 0x02
+        return bytes(data), 0
+
+    def member(self) -> Tuple[str, int, int]:
+        """The kind of the zip file members
+
+        Returns:
+            suffix: the suffix of the member names after the variable names
+            method: the zip compression method
+            version: the zip version needed to extract the member
+        """
+        if self.codec == "zlib" and self.zdict is not None:
+            # Stored, since zip files don't support preset dictionaries
+            return (".npy.z",) + self.methods["none"]
+        return (".npy",) + self.methods[self.codec]
+
+
 class Buffer:
     """A buffer that collects extracted variables by group, up to a packing limit"""
 
-    def __init__(self, pack_length: int, group_by: Optional[str] = None) -> None:
+    def __init__(
+        self,
+        pack_length: int,
+        group_by: Optional[str] = None,
+        pack_duration: Optional[float] = None,
+    ) -> None:
         """Initialize the Buffer
 
         Args:
             pack_length: the number of records to save in each file
             group_by: the name of the grouping variable (default: None)
+            pack_duration: the number of seconds after which a group is due to be
+                saved, even if it has fewer than pack_length records (default: None)
         """
         self.pack_length = pack_length
         self.group_by = group_by
+        self.pack_duration = pack_duration
         self._buf = dict()
+        # When the first record of each group was buffered, see time.monotonic()
+        self._started = dict()
 
     def put(self, extracted: Dict[str, Any]) -> None:
         """Collect the data separately for each of the groups, up to a packing limit
@@ -269,32 +1194,1240 @@ class Buffer:
             ), "Cannot add to a buffer that is already full"
         else:
             buf = self._buf[group_value] = defaultdict(list)
+            self._started[group_value] = time.monotonic()
 
         # Collect the extracted values
         for var, value in extracted.items():
             buf[var].append(value)
 
-    def full(self) -> Iterator[Tuple[Any, Dict[str, Any]]]:
-        """Iterate over the groups that have reached the packing limit
+    def put_many(self, columns: Dict[str, np.ndarray]) -> int:
+        """Collect the records of a single group, as many as fit until the packing limit
 
-        Yields:
-            group_value: the value of the group that has pack_length items buffered
-            buf: a dict of variable-list pairs, where each list is a vector of
-                pack_length values.
-        """
-        for group_value, buf in self._buf.items():
-            # Avoid creating an empty "time" variable when checking its length
-            timestamps = buf.get("time")
-            if timestamps and len(timestamps) == self.pack_length:
-                yield group_value, buf
+        Args:
+            columns: a dict of variable-array pairs, including the timestamps, with all
+                records in the same group
 
-    def clear(self, group_value: Any) -> None:
+        Returns:
+            count: the number of records collected, from the beginning of the arrays
+
+        Raises:
+            AssertionError: if basic consistency checks fail
+        """
+        group = columns.get(self.group_by)
+        group_value = group[0] if group is not None else None
+        buf = self._buf.get(group_value)
+        if buf:
+            assert columns.keys() == buf.keys(), (
+                f"Cannot buffer the supplied variables. "
+                f"Expected {sorted(buf.keys())}, but got {sorted(columns.keys())}"
+            )
+        else:
+            assert "time" in columns, "'time' must be among supplied variables"
+            buf = self._buf[group_value] = defaultdict(list)
+            self._started[group_value] = time.monotonic()
+
+        count = min(len(columns["time"]), self.pack_length - len(buf["time"]))
+        for var, values in columns.items():
+            buf[var].extend(values[:count].tolist())
+        return count
+
+    def _due(self, group_value: Any, count: int, partial: bool) -> bool:
+        """Check whether a group is due to be saved
+
+        Args:
+            group_value: the value of the group
+            count: the number of records buffered in the group
+            partial: whether any records are due
+
+        Returns:
+            due: True if the group has records that are due to be saved
+        """
+        if not count:
+            return False
+        if partial or count == self.pack_length:
+            return True
+        return (
+            self.pack_duration is not None
+            and time.monotonic() - self._started[group_value] >= self.pack_duration
+        )
+
+    def full(self, partial: bool = False) -> Iterator[Tuple[Any, Dict[str, Any]]]:
+        """Iterate over the groups that have reached the packing limit, or have been
+        collecting records for pack_duration
+
+        Args:
+            partial: iterate over all of the groups that have any records instead
+                (default: False)
+
+        Yields:
+            group_value: the value of the group that is due to be saved
+            buf: a dict of variable-list pairs, where each list is a vector of
+                up to pack_length values.
+        """
+        for group_value, buf in self._buf.items():
+            # Avoid creating an empty "time" variable when checking its length
+            if self._due(group_value, len(buf.get("time", ())), partial):
+                yield group_value, buf
+
+    def clear(self, group_value: Any) -> None:
         """Reset the in-memory buffer for a particular group
 
         Args:
             group_value: the value of the group to reset and start over
         """
         self._buf[group_value].clear()
+        self._started.pop(group_value, None)
+
+    def pop(self, group_value: Any) -> Dict[str, Any]:
+        """Take the buffered data of a particular group, so that the group starts over
+        with a new buffer
+
+        Args:
+            group_value: the value of the group to take
+
+        Returns:
+            buf: a dict of variable-list pairs, no longer referenced by the buffer
+        """
+        self._started.pop(group_value, None)
+        return self._buf.pop(group_value)
+
+
+class ColumnarBuffer(Buffer):
+    """A buffer that stores each variable in a NumPy array preallocated to the packing
+    limit. The arrays are allocated for each group once, when the first record arrives,
+    and are reused after every clear(). The group_by variable isn't stored.
+    """
+
+    def __init__(
+        self,
+        pack_length: int,
+        group_by: Optional[str] = None,
+        dtypes: Optional[Dict[str, np.dtype]] = None,
+        pack_duration: Optional[float] = None,
+    ) -> None:
+        """Initialize the ColumnarBuffer
+
+        Args:
+            pack_length: the number of records to save in each file
+            group_by: the name of the grouping variable (default: None)
+            dtypes: the data types of the arrays by variable name. The types of other
+                variables are taken from their first values (default: None)
+            pack_duration: the number of seconds after which a group is due to be
+                saved, even if it has fewer than pack_length records (default: None)
+        """
+        super().__init__(pack_length, group_by, pack_duration)
+        self.dtypes = dtypes or {}
+        # The number of records buffered in each group
+        self._count = dict()
+
+    def _allocate(self, extracted: Dict[str, Any]) -> Dict[str, np.ndarray]:
+        """Create the arrays of a group, taking the data types from its first record
+
+        Args:
+            extracted: a dict of variable-value pairs, including the timestamp
+
+        Returns:
+            columns: a dict of variable-array pairs
+
+        Raises:
+            AssertionError: if the timestamp is missing
+        """
+        assert "time" in extracted, "'time' must be among supplied variables"
+        return {
+            var: np.empty(
+                self.pack_length,
+                dtype=self.dtypes.get(var, np.asarray(value).dtype),
+            )
+            for var, value in extracted.items()
+            if var != self.group_by
+        }
+
+    def put(self, extracted: Dict[str, Any]) -> None:
+        """Write the record into the arrays of its group, up to a packing limit
+
+        Args:
+            extracted: a dict of variable-value pairs, including the timestamp
+
+        Raises:
+            AssertionError: if basic consistency checks fail
+        """
+        group_value = extracted.get(self.group_by)
+        columns = self._buf.get(group_value)
+        if columns is None:
+            columns = self._buf[group_value] = self._allocate(extracted)
+            self._count[group_value] = 0
+
+        # The group_by variable is part of the record, but not of the columns
+        assert extracted.keys() - {self.group_by} == columns.keys(), (
+            f"Cannot buffer the supplied variables. "
+            f"Expected {sorted(columns.keys())}, but got {sorted(extracted.keys())}"
+        )
+        count = self._count[group_value]
+        assert count < self.pack_length, "Cannot add to a buffer that is already full"
+        if not count:
+            self._started[group_value] = time.monotonic()
+
+        for var, column in columns.items():
+            column[count] = extracted[var]
+        self._count[group_value] = count + 1
+
+    def put_many(self, columns: Dict[str, np.ndarray]) -> int:
+        """Copy the records of a single group into its arrays, as many as fit until the
+        packing limit
+
+        Args:
+            columns: a dict of variable-array pairs, including the timestamps, with all
+                records in the same group
+
+        Returns:
+            count: the number of records copied, from the beginning of the arrays
+
+        Raises:
+            AssertionError: if basic consistency checks fail
+        """
+        group = columns.get(self.group_by)
+        group_value = group[0] if group is not None else None
+        buf = self._buf.get(group_value)
+        if buf is None:
+            first = {var: values[0] for var, values in columns.items()}
+            buf = self._buf[group_value] = self._allocate(first)
+            self._count[group_value] = 0
+
+        assert columns.keys() - {self.group_by} == buf.keys(), (
+            f"Cannot buffer the supplied variables. "
+            f"Expected {sorted(buf.keys())}, but got {sorted(columns.keys())}"
+        )
+        start = self._count[group_value]
+        count = min(len(columns["time"]), self.pack_length - start)
+        if not start:
+            self._started[group_value] = time.monotonic()
+        for var, column in buf.items():
+            column[start : start + count] = columns[var][:count]
+        self._count[group_value] = start + count
+        return count
+
+    def full(self, partial: bool = False) -> Iterator[Tuple[Any, Dict[str, Any]]]:
+        """Iterate over the groups that have reached the packing limit, or have been
+        collecting records for pack_duration
+
+        Args:
+            partial: iterate over all of the groups that have any records instead
+                (default: False)
+
+        Yields:
+            group_value: the value of the group that is due to be saved
+            buf: a dict of variable-array pairs, with up to pack_length values. The
+                arrays are reused by the buffer, so they must be consumed before the
+                group is cleared.
+        """
+        for group_value, count in self._count.items():
+            if self._due(group_value, count, partial):
+                columns = self._buf[group_value]
+                if count < self.pack_length:
+                    columns = {var: column[:count] for var, column in columns.items()}
+                yield group_value, columns
+
+    def clear(self, group_value: Any) -> None:
+        """Reset the in-memory buffer for a particular group, keeping its arrays
+
+        Args:
+            group_value: the value of the group to reset and start over
+        """
+        self._count[group_value] = 0
+        self._started.pop(group_value, None)
+
+    def pop(self, group_value: Any) -> Dict[str, np.ndarray]:
+        """Take the arrays of a particular group. New arrays are allocated for the group
+        when its next record arrives.
+
+        Args:
+            group_value: the value of the group to take
+
+        Returns:
+            buf: a dict of variable-array pairs with the buffered records, no longer
+                referenced by the buffer
+        """
+        count = self._count.pop(group_value)
+        self._started.pop(group_value, None)
+        return {
+            var: column[:count] for var, column in self._buf.pop(group_value).items()
+        }
+
+
+class MappedBuffer(ColumnarBuffer):
+    """A ColumnarBuffer whose arrays are memory-mapped from a checkpoint file per
+    group, so that the buffered records survive a crash or a restart. The operating
+    system writes the pages to disk in the background, without a sync per record.
+
+    A checkpoint file starts with a magic line and a JSON line with the pack length,
+    the group value and the data types of the variables, padded to a page. The number
+    of buffered records follows as a uint64, and then the arrays of the variables.
+    """
+
+    magic = b"TOWERBUF1\n"
+    page_size = 4096
+    # The space for the number of records, keeping the arrays aligned
+    count_size = 64
+
+    def __init__(
+        self,
+        directory: Union[str, Path],
+        pack_length: int,
+        group_by: Optional[str] = None,
+        dtypes: Optional[Dict[str, np.dtype]] = None,
+        pack_duration: Optional[float] = None,
+    ) -> None:
+        """Initialize the MappedBuffer
+
+        Args:
+            directory: where to keep the checkpoint files, one per group
+            pack_length: the number of records to save in each file
+            group_by: the name of the grouping variable (default: None)
+            dtypes: the data types of the arrays by variable name. The types of other
+                variables are taken from their first values (default: None)
+            pack_duration: the number of seconds after which a group is due to be
+                saved, even if it has fewer than pack_length records (default: None)
+        """
+        super().__init__(pack_length, group_by, dtypes, pack_duration)
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # The number of records in the checkpoint file of each group
+        self._mapped_count = dict()
+
+    def _layout(self, header: Dict[str, Any]) -> Tuple[int, Dict[str, int]]:
+        """Compute the offsets of the contents of a checkpoint file
+
+        Args:
+            header: the contents of the JSON line
+
+        Returns:
+            size: the size of the file
+            offsets: the offset of the number of records ("") and of each array
+        """
+        header_size = len(self.magic) + len(json.dumps(header)) + 1
+        offset = -(-header_size // self.page_size) * self.page_size
+        offsets = {"": offset}
+        offset += self.count_size
+        for var, dtype in header["dtypes"].items():
+            offsets[var] = offset
+            size = np.dtype(dtype).itemsize * header["pack_length"]
+            offset += -(-size // self.count_size) * self.count_size
+        return offset, offsets
+
+    def _map(self, path: Path, header: Dict[str, Any]) -> Dict[str, np.ndarray]:
+        """Map a checkpoint file into the buffer
+
+        Args:
+            path: the checkpoint file
+            header: the contents of its JSON line
+
+        Returns:
+            columns: a dict of variable-array pairs, backed by the file
+        """
+        size, offsets = self._layout(header)
+        with path.open("r+b") as f:
+            buf = mmap.mmap(f.fileno(), size)
+        group_value = header["group"]
+        self._mapped_count[group_value] = np.ndarray(
+            (1,), np.uint64, buffer=buf, offset=offsets[""]
+        )
+        return {
+            var: np.ndarray(
+                (header["pack_length"],), dtype, buffer=buf, offset=offsets[var]
+            )
+            for var, dtype in header["dtypes"].items()
+        }
+
+    def _allocate(self, extracted: Dict[str, Any]) -> Dict[str, np.ndarray]:
+        """Create the checkpoint file of a group, taking the data types from its first
+        record
+
+        Args:
+            extracted: a dict of variable-value pairs, including the timestamp
+
+        Returns:
+            columns: a dict of variable-array pairs, backed by the file
+
+        Raises:
+            AssertionError: if the timestamp is missing
+        """
+        columns = super()._allocate(extracted)
+        header = dict(
+            pack_length=self.pack_length,
+            # Without NumPy scalars, e.g. from put_many()
+            group=np.asarray(extracted.get(self.group_by)).item(),
+            dtypes={var: column.dtype.str for var, column in columns.items()},
+        )
+        size, _ = self._layout(header)
+        paths = set(self.directory.glob("*.buf"))
+        path = next(
+            path
+            for path in (
+                self.directory / f"group_{i}.buf" for i in range(len(paths) + 1)
+            )
+            if path not in paths
+        )
+        with path.open("wb") as f:
+            f.write(self.magic + json.dumps(header).encode() + b"\n")
+            f.truncate(size)
+        return self._map(path, header)
+
+    def _sync(self, group_value: Any) -> None:
+        """Record the number of records of a group in its checkpoint file
+
+        Args:
+            group_value: the value of the group
+        """
+        self._mapped_count[group_value][0] = self._count[group_value]
+
+    def put(self, extracted: Dict[str, Any]) -> None:
+        super().put(extracted)
+        self._sync(extracted.get(self.group_by))
+
+    def put_many(self, columns: Dict[str, np.ndarray]) -> int:
+        count = super().put_many(columns)
+        group = columns.get(self.group_by)
+        self._sync(group[0] if group is not None else None)
+        return count
+
+    def clear(self, group_value: Any) -> None:
+        super().clear(group_value)
+        self._sync(group_value)
+
+    def pop(self, group_value: Any) -> Dict[str, np.ndarray]:
+        """Take a copy of the records of a particular group, and clear the group
+
+        Args:
+            group_value: the value of the group to take
+
+        Returns:
+            buf: a dict of variable-array pairs with the buffered records
+        """
+        count = self._count[group_value]
+        columns = self._buf[group_value]
+        columns = {var: column[:count].copy() for var, column in columns.items()}
+        self.clear(group_value)
+        return columns
+
+    def resume(self, variables: AbstractSet[str]) -> Dict[Any, Dict[str, np.ndarray]]:
+        """Continue with the records buffered in the checkpoint files of a previous run.
+        The checkpoint files of the groups with different variables, data types, or
+        pack length are removed, and their records are returned to be saved.
+
+        Args:
+            variables: the names of all of the saved variables, including the timestamp
+
+        Returns:
+            stale: the records that can't be resumed, as a dict of group values and
+                dicts of variable-array pairs
+        """
+        stale = {}
+        for path in sorted(self.directory.glob("*.buf")):
+            try:
+                with path.open("rb") as f:
+                    if f.readline() != self.magic:
+                        raise ValueError("not a checkpoint file")
+                    header = json.loads(f.readline())
+                    group_value = header["group"]
+                    size, offsets = self._layout(header)
+                    if path.stat().st_size != size:
+                        raise ValueError("the file is truncated")
+                    f.seek(offsets[""])
+                    (count,) = np.fromfile(f, np.uint64, 1)
+                    if count > header["pack_length"]:
+                        raise ValueError("the number of records is invalid")
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                logging.error(f"Cannot resume from '{path}': {e}")
+                continue
+
+            dtypes = {var: np.dtype(dtype) for var, dtype in header["dtypes"].items()}
+            if (
+                header["pack_length"] == self.pack_length
+                and set(dtypes) == variables
+                and all(
+                    dtype == self.dtypes.get(var, dtype)
+                    for var, dtype in dtypes.items()
+                )
+                and group_value not in self._buf
+            ):
+                self._buf[group_value] = self._map(path, header)
+                self._count[group_value] = int(count)
+                self._started[group_value] = time.monotonic()
+                continue
+
+            # The settings have changed, so the file can't be reused
+            if count:
+                columns = self._map(path, header)
+                stale[group_value] = {
+                    var: column[: int(count)].copy() for var, column in columns.items()
+                }
+                del self._mapped_count[group_value]
+            path.unlink()
+
+        resumed = sum(self._count.values())
+        if resumed:
+            logging.info(f"Resumed {resumed:,} records from '{self.directory}'")
+        return stale
+
+
+class BackgroundWriter:
+    """A thread that saves packs to disk in the order they were submitted, while the
+    parser carries on. The number of packs in flight is bounded.
+    """
+
+    def __init__(
+        self, max_pending: int, measurements: Optional[Metrics] = None
+    ) -> None:
+        """Initialize the BackgroundWriter and start its thread
+
+        Args:
+            max_pending: the maximum number of packs submitted, but not saved yet
+            measurements: where to record "flush_latency" (default: None, i.e. the
+                metrics of the process)
+        """
+        self._metrics = measurements or metrics
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._slots = threading.Semaphore(max_pending)
+        self._lock = threading.Lock()
+        # The journal sequence numbers of the packs in flight, by submission number
+        self._in_flight = dict()
+        self._submitted = 0
+
+    @property
+    def pending(self) -> int:
+        """The number of packs submitted, but not saved yet"""
+        return len(self._in_flight)
+
+    @property
+    def seqs(self) -> List[int]:
+        """The journal sequence numbers of the first messages of the packs in flight"""
+        with self._lock:
+            return [seq for seq in self._in_flight.values() if seq is not None]
+
+    def submit(
+        self, save: Callable[..., None], *args: Any, seq: Optional[int] = None
+    ) -> None:
+        """Schedule a pack to be saved, waiting while too many packs are in flight
+
+        Args:
+            save: the function that saves the pack, raising ParseError on failure
+            args: the arguments to the function, which must not be modified later
+            seq: the journal sequence number of the first message in the pack, if any
+                (default: None)
+        """
+        self._slots.acquire()
+        with self._lock:
+            key = self._submitted
+            self._submitted += 1
+            self._in_flight[key] = seq
+        self._executor.submit(self._run, key, time.monotonic(), save, args)
+
+    def _run(
+        self, key: int, submitted: float, save: Callable[..., None], args: Tuple
+    ) -> None:
+        """Save a pack in the writer thread
+
+        Args:
+            key: the submission number of the pack
+            submitted: the time the pack was submitted, according to time.monotonic()
+            save: the function that saves the pack
+            args: the arguments to the function
+        """
+        try:
+            save(*args)
+        except ParseError:
+            # The error has been logged, and the pack is lost
+            pass
+        finally:
+            self._metrics.observe("flush_latency", time.monotonic() - submitted)
+            with self._lock:
+                del self._in_flight[key]
+            self._slots.release()
+
+    def drain(self) -> None:
+        """Wait for the packs submitted so far to be saved"""
+        self._executor.submit(int).result()
+
+    def close(self) -> None:
+        """Wait for the packs in flight to be saved, and stop the thread"""
+        self._executor.shutdown(wait=True)
+
+
+class Coalescer:
+    """Collects the packs of each group into a container for an hour or a day, and
+    seals the container into a single .npz file once the period is over. Useful for
+    devices that send few messages, to avoid many tiny files.
+
+    A container is an uncompressed zip file, where the variables of the k-th pack
+    are stored as "<k>/<variable>.npy". It is named after the sealed file with ".tmp"
+    appended, so that it isn't uploaded before it's sealed, and neither is ever
+    overwritten: a sequence number is added to the name instead, e.g. "data.1.npz".
+    A container torn by a crash while a pack was being appended is truncated to its
+    last complete pack. When sealed, the variables
+    of the packs are concatenated. The statistics of each pack, e.g. "time_drift",
+    are saved one value per pack, and "_pack_lengths" records the number of records
+    in each pack.
+    """
+
+    periods = ("hour", "day")
+
+    def __init__(
+        self, period: str, save: Callable[[Path, Dict[str, np.ndarray]], None]
+    ) -> None:
+        """Initialize the Coalescer
+
+        Args:
+            period: either "hour" or "day"
+            save: the function to save the sealed variables to an .npz file with
+        """
+        self.period = period
+        self._save = save
+        self._lock = threading.Lock()
+        # The start of the period, the container file, and the number of packs of
+        # each group
+        self._containers = dict()
+
+    def _start(self, date: datetime) -> datetime:
+        """The start of the period that includes the date"""
+        date = date.replace(minute=0, second=0, microsecond=0)
+        return date.replace(hour=0) if self.period == "day" else date
+
+    def add(
+        self,
+        group_value: Any,
+        target: Path,
+        date: datetime,
+        vectors: Dict[str, np.ndarray],
+    ) -> None:
+        """Append a pack to the container of its group, sealing the previous container
+        if the pack belongs to the next period
+
+        Args:
+            group_value: the value of the group
+            target: the file the pack would be saved to, which names a new container
+            date: the date of the pack
+            vectors: a dict of variable-array pairs
+
+        Raises:
+            OSError or ValueError: if the pack can't be written
+        """
+        start = self._start(date)
+        with self._lock:
+            container = self._containers.get(group_value)
+            if container is not None and container[0] != start:
+                self._seal(group_value)
+                container = None
+            if container is None:
+                container = [start, self._unique(target), 0]
+                self._containers[group_value] = container
+
+            _, path, count = container
+            try:
+                self._append(path, count, vectors)
+            except Exception:
+                # Remove the partially appended pack, e.g. when the disk is full
+                if count:
+                    self._repair(path, count)
+                else:
+                    if path.exists():
+                        path.unlink()
+                    del self._containers[group_value]
+                raise
+            container[2] = count + 1
+        logging.debug(f"Data added to '{path}'")
+
+    @staticmethod
+    def _unique(target: Path) -> Path:
+        """The container for a file, numbered so that neither exists yet"""
+        candidate, sequence = target, 0
+        while candidate.exists() or Path(f"{candidate}.tmp").exists():
+            sequence += 1
+            candidate = target.with_name(f"{target.stem}.{sequence}{target.suffix}")
+        return Path(f"{candidate}.tmp")
+
+    @staticmethod
+    def _append(path: Path, index: int, vectors: Dict[str, np.ndarray]) -> None:
+        """Append a pack to a container"""
+        with zipfile.ZipFile(path, "a") as z:
+            for var, array in vectors.items():
+                with z.open(f"{index}/{var}.npy", "w") as f:
+                    np.lib.format.write_array(
+                        f, np.asanyarray(array), allow_pickle=False
+                    )
+
+    @staticmethod
+    def _repair(path: Path, count: Optional[int] = None) -> int:
+        """Truncate a container, e.g. torn by a crash, to its last complete pack, and
+        write the central directory anew
+
+        Args:
+            path: the container file
+            count: the number of packs to keep, by default all of the complete ones
+
+        Returns:
+            count: the number of packs kept
+
+        Raises:
+            ValueError: if no pack is complete
+        """
+        with path.open("r+b") as f:
+            data = f.read()
+
+            # The members written completely, whose data match their checksum
+            members = []
+            offset = 0
+            while data.startswith(b"PK\x03\x04", offset):
+                fields = _zip_local.unpack_from(data, offset)
+                name_start = offset + _zip_local.size
+                start = name_start + fields[9] + fields[10]
+                end = start + fields[7]
+                if not fields[7] or zlib.crc32(data[start:end]) != fields[6]:
+                    break
+                filename = data[name_start : name_start + fields[9]]
+                members.append((filename, fields[1:9], offset, end))
+                offset = end
+
+            # The variables of a pack are written together, so the last pack is
+            # incomplete if it lacks any of the variables of the previous ones
+            packs = defaultdict(set)
+            for filename, *_ in members:
+                index, var = filename.decode().split("/", 1)
+                packs[int(index)].add(var)
+            last = len(packs) - 1
+            if count is not None:
+                packs = {index: packs[index] for index in range(min(count, len(packs)))}
+            elif last > 0 and packs[last] != packs[last - 1]:
+                del packs[last]
+            members = [m for m in members if int(m[0].split(b"/")[0]) in packs]
+            if not members:
+                raise ValueError("No complete pack")
+
+            end = members[-1][3]
+            f.seek(end)
+            f.truncate()
+            _write_zip_directory(f, [member[:3] for member in members], end)
+        logging.warning(f"'{path}' was damaged, {len(packs)} packs recovered")
+        return len(packs)
+
+    def seal_due(self, now: datetime) -> None:
+        """Seal the containers of the periods that are over
+
+        Args:
+            now: the current date
+        """
+        with self._lock:
+            for group_value, (start, _, _) in list(self._containers.items()):
+                if start < self._start(now):
+                    self._seal(group_value)
+
+    def seal_all(self) -> None:
+        """Seal all of the containers, e.g. on shutdown"""
+        with self._lock:
+            for group_value in list(self._containers):
+                self._seal(group_value)
+
+    def _seal(self, group_value: Any) -> None:
+        """Seal the container of a group
+
+        Args:
+            group_value: the value of the group
+        """
+        _, path, _ = self._containers.pop(group_value)
+        self.seal(path)
+
+    def seal(self, path: Path) -> None:
+        """Combine the packs of a container into a single .npz file and remove the
+        container. Errors are logged, and the container is left for recover().
+
+        Args:
+            path: the container file
+        """
+        try:
+            target = self._seal_file(path)
+        except Exception as e:
+            logging.error(f"Cannot seal '{path}': {e}")
+        else:
+            logging.info(f"Data saved to '{target}'")
+
+    def _seal_file(self, path: Path) -> Path:
+        """Combine the packs of a container into a single .npz file and remove the
+        container
+
+        Args:
+            path: the container file
+
+        Returns:
+            target: the sealed file
+
+        Raises:
+            ValueError: if the container is damaged beyond repair
+            OSError: if the container can't be read or the file saved
+        """
+        target = path.with_suffix("")
+        if target.exists():
+            # E.g. a file saved by a replay. The container is renamed first, so that
+            # recover() knows it's sealed if the removal below is interrupted.
+            new_path = self._unique(target)
+            path.rename(new_path)
+            path, target = new_path, new_path.with_suffix("")
+
+        try:
+            data = np.load(path)
+        except (zipfile.BadZipFile, EOFError):
+            self._repair(path)
+            data = np.load(path)
+        packs = defaultdict(dict)
+        with data:
+            for name in data.files:
+                index, var = name.split("/", 1)
+                packs[int(index)][var] = data[name]
+        packs = [packs[index] for index in sorted(packs)]
+
+        vectors = {}
+        for var in packs[0]:
+            arrays = [pack[var] for pack in packs]
+            if var in ("_missing_vars", "_fixed_vars", "_fixed_decimals"):
+                # The same in every pack
+                vectors[var] = arrays[-1]
+            elif arrays[0].ndim == 0:
+                # The statistics of each pack
+                vectors[var] = np.stack(arrays)
+            else:
+                vectors[var] = np.concatenate(arrays)
+        vectors["_pack_lengths"] = np.array([len(pack["time"]) for pack in packs])
+
+        self._save(target, vectors)
+        path.unlink()
+        return target
+
+    def recover(self, pattern: str) -> None:
+        """Seal the containers left over by a previous run
+
+        Args:
+            pattern: the glob pattern of the container files
+        """
+        for path in map(Path, sorted(glob.glob(pattern))):
+            if path.with_suffix("").exists():
+                # Sealed, but not removed
+                path.unlink()
+                continue
+            try:
+                target = self._seal_file(path)
+            except (ValueError, KeyError) as e:
+                # Set aside, so that it doesn't block the name, and isn't uploaded
+                bad_path = path.with_suffix(".bad.tmp")
+                path.rename(bad_path)
+                logging.error(f"Cannot seal '{path}', moved to '{bad_path}': {e}")
+            except Exception as e:
+                logging.error(f"Cannot seal '{path}': {e}")
+            else:
+                logging.info(f"Data saved to '{target}'")
+
+
+def regularize_time(
+    timestamps: Union[List[float], np.ndarray], sample_rate: float, trim: float = 3.0
+) -> Dict[str, Any]:
+    """Reconstruct the sampling times of a device that samples at a fixed rate from the
+    times its messages were received, which are distorted by the network and the host.
+
+    The receive times are fitted against the sample index with a robust linear fit.
+    Lost samples are detected as lasting shifts of the lower envelope of the receive
+    times, while a burst of delayed messages doesn't shift it, and are skipped in the
+    index.
+
+    Args:
+        timestamps: the receive times of the messages, in seconds
+        sample_rate: the nominal sampling rate of the device, in Hz
+        trim: exclude the receive times that deviate from the fit by more than this
+            many standard deviations, and refit (default: 3.0)
+
+    Returns:
+        vectors: a dict with the regularized times ("time_regular") and the statistics
+            of the pack: the deviation of the device sampling rate from sample_rate in
+            ppm ("time_drift"), the number of lost samples ("time_gaps"), and the
+            standard deviation of the receive delays in seconds ("time_jitter").
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    period = 1 / sample_rate
+    index = np.arange(len(timestamps))
+    if len(timestamps) < 2:
+        return dict(
+            time_regular=timestamps, time_drift=0.0, time_gaps=0, time_jitter=0.0
+        )
+
+    # Fit relative to the first message to retain the precision of the slope
+    start = timestamps[0]
+    t = timestamps - start
+
+    # The latest time each message could have been sampled, given the later messages
+    envelope = np.minimum.accumulate((t - index * period)[::-1])[::-1]
+    lost = np.rint(np.diff(envelope) / period).astype(np.int64)
+    index[1:] += np.cumsum(lost)
+
+    keep = np.ones(len(t), dtype=bool)
+    for _ in range(3):
+        slope, offset = np.polyfit(index[keep], t[keep], 1)
+        residuals = t - (offset + slope * index)
+        deviation = np.abs(residuals - np.median(residuals[keep]))
+        # A robust estimate of the standard deviation
+        sigma = 1.4826 * np.median(deviation[keep])
+        outliers = deviation > trim * sigma
+        if not sigma or np.count_nonzero(~outliers) < 2 or not outliers[keep].any():
+            break
+        keep = ~outliers
+
+    return dict(
+        time_regular=start + offset + slope * index,
+        time_drift=(period / slope - 1) * 1e6,
+        time_gaps=int(index[-1] - len(index) + 1),
+        time_jitter=float(np.std(residuals[keep])),
+    )
+
+
+def integer_cast(dtype: np.dtype) -> Callable[[bytes], int]:
+    """Create a conversion function for an integer data type, which rejects the values
+    that don't fit it instead of wrapping around.
+
+    Args:
+        dtype: a NumPy integer data type
+
+    Returns:
+        cast: a function that converts a value to int
+    """
+    info = np.iinfo(dtype)
+
+    def cast(value: bytes) -> int:
+        number = float(value)
+        if not number.is_integer() or not info.min <= number <= info.max:
+            raise ValueError(f"{value!r} is not a valid {info.dtype} value")
+        return int(number)
+
+    return cast
+
+
+def fixed_cast(decimals: int) -> Callable[[bytes], int]:
+    """Create a conversion function for fixed-point values, scaled by 10 ** decimals to
+    int32. The values with more decimals, or out of range, are rejected.
+
+    Args:
+        decimals: the number of decimals
+
+    Returns:
+        cast: a function that converts a value to a scaled int
+    """
+    info = np.iinfo(np.int32)
+    scale = 10 ** decimals
+
+    def cast(value: bytes) -> int:
+        number = float(value) * scale
+        scaled = round(number)
+        # Allow for the rounding errors of float(), far below the last decimal
+        if abs(number - scaled) > 1e-6 or not info.min <= scaled <= info.max:
+            raise ValueError(f"{value!r} is not a valid value with {decimals} decimals")
+        return scaled
+
+    return cast
+
+
+def count_decimals(value: Optional[bytes]) -> Optional[int]:
+    """Count the decimals of a value as formatted by the device, e.g. 3 for b"+000.079"
+
+    Args:
+        value: the raw value
+
+    Returns:
+        decimals: the number of decimals, or None if the value is not a finite number
+    """
+    try:
+        number = Decimal(value.decode().strip())
+    except (AttributeError, UnicodeDecodeError, InvalidOperation):
+        return None
+    if not number.is_finite():
+        return None
+    return max(-number.as_tuple().exponent, 0)
+
+
+def _compress_member(
+    name: str, array: np.ndarray, compression: Compression
+) -> Tuple[bytes, bytes, Tuple[int, ...]]:
+    """Serialize an array in the .npy format and compress it for a zip file
+
+    Args:
+        name: the name of the variable
+        array: the values of the variable
+        compression: the codec and the level to compress with
+
+    Returns:
+        filename: the name of the zip member
+        compressed: the compressed member
+        fields: the version needed, the flags, the compression method, the CRC-32
+            and the size of the uncompressed member, as in the zip headers
+    """
+    buf = io.BytesIO()
+    np.lib.format.write_array(buf, np.asanyarray(array), allow_pickle=False)
+    data = buf.getbuffer()
+    compressed, flags = compression.compress(data)
+    suffix, method, version = compression.member()
+    if not method:
+        # Stored as is, as far as the zip file is concerned
+        data = compressed
+    fields = (version, flags, method, zlib.crc32(data), len(data))
+    return f"{name}{suffix}".encode(), compressed, fields
+
+
+def train_zdict(packs: List[Dict[str, np.ndarray]], size: int = 32768) -> bytes:
+    """Build a zlib preset dictionary from a sample of packs. zlib can't train one, so
+    the dictionary is made of what the packs have in common: the .npy headers of the
+    variables, preceded by the data of the latest packs. zlib finds the strings at the
+    end of the dictionary at the shortest distances.
+
+    Args:
+        packs: dicts of variable-array pairs, the latest last
+        size: the maximum size of the dictionary. zlib uses up to 32 KB
+
+    Returns:
+        zdict: the preset dictionary
+    """
+    headers = {}
+    data = []
+    for pack in packs:
+        for array in map(np.asanyarray, pack.values()):
+            buf = io.BytesIO()
+            np.lib.format.write_array(buf, array, allow_pickle=False)
+            member = buf.getvalue()
+            split = len(member) - array.nbytes
+            headers[member[:split]] = None
+            data.append(member[split:])
+    headers = b"".join(headers)[-size:]
+    # The data of the latest packs fill the rest of the dictionary
+    room = size - len(headers)
+    data = b"".join(data)[-room:] if room else b""
+    return data + headers
+
+
+def saved_files(dest: Union[str, Path], grouped: bool) -> str:
+    """The glob pattern of the files saved for a device, of any group and date
+
+    Args:
+        dest: the destination path template, with {group} and {date} placeholders
+        grouped: whether the data are grouped
+
+    Returns:
+        pattern: a glob pattern, e.g. "data/4001/*/*.npz"
+    """
+    pattern = str(dest).replace("{group}", "*" if grouped else "")
+    return re.sub(r"\{[^{}]*\}", "*", pattern)
+
+
+def save_zdict(directory: Union[str, Path], zdict: bytes) -> Path:
+    """Save a preset dictionary to a directory of dictionaries, under a name made of its
+    id, and make it the current one. Saved dictionaries are never overwritten, since
+    the files compressed with them can't be read without them.
+
+    Args:
+        directory: the directory of dictionaries
+        zdict: the preset dictionary
+
+    Returns:
+        path: the dictionary file
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    zdict_id = f"{zlib.adler32(zdict):08x}"
+    path = directory / f"{zdict_id}.zdict"
+    if not path.exists():
+        tmp_file = path.with_suffix(".tmp")
+        tmp_file.write_bytes(zdict)
+        tmp_file.rename(path)
+    # Only the pointer to the current dictionary is replaced
+    tmp_file = directory / "current.tmp"
+    tmp_file.write_text(zdict_id)
+    tmp_file.rename(directory / "current")
+    return path
+
+
+def find_zdict(
+    zdicts: Union[bytes, str, Path, Mapping[int, bytes]], zdict_id: Optional[int] = None
+) -> Optional[bytes]:
+    """Find a preset dictionary by its id
+
+    Args:
+        zdicts: a dictionary, a directory of dictionaries saved by save_zdict(), or a
+            dict of ids and dictionaries
+        zdict_id: the Adler-32 checksum of the dictionary, or None for the current
+            dictionary of a directory (default: None)
+
+    Returns:
+        zdict: the dictionary, or None if it isn't found
+    """
+    if isinstance(zdicts, bytes):
+        zdict = zdicts
+    elif isinstance(zdicts, Mapping):
+        zdict = zdicts.get(zdict_id)
+    else:
+        if zdict_id is None:
+            current = Path(zdicts) / "current"
+            if not current.exists():
+                return None
+            zdict_id = int(current.read_text(), 16)
+        path = Path(zdicts) / f"{zdict_id:08x}.zdict"
+        zdict = path.read_bytes() if path.exists() else None
+    if zdict is None or (zdict_id is not None and zlib.adler32(zdict) != zdict_id):
+        return None
+    return zdict
+
+
+def load_npz(
+    path: Union[str, Path, BinaryIO],
+    zdicts: Union[None, bytes, str, Path, Mapping[int, bytes]] = None,
+) -> Dict[str, np.ndarray]:
+    """Load the variables from an .npz file saved by the parser, including the files
+    compressed with a preset dictionary, which np.load() can't decompress
+
+    Args:
+        path: the file
+        zdicts: the preset dictionary the file was saved with, a directory of
+            dictionaries saved by save_zdict(), or a dict of ids and dictionaries.
+            The dictionary is looked up by the id stored in the file (default: None)
+
+    Returns:
+        arrays: a dict of variable-array pairs
+
+    Raises:
+        ValueError: if the preset dictionary of the file isn't found
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as z:
+        for name in z.namelist():
+            data = z.read(name)
+            if name.endswith(".z"):
+                # The id of the dictionary follows the two bytes of the zlib header
+                (zdict_id,) = struct.unpack(">L", data[2:6])
+                zdict = find_zdict(zdicts, zdict_id) if zdicts is not None else None
+                if zdict is None:
+                    raise ValueError(
+                        f"{name} needs the preset dictionary {zdict_id:08x}"
+                    )
+                data = zlib.decompressobj(zdict=zdict).decompress(data)
+                name = name[: -len(".z")]
+            array = np.lib.format.read_array(io.BytesIO(data), allow_pickle=False)
+            arrays[name[: -len(".npy")]] = array
+    return arrays
+
+
+def decode_fixed(arrays: Mapping[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Convert the fixed-point variables of a saved file back to float64, the same
+    values as the device output. The missing values are NaN with missing = fill.
+
+    Args:
+        arrays: a dict of variable-array pairs, e.g. from np.load() or load_npz()
+
+    Returns:
+        arrays: a dict of variable-array pairs, without "_fixed_vars" and
+            "_fixed_decimals"
+    """
+    arrays = dict(arrays)
+    fixed = arrays.pop("_fixed_vars", np.array([])).tolist()
+    decimals = arrays.pop("_fixed_decimals", np.array([])).tolist()
+    missing_vars = arrays.get("_missing_vars", np.array([])).tolist()
+    for var, places in zip(fixed, decimals):
+        # Dividing by an exact power of ten rounds the same way as float() does
+        values = arrays[var] / 10 ** places
+        if var in missing_vars:
+            bit = np.uint64(1 << missing_vars.index(var))
+            values[arrays["_missing"].astype(np.uint64) & bit != 0] = np.nan
+        arrays[var] = values
+    return arrays
+
+
+def save_npz(
+    f: BinaryIO,
+    arrays: Dict[str, np.ndarray],
+    compression: Optional[Compression] = None,
+    pool: Optional[Executor] = None,
+) -> None:
+    """Save the arrays to an .npz file, like np.savez_compressed(), but with any of
+    the codecs, and optionally compressing the arrays in parallel. The codecs release
+    the GIL, so the threads of the pool make use of several cores.
+
+    Args:
+        f: a file opened for writing in binary mode
+        arrays: a dict of variable-array pairs
+        compression: the codec and the level to compress with, or None for zlib at
+            the default level (default: None)
+        pool: the workers to compress the arrays with, or None to compress them one
+            after another (default: None)
+
+    Raises:
+        ValueError: if an array is too large for a zip file without ZIP64 extensions
+    """
+    # The modification time of the members in the MS-DOS format
+    now = time.localtime()
+    dos_time = now.tm_hour << 11 | now.tm_min << 5 | now.tm_sec // 2
+    dos_date = (now.tm_year - 1980) << 9 | now.tm_mon << 5 | now.tm_mday
+
+    compression = compression or Compression()
+    compress = partial(_compress_member, compression=compression)
+    members = (pool.map if pool is not None else map)(compress, *zip(*arrays.items()))
+
+    directory = []
+    offset = 0
+    for filename, compressed, (version, flags, method, crc, size) in members:
+        if max(size, len(compressed), offset) >= 0xFFFFFFFF:
+            raise ValueError(f"{filename.decode()} is too large to save")
+        fields = (
+            version,
+            flags,
+            method,
+            dos_time,
+            dos_date,
+            crc,
+            len(compressed),
+            size,
+        )
+        header = _zip_local.pack(b"PK\x03\x04", *fields, len(filename), 0)
+        f.write(header + filename)
+        f.write(compressed)
+        directory.append((filename, fields, offset))
+        offset += len(header) + len(filename) + len(compressed)
+
+    # The id of the preset dictionary, if any, is recorded in the zip file comment
+    comment = b""
+    if compression.zdict is not None:
+        comment = b"zdict=%08x" % compression.zdict_id
+    _write_zip_directory(f, directory, offset, comment)
+
+
+def _write_zip_directory(
+    f: BinaryIO,
+    directory: List[Tuple[bytes, Tuple[int, ...], int]],
+    offset: int,
+    comment: bytes = b"",
+) -> None:
+    """Write the central directory and the end record of a zip file
+
+    Args:
+        f: the file, positioned after the last member
+        directory: the name, the local header fields from the version to the
+            uncompressed size, and the offset of each member
+        offset: the position of the file
+        comment: the zip file comment
+    """
+    start = offset
+    for filename, fields, member_offset in directory:
+        # Made by Unix, readable and writable by the owner only, as with zipfile
+        attributes = (len(filename), 0, 0, 0, 0, 0o600 << 16, member_offset)
+        header = _zip_central.pack(b"PK\x01\x02", 3 << 8 | 20, *fields, *attributes)
+        f.write(header + filename)
+        offset += len(header) + len(filename)
+
+    count = len(directory)
+    f.write(
+        _zip_end.pack(
+            b"PK\x05\x06", 0, 0, count, count, offset - start, start, len(comment)
+        )
+    )
+    f.write(comment)
 
 
 class Parser:
@@ -307,23 +2440,190 @@ class Parser:
         group: Group,
         pack_length: int,
         dest: Union[str, Path],
+        date_from_data: bool = False,
+        sample_rate: Optional[float] = None,
+        columnar: bool = False,
+        dtypes: Optional[Dict[str, np.dtype]] = None,
+        missing: str = "reject",
+        message_format: Optional[Format] = None,
+        deferred: bool = False,
+        pending_packs: int = 0,
+        compress_workers: int = 1,
+        compression: Optional[Compression] = None,
+        pack_duration: Optional[float] = None,
+        checkpoint_dir: Optional[Union[str, Path]] = None,
+        coalesce: Optional[str] = None,
+        decimals: Optional[Dict[str, Optional[int]]] = None,
+        measurements: Optional[Metrics] = None,
     ) -> None:
         """Initialize the parser
 
         Args:
-            regex: regular expression for variable extraction
+            regex: regular expression for variable extraction, unless another
+                message_format is used
             group: an instance of Group, containing group_by related settings
             pack_length: the number of records to save in each file
             dest: the target filename where to save the data, with an optional
                 "{date}" placeholder for the current date and time.
+            date_from_data: use the time of the last record in a file for the "{date}"
+                placeholder instead of the current time, e.g. when processing
+                recorded data (default: False)
+            sample_rate: the sampling rate of the device in Hz. If set, the sampling
+                times are reconstructed from the message timestamps, see
+                regularize_time() (default: None)
+            columnar: buffer the data in preallocated NumPy arrays instead of lists,
+                see ColumnarBuffer (default: False)
+            dtypes: the data types to save the variables with, by variable name. An
+                integer type for "time" stores nanoseconds. Other variables are saved as
+                float64 (default: None)
+            missing: what to do with the messages where some variables are missing,
+                i.e. their capture groups don't match, or their values are empty or
+                "///". Either "reject" the message, or "fill" the missing values with
+                NaN (0 for integer types) and mark them in the "_missing" bitmask of
+                the record. Bit i stands for the i-th variable of the message, except
+                for group_by, as saved in "_missing_vars" (default: "reject")
+            message_format: an instance of Format, to split the messages without a
+                regex (default: None)
+            deferred: buffer the raw values, and convert them a column at a time when
+                a pack is saved. The records with invalid values are dropped then.
+                Not supported with columnar (default: False)
+            pending_packs: if greater than 0, save the full packs in a background
+                thread, see BackgroundWriter. Writing blocks while this many packs
+                wait to be saved. Call close() to wait for them (default: 0)
+            compress_workers: if greater than 1, compress the variables of each pack
+                in parallel with this many threads, see save_npz() (default: 1)
+            compression: an instance of Compression, the codec and the level to save
+                the variables with (default: None, i.e. zlib at the default level)
+            pack_duration: save the records of a group after this many seconds, even if
+                there are fewer than pack_length of them. Checked on every write and
+                flush() (default: None)
+            checkpoint_dir: if set, buffer the data in memory-mapped files in this
+                directory, see MappedBuffer, and continue with the records buffered
+                there by a previous run. Implies columnar (default: None)
+            coalesce: collect the packs into a single file per "hour" or "day", see
+                Coalescer. The containers left over by a previous run are sealed
+                right away (default: None)
+            decimals: the number of decimals of the variables to save as fixed-point
+                int32, by variable name, or None to count them in the values, see
+                _detect_decimals(). The scales are saved in "_fixed_vars" and
+                "_fixed_decimals", see decode_fixed() (default: None)
+            measurements: where to record "flush_latency", e.g. separately for each
+                device (default: None, i.e. the metrics of the process)
         """
         self.regex = regex
         self.group = group
         self.dest = dest
-        self._buffer = Buffer(pack_length, group.by)
-        # Convert all variables to float, except for the group.by variable, if any
+        self.date_from_data = date_from_data
+        self.sample_rate = sample_rate
+        self.dtypes = dict(dtypes or {})
+        self.format = message_format or Format()
+        self.deferred = deferred
+        self.compression = compression or Compression()
+        # The fixed-point variables are integers scaled by 10 ** decimals
+        self.decimals = dict(decimals or {})
+        for var in self.decimals:
+            self.dtypes[var] = np.dtype(np.int32)
+
+        # The names of the variables, in the order of the message
+        if self.format.kind == "regex":
+            self.variables = list(re.compile(regex).groupindex)
+        else:
+            self.variables = list(self.format.fields)
+
+        # The fill values of all saved variables, in the order of the message
+        self._fill = None
+        if missing == "fill":
+            self._fill = {
+                var: 0 if self.dtypes.get(var, np.dtype(float)).kind in "iu" else np.nan
+                for var in self.variables
+                if var != group.by
+            }
+            self.dtypes["_missing"] = np.min_scalar_type((1 << len(self._fill)) - 1)
+
+        if checkpoint_dir:
+            self._buffer = MappedBuffer(
+                checkpoint_dir, pack_length, group.by, self.dtypes, pack_duration
+            )
+        elif columnar:
+            self._buffer = ColumnarBuffer(
+                pack_length, group.by, self.dtypes, pack_duration
+            )
+        else:
+            self._buffer = Buffer(pack_length, group.by, pack_duration)
+        # Convert all variables to float, except for the group.by variable, if any,
+        # and the variables stored as integers
         self._cast = defaultdict(lambda: float)
+        for var, dtype in self.dtypes.items():
+            if dtype.kind in "iu":
+                self._cast[var] = integer_cast(dtype)
+        # Until the decimals are counted, only the invalid values are left to convert
+        for var, places in self.decimals.items():
+            self._cast[var] = fixed_cast(places or 0)
+        self._auto = {var for var, places in self.decimals.items() if places is None}
         self._cast[group.by] = group.cast
+        self._time_ns = self.dtypes.get("time", np.dtype(float)).kind == "i"
+        self._split = self._compile_splitter()
+        # For matching many messages at once, anchored to the beginning of the lines
+        self._multiline = None
+        if self.format.kind == "regex" and self.variables:
+            try:
+                self._multiline = re.compile(b"^(?:%s)" % regex, re.MULTILINE)
+            except re.error:
+                # E.g. global flags must be at the beginning of the pattern
+                pass
+        self._convert = self._compile_converter()
+        # The sequence numbers of the first buffered message of each group
+        self._pending = {}
+        self.metrics = measurements or metrics
+        self._writer = None
+        if pending_packs:
+            self._writer = BackgroundWriter(pending_packs, self.metrics)
+        self._compressors = None
+        if compress_workers > 1:
+            self._compressors = ThreadPoolExecutor(max_workers=compress_workers)
+        self._coalescer = None
+        if coalesce:
+            self._coalescer = Coalescer(coalesce, self._write_npz)
+            # Any group and date, for this device only
+            self._coalescer.recover(saved_files(self.dest, bool(group.by)) + ".tmp")
+        if checkpoint_dir:
+            self._resume()
+
+    @classmethod
+    def from_config(cls, conf: argparse.Namespace, **kwargs) -> "Parser":
+        """Initialize the Parser based on the loaded config file settings
+
+        Args:
+            conf: all of the loaded config file settings for the device
+            kwargs: additional arguments to the Parser, e.g. date_from_data, which
+                override the settings
+
+        Returns:
+            parser: an initialized instance of Parser
+        """
+        options = dict(
+            sample_rate=conf.sample_rate,
+            columnar=conf.columnar,
+            dtypes=conf.dtypes,
+            missing=conf.missing,
+            message_format=conf.format,
+            deferred=conf.deferred,
+            pending_packs=conf.pending_packs,
+            compress_workers=conf.compress_workers,
+            compression=conf.compression,
+            pack_duration=conf.pack_duration,
+            checkpoint_dir=conf.checkpoint_dir,
+            coalesce=conf.coalesce,
+            decimals=conf.decimals,
+        )
+        options.update(kwargs)
+        return cls(
+            conf.regex,
+            conf.group,
+            conf.pack_length,
+            Path(conf.dest_dir) / conf.filename,
+            **options,
+        )
 
     def extract(self, item: Item) -> Dict[str, Any]:
         """Extract variables from the binary device data
@@ -337,21 +2637,22 @@ class Parser:
 
         Raises:
             AttributeError: when no match is found by the regex
-            ValueError or UnicodeDecodeError: type conversion of extracted values fails
+            IndexError or KeyError: when a csv message has too few columns, or a kv
+                message has none of the keys
+            ValueError or UnicodeDecodeError: type conversion of extracted values
+                fails, or some values are missing unless missing = fill
             re.error: for other types of regex errors
         """
 
         try:
-            match = re.match(self.regex, item.data)
-            # Collect the results, converting to appropriate data types and filtering out
-            # capture groups that didn't match
-            extracted = {
-                key: self._cast[key](value)
-                for key, value in match.groupdict().items()
-                if value is not None and value != b"///"
-            }
-        except AttributeError as e:
-            # The regex pattern produced no match
+            values = self._split(item.data)
+            if self._auto:
+                self._detect_decimals([values])
+            extracted = self._convert(values)
+            if extracted is None:
+                raise ValueError(f"Missing values in the message: {item.data}")
+        except (AttributeError, IndexError, KeyError) as e:
+            # The message doesn't match the format
             if item.fresh_connection:
                 # We expect the very first message received upon establishing
                 # a connection to be incomplete quite often.
@@ -363,17 +2664,237 @@ class Parser:
             logging.error(e)
             raise ParseError(e)
         else:
-            extracted["time"] = item.timestamp
-            logging.debug(f"Got {extracted}")
+            if self._time_ns:
+                # Convert the whole seconds separately to avoid rounding errors
+                seconds = int(item.timestamp)
+                nanoseconds = round((item.timestamp - seconds) * 1e9)
+                extracted["time"] = seconds * 1_000_000_000 + nanoseconds
+            else:
+                extracted["time"] = item.timestamp
+            # Formatted lazily, since this is called for every message
+            logging.debug("Got %s", extracted)
 
         return extracted
 
-    def write(self, extracted: Dict[str, Any]) -> None:
+    def _compile_splitter(self) -> Callable[[bytes], Tuple[Optional[bytes], ...]]:
+        """Create a function that splits a message into the values of the variables
+
+        Returns:
+            split: a function taking a message and returning the raw values of the
+                variables, or None for the missing ones
+        """
+        names = self.variables
+        if self.format.kind == "regex":
+            pattern = re.compile(self.regex)
+            if len(names) == 1:
+                return lambda data: (pattern.match(data).group(names[0]),)
+            if names:
+                return lambda data: pattern.match(data).group(*names)
+            return lambda data: pattern.match(data).groups()
+
+        delimiter = self.format.delimiter
+        if self.format.kind == "csv":
+            columns = list(self.format.fields.values())
+            if len(columns) == 1:
+                return lambda data: (data.rstrip(b"\r\n").split(delimiter)[columns[0]],)
+            fields = itemgetter(*columns)
+            return lambda data: fields(data.rstrip(b"\r\n").split(delimiter))
+
+        separator = self.format.separator
+        keys = list(self.format.fields.values())
+
+        def split(data: bytes) -> Tuple[Optional[bytes], ...]:
+            pairs = dict(
+                field.strip().partition(separator)[::2]
+                for field in data.split(delimiter)
+            )
+            values = tuple(map(pairs.get, keys))
+            if values.count(None) == len(values):
+                raise KeyError(f"none of the keys found in {data}")
+            return values
+
+        return split
+
+    def _detect_decimals(
+        self, rows: List[Optional[Tuple[Optional[bytes], ...]]]
+    ) -> None:
+        """Count the decimals of the fixed-point variables with decimals = auto, taking
+        the most decimals in the first messages where they are present, and more
+        decimals whenever a value has them. The buffered records are saved with the
+        previous decimals first, so that the scale is the same throughout each file.
+
+        Args:
+            rows: the raw values of each message, or None if it doesn't match
+        """
+        detected = {}
+        for i, var in enumerate(self.variables):
+            if var not in self._auto:
+                continue
+            counts = [count_decimals(row[i]) for row in rows if row is not None]
+            # Values with more decimals don't fit int32 anyway, and are rejected
+            places = max(
+                (count for count in counts if count in range(10)), default=None
+            )
+            current = self.decimals[var]
+            if places is not None and (current is None or places > current):
+                detected[var] = places
+        if not detected:
+            return
+
+        if any(self.decimals[var] is not None for var in detected):
+            self.flush(partial=True)
+            if self._writer is not None:
+                self._writer.drain()
+        for var, places in detected.items():
+            logging.info(f"Saving {var} as fixed-point with {places} decimals")
+            self.decimals[var] = places
+            self._cast[var] = fixed_cast(places)
+        self._convert = self._compile_converter()
+
+    def _compile_converter(self) -> Callable[[Any], Optional[Dict[str, Any]]]:
+        """Generate a function that converts the raw values of the variables, with the
+        variables and their conversions unrolled.
+
+        Without missing = fill, the function returns None if some of the variables are
+        missing, see MISSING_VALUES. With deferred conversion, only the group_by
+        variable is converted.
+
+        Returns:
+            convert: a function taking the output of the splitter and returning a dict
+                of variable-value pairs in the order of the message, excluding the
+                timestamp
+        """
+        names = self.variables
+        namespace = {f"cast{i}": self._cast[name] for i, name in enumerate(names)}
+        namespace["MISSING_VALUES"] = MISSING_VALUES
+        values = [f"value{i}" for i in range(len(names))]
+
+        lines = ["def convert(values):"]
+        if names:
+            lines.append(f"    {', '.join(values)}, = values")
+
+        if self.deferred:
+            items = [
+                f"{name!r}: cast{i}(value{i})"
+                if name == self.group.by
+                else f"{name!r}: value{i}"
+                for i, name in enumerate(names)
+            ]
+        elif self._fill is None:
+            if names:
+                missing = " or ".join(
+                    f"{value} is None or {value} in MISSING_VALUES" for value in values
+                )
+                lines.append(f"    if {missing}:")
+                lines.append("        return None")
+            items = [f"{name!r}: cast{i}(value{i})" for i, name in enumerate(names)]
+        else:
+            lines.append("    missing = 0")
+            bits = {name: bit for bit, name in enumerate(self._fill)}
+            items = []
+            for i, name in enumerate(names):
+                if name == self.group.by:
+                    items.append(f"{name!r}: cast{i}(value{i})")
+                    continue
+                namespace[f"fill{i}"] = self._fill[name]
+                lines.extend(
+                    [
+                        f"    if value{i} is None or value{i} in MISSING_VALUES:",
+                        f"        value{i} = fill{i}",
+                        f"        missing |= {1 << bits[name]}",
+                        "    else:",
+                        f"        value{i} = cast{i}(value{i})",
+                    ]
+                )
+                items.append(f"{name!r}: value{i}")
+            items.append("'_missing': missing")
+        lines.append(f"    return {{{', '.join(items)}}}")
+
+        exec("\n".join(lines), namespace)
+        return namespace["convert"]
+
+    @property
+    def watermark(self) -> Optional[int]:
+        """The sequence number of the oldest buffered message that has not been saved
+        to disk yet, or None if there are no such messages.
+        """
+        seqs = list(self._pending.values())
+        if self._writer is not None:
+            seqs.extend(self._writer.seqs)
+        return min(seqs, default=None)
+
+    @property
+    def pending_packs(self) -> int:
+        """The number of full packs waiting to be saved by the background writer"""
+        return self._writer.pending if self._writer is not None else 0
+
+    def _resume(self) -> None:
+        """Continue with the records in the checkpoint files of a previous run, saving
+        those that have been buffered with different settings, and the full packs
+        that hadn't been cleared"""
+        variables = set(self.variables) - {self.group.by} | {"time"}
+        if self._fill is not None:
+            variables.add("_missing")
+        stale = self._buffer.resume(variables)
+        for group_value, vectors in stale.items():
+            try:
+                self._save(group_value, vectors, datetime.utcnow())
+            except ParseError:
+                pass
+        # E.g. a power loss between saving a pack and clearing it. A full pack would
+        # reject every message.
+        try:
+            self._save_full()
+        except ParseError:
+            pass
+
+    def flush(self, partial: bool = False) -> None:
+        """Save the groups that are due to be saved, e.g. when no messages arrive for a
+        while. Saving errors are logged.
+
+        Args:
+            partial: save all of the buffered records, e.g. on shutdown (default: False)
+        """
+        try:
+            self._save_full(partial)
+        except ParseError:
+            pass
+
+        if self._coalescer is not None:
+            # After the packs handed over to the background writer, if any
+            if partial:
+                self._in_order(self._coalescer.seal_all)
+            elif not self.date_from_data:
+                self._in_order(self._coalescer.seal_due, datetime.utcnow())
+
+    def _in_order(self, func: Callable[..., None], *args: Any) -> None:
+        """Call a function after the packs handed over to the background writer have
+        been saved
+
+        Args:
+            func: the function to call
+            args: the arguments to the function
+        """
+        if self._writer is not None:
+            self._writer.submit(func, *args)
+        else:
+            func(*args)
+
+    def close(self) -> None:
+        """Wait for the background writer to save the full packs, if any, and stop
+        the threads of the parser"""
+        if self._writer is not None:
+            self._writer.close()
+        if self._compressors is not None:
+            self._compressors.shutdown(wait=True)
+
+    def write(self, extracted: Dict[str, Any], seq: Optional[int] = None) -> None:
         """Write the extracted variables to an internal buffer, which is saved to disk
         when pack_length is reached.
 
         Args:
             extracted: a dict of variable-value pairs, i.e. the output of extract()
+            seq: the sequence number of the message in the journal, if any (default: None)
 
         Raises:
             AssertionError: if the supplied variables differ from those previously saved
@@ -385,42 +2906,432 @@ class Parser:
             logging.error(e)
             raise ParseError(e)
 
-        # Save the data to disk when the packing limit is reached
-        for group_value, vectors in self._buffer.full():
-            try:
-                # Make sure the destination directory exists
-                group = group_value if group_value is not None else ""
-                target = Path(
-                    str(self.dest).format(group=group, date=datetime.utcnow())
+        if seq is not None:
+            # Remember the oldest message of the group for committing the journal
+            self._pending.setdefault(extracted.get(self.group.by), seq)
+
+        self._save_full()
+
+    def extract_many(
+        self, items: List[Item]
+    ) -> Tuple[Dict[str, np.ndarray], List[int]]:
+        """Extract variables from a batch of messages at once. Regular expressions are
+        matched in one pass over the joined messages, and the values are converted
+        to arrays a column at a time.
+
+        The records are the same as those of extract() for each message.
+
+        Args:
+            items: the messages to parse, in the order they were received
+
+        Returns:
+            columns: a dict of variable-array pairs with the values of the parsed
+                messages, including the timestamps
+            failed: the indices of the messages that couldn't be parsed. The errors
+                are logged.
+        """
+        rows = self._split_many(items)
+        if self._auto:
+            self._detect_decimals(rows)
+        failed = np.array([values is None for values in rows], dtype=bool)
+        for i in np.flatnonzero(failed):
+            if items[i].fresh_connection:
+                logging.debug(f"Possibly incomplete first message: {items[i].data}")
+            else:
+                logging.error(f"Cannot parse the message: {items[i].data}")
+
+        raw = [values for values in rows if values is not None]
+        parsed = np.flatnonzero(~failed)
+        if self.deferred:
+            # Only the group_by variable is converted right away
+            columns = {
+                var: np.array(values, dtype=object)
+                for var, values in zip(self.variables, zip(*raw))
+            }
+            errors = np.zeros(len(raw), dtype=bool)
+            if self.group.by is not None and raw:
+                columns[self.group.by], errors = self._convert_many(
+                    columns[self.group.by], self.group.cast
                 )
-                target.parent.mkdir(parents=True, exist_ok=True)
+        else:
+            columns, errors = self._convert_columns(
+                dict(zip(self.variables, zip(*raw))), len(raw)
+            )
+
+        for i in np.flatnonzero(errors):
+            logging.error(
+                f"Cannot convert the values of the message: {items[parsed[i]].data}"
+            )
+        failed[parsed[errors]] = True
+
+        keep = ~errors
+        columns = {var: column[keep] for var, column in columns.items()}
+        timestamps = np.array([items[i].timestamp for i in parsed[keep]])
+        if self._time_ns:
+            # Convert the whole seconds separately to avoid rounding errors
+            seconds = np.floor(timestamps)
+            columns["time"] = seconds.astype(np.int64) * 1_000_000_000 + np.rint(
+                (timestamps - seconds) * 1e9
+            ).astype(np.int64)
+        else:
+            columns["time"] = timestamps
+        logging.debug("Got %d records", len(timestamps))
 
-                # Do not save the values of the group variable, record it as part of
-                # the filename only
-                vectors.pop(self.group.by, None)
+        return columns, np.flatnonzero(failed).tolist()
 
-                # Save the variables to a temporary file
-                tmp_file = target.with_suffix(".tmp")
-                with tmp_file.open(mode="wb") as f:
-                    np.savez_compressed(f, **vectors)
+    def _convert_columns(
+        self, raw: Dict[str, Iterable[Optional[bytes]]], count: int
+    ) -> Tuple[Dict[str, np.ndarray], np.ndarray]:
+        """Convert the raw values of the variables to arrays, a column at a time
 
-                # Rename to ".npz" to make `rsync --remove-source-files` safe
-                tmp_file.rename(target)
-            except Exception as e:
-                logging.error(
-                    f"Saving failed: {e}. "
-                    f"{self._buffer.pack_length:,} data points will be lost."
+        Args:
+            raw: the raw values of the variables, by variable name
+            count: the number of records
+
+        Returns:
+            columns: a dict of variable-array pairs, including the "_missing" bitmask
+                with missing = fill. The records that failed are filled with zeros.
+            errors: a boolean mask of the records that couldn't be converted, or have
+                missing values with missing = reject
+        """
+        columns = {}
+        errors = np.zeros(count, dtype=bool)
+        missing = np.zeros(count, dtype=np.uint64)
+        bits = {var: 1 << bit for bit, var in enumerate(self._fill or ())}
+        for var, values in raw.items():
+            if var == self.group.by:
+                columns[var], bad = self._convert_many(values, self.group.cast)
+                errors |= bad
+                continue
+
+            # Usually all of the values are present and valid
+            column = None
+            absent = np.zeros(count, dtype=bool)
+            # Missing values fail to convert
+            if None not in values:
+                try:
+                    column = np.fromiter(map(float, values), np.float64, count)
+                except ValueError:
+                    pass
+
+            if column is None:
+                # Missing values are either filled or rejected
+                if None in values:
+                    values = [b"" if value is None else value for value in values]
+                values = np.array(values, dtype=bytes)
+                absent = np.isin(values, MISSING_VALUES)
+                if absent.any():
+                    values = np.where(absent, b"nan", values)
+                    if self._fill is None:
+                        errors |= absent
+                    else:
+                        missing[absent] |= np.uint64(bits[var])
+
+                # Convert the whole column at once, unless some values are invalid
+                try:
+                    column = values.astype(np.float64)
+                except ValueError:
+                    column, bad = self._convert_many(values, float, np.float64)
+                    errors |= bad
+
+            if var in self.decimals:
+                # Scale to integers, rejecting the values with more decimals
+                column = column * 10 ** (self.decimals[var] or 0)
+                scaled = np.rint(column)
+                with np.errstate(invalid="ignore"):
+                    errors |= ~absent & ~(np.abs(column - scaled) <= 1e-6)
+                column = scaled
+
+            dtype = self.dtypes.get(var, np.dtype(float))
+            if dtype.kind in "iu":
+                info = np.iinfo(dtype)
+                column[absent] = 0
+                with np.errstate(invalid="ignore"):
+                    errors |= (column % 1 != 0) | (column < info.min)
+                    errors |= column > info.max
+                column[errors] = 0
+            columns[var] = column.astype(dtype)
+
+        if self._fill is not None:
+            columns["_missing"] = missing.astype(self.dtypes["_missing"])
+        return columns, errors
+
+    def _split_many(self, items: List[Item]) -> List[Optional[Tuple[bytes, ...]]]:
+        """Split a batch of messages into the raw values of the variables
+
+        Args:
+            items: the messages to split
+
+        Returns:
+            rows: the raw values of each message, or None if it doesn't match
+        """
+        rows = [None] * len(items)
+        if self._multiline is not None:
+            lines = [item.data for item in items]
+            joined = b"\n".join(lines)
+            names = self.variables
+            if self._multiline.groups == len(names):
+                # The matches start at the beginning of the lines. If every line
+                # matches, none of the matches can run into the next line.
+                found = self._multiline.findall(joined)
+                if len(found) == len(lines):
+                    return found if len(names) > 1 else [(value,) for value in found]
+
+            # Otherwise, accept only the matches that start at the beginning of
+            # a message and don't run into the next one
+            starts = dict()
+            position = 0
+            for i, line in enumerate(lines):
+                starts[position] = i
+                position += len(line) + 1
+            for match in self._multiline.finditer(joined):
+                i = starts.get(match.start())
+                if i is not None and match.end() - match.start() <= len(lines[i]):
+                    values = match.group(*names)
+                    rows[i] = values if len(names) > 1 else (values,)
+
+        # Check the rest one by one, e.g. for patterns that depend on the line ends
+        for i, item in enumerate(items):
+            if rows[i] is None:
+                try:
+                    rows[i] = self._split(item.data)
+                except (AttributeError, IndexError, KeyError):
+                    pass
+        return rows
+
+    @staticmethod
+    def _convert_many(
+        values: np.ndarray, cast: Callable[[bytes], Any], dtype: Any = object
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Convert the values one by one, noting the ones that fail
+
+        Args:
+            values: the raw values
+            cast: the conversion function
+            dtype: the data type of the result (default: object)
+
+        Returns:
+            converted: the converted values, with zeros in place of the failed ones
+            failed: a boolean mask of the values that couldn't be converted
+        """
+        converted = np.zeros(len(values), dtype=dtype)
+        failed = np.zeros(len(values), dtype=bool)
+        for i, value in enumerate(values):
+            try:
+                converted[i] = cast(value)
+            except Exception:
+                failed[i] = True
+        return converted, failed
+
+    def write_many(
+        self, columns: Dict[str, np.ndarray], seqs: Optional[np.ndarray] = None
+    ) -> None:
+        """Write a batch of records to the internal buffer, saving the packs to disk as
+        they fill up. Saving errors are logged, and the rest of the batch is written.
+
+        Args:
+            columns: a dict of variable-array pairs, i.e. the output of extract_many()
+            seqs: the sequence numbers of the records in the journal, if any
+                (default: None)
+
+        Raises:
+            ParseError: if the supplied variables differ from those previously saved
+        """
+        if not len(columns["time"]):
+            return
+
+        if self.group.by is None:
+            groups = [slice(None)]
+        else:
+            values = columns[self.group.by]
+            groups = [values == value for value in dict.fromkeys(values.tolist())]
+
+        for rows in groups:
+            group = {var: column[rows] for var, column in columns.items()}
+            if seqs is not None:
+                group_seqs = seqs[rows]
+            start = 0
+            while start < len(group["time"]):
+                chunk = {var: column[start:] for var, column in group.items()}
+                try:
+                    count = self._buffer.put_many(chunk)
+                except AssertionError as e:
+                    logging.error(e)
+                    raise ParseError(e)
+                if seqs is not None and count:
+                    group_value = chunk[self.group.by][0] if self.group.by else None
+                    self._pending.setdefault(group_value, int(group_seqs[start]))
+                start += count
+                try:
+                    self._save_full()
+                except ParseError:
+                    pass
+
+    def _convert_deferred(self, vectors: Dict[str, List[Any]]) -> Dict[str, np.ndarray]:
+        """Convert the buffered raw values of a pack, dropping the invalid records
+
+        Args:
+            vectors: a dict of variable-list pairs from the buffer
+
+        Returns:
+            vectors: a dict of variable-array pairs, without the group_by variable
+        """
+        raw = {
+            var: values
+            for var, values in vectors.items()
+            if var not in (self.group.by, "time")
+        }
+        count = len(vectors["time"])
+        columns, errors = self._convert_columns(raw, count)
+        columns["time"] = np.asarray(vectors["time"], dtype=self.dtypes.get("time"))
+        if errors.any():
+            logging.error(
+                f"Dropped {np.count_nonzero(errors):,} of {count:,} records "
+                f"with invalid values"
+            )
+            columns = {var: column[~errors] for var, column in columns.items()}
+        return columns
+
+    def _save_full(self, partial: bool = False) -> None:
+        """Save the groups that have reached the packing limit or pack_duration to
+        disk, or hand them over to the background writer
+
+        Args:
+            partial: save all of the groups that have any records (default: False)
+
+        Raises:
+            ParseError: for filesystem-related and NumPy issues
+        """
+        # Taking the groups from the buffer modifies it
+        for group_value, vectors in list(self._buffer.full(partial)):
+            if self._writer is not None:
+                # Parsing continues into a new buffer of the group
+                self._writer.submit(
+                    self._save,
+                    group_value,
+                    self._buffer.pop(group_value),
+                    datetime.utcnow(),
+                    seq=self._pending.pop(group_value, None),
                 )
-                raise ParseError(e)
-            else:
-                logging.info(f"Data saved to '{target}'")
+                continue
+
+            started = time.monotonic()
+            try:
+                self._save(group_value, vectors, datetime.utcnow())
             finally:
                 # Reset the in-memory storage
                 self._buffer.clear(group_value)
+                self._pending.pop(group_value, None)
+                self.metrics.observe("flush_latency", time.monotonic() - started)
+
+    def _save(self, group_value: Any, vectors: Dict[str, Any], now: datetime) -> None:
+        """Save a full pack of a group to disk
+
+        Args:
+            group_value: the value of the group
+            vectors: a dict of variable-list (or array) pairs from the buffer, which
+                are left intact
+            now: the time the pack became full, for the "{date}" placeholder unless
+                date_from_data is set
+
+        Raises:
+            ParseError: for filesystem-related and NumPy issues
+        """
+        try:
+            # Do not save the values of the group variable, record it as part of
+            # the filename only.
+            if self.deferred:
+                vectors = self._convert_deferred(vectors)
+                if not len(vectors["time"]):
+                    return
+            else:
+                vectors = {
+                    var: np.asarray(values, dtype=self.dtypes.get(var))
+                    for var, values in vectors.items()
+                    if var != self.group.by
+                }
+            seconds = vectors["time"] / 1e9 if self._time_ns else vectors["time"]
+            if self._fill is not None:
+                vectors["_missing_vars"] = np.array(list(self._fill))
+            if self.decimals:
+                vectors["_fixed_vars"] = np.array(list(self.decimals))
+                vectors["_fixed_decimals"] = np.array(
+                    [places or 0 for places in self.decimals.values()], dtype=np.uint8
+                )
+
+            # Make sure the destination directory exists
+            group = group_value if group_value is not None else ""
+            if self.date_from_data:
+                date = datetime.utcfromtimestamp(seconds[-1])
+            else:
+                date = now
+            target = Path(str(self.dest).format(group=group, date=date))
+            target.parent.mkdir(parents=True, exist_ok=True)
+
+            if self.sample_rate:
+                vectors.update(regularize_time(seconds, self.sample_rate))
+                if self._time_ns:
+                    vectors["time_regular"] = np.rint(
+                        vectors["time_regular"] * 1e9
+                    ).astype(vectors["time"].dtype)
+
+            if self._coalescer is not None:
+                self._coalescer.add(group_value, target, date, vectors)
+                return
+            self._write_npz(target, vectors)
+        except Exception as e:
+            logging.error(
+                f"Saving failed: {e}. "
+                f"{len(vectors['time']):,} data points will be lost."
+            )
+            raise ParseError(e)
+        else:
+            logging.info(f"Data saved to '{target}'")
+
+    def _write_npz(self, target: Path, vectors: Dict[str, np.ndarray]) -> None:
+        """Save the variables to an .npz file with the configured compression
+
+        Args:
+            target: the .npz file
+            vectors: a dict of variable-array pairs
+        """
+        # Save the variables to a temporary file
+        tmp_file = target.with_suffix(".tmp")
+        with tmp_file.open(mode="wb") as f:
+            if self._compressors is None and self.compression == Compression():
+                np.savez_compressed(f, **vectors)
+            else:
+                save_npz(f, vectors, self.compression, self._compressors)
+
+        # Rename to ".npz" to make `rsync --remove-source-files` safe
+        tmp_file.rename(target)
+
+
+def send(queue: Queue, obj: Union[Item, List[Item]]) -> None:
+    """Pass a message or a batch of messages to the parser process without blocking.
+    If the queue is full, shut down.
+
+    Args:
+        queue: a multiprocessing queue to send data to
+        obj: an Item or a list of Items
+    """
+    try:
+        queue.put(obj, block=False)
+    except Full:
+        logging.error("Queue is full, real-time data collection impossible. Exiting.")
+        shutdown.set()
 
 
 def listen_device(
-    queue: Queue, host: str, port: int, timeout: Optional[float] = None
+    queue: Queue,
+    host: str,
+    port: int,
+    timeout: Optional[float] = None,
+    batch_size: int = 1,
+    batch_latency: float = 0.1,
+    spill_file: Optional[Union[str, Path]] = None,
+    journal: Optional[Journal] = None,
+    kernel_timestamps: bool = False,
 ) -> None:
     """Receive messages from the device over a TCP socket and queue them
     for parallel processing.
@@ -430,68 +3341,322 @@ def listen_device(
         host: IP address of the device
         port: integer port number to listen to
         timeout: a timeout in seconds for connecting and reading data (default: None)
+        batch_size: if greater than 1, send lists of up to batch_size messages at a
+            time instead of individual messages (default: 1)
+        batch_latency: the maximum number of seconds a message may wait in a partially
+            filled batch (default: 0.1)
+        spill_file: if set, messages that don't fit into the queue are written to
+            this file and replayed later (default: None)
+        journal: if set, append every message to the write-ahead journal before
+            sending it (default: None)
+        kernel_timestamps: timestamp the messages with the time the kernel received
+            them instead of the time they were read. The difference between the two is
+            reported as the "timestamp_delay" metric (default: False)
     """
-    with TCPClient(host, port, timeout) as client:
+    if spill_file:
+        if journal is not None and Path(spill_file).exists():
+            # The spilled messages have been journaled, and will be replayed by the
+            # parser from the journal
+            Path(spill_file).unlink()
+        queue = SpillQueue(queue, spill_file)
+        metrics.watch("spilled_bytes", lambda: queue.spilled)
+
+    batch = []
+    deadline = None
+    with TCPClient(host, port, timeout, kernel_timestamps=kernel_timestamps) as client:
         # Establish socket connection to the device
         client.connect()
 
         while not shutdown.is_set():
+            metrics.report()
+            if spill_file and queue.spilled and not batch:
+                # Replay the spilled messages as the parser catches up, rather than
+                # with the next message, which may be a long time coming. They are
+                # left for the next run on shutdown, once the parser stops reading.
+                queue.replay()
+                if queue.spilled and not client.wait(POLL_INTERVAL):
+                    continue
+
+            if batch:
+                # Send a partially filled batch if no more data arrives in time
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not client.wait(remaining):
+                    send(queue, batch)
+                    batch = []
+                    continue
+
+            if journal is not None and journal.unsynced:
+                # Flush the last messages of a burst once the device is quiet, since
+                # append() only flushes with the next message
+                if not client.wait(journal.sync_interval):
+                    journal.sync()
+                    continue
+
             try:
                 fresh_connection = client.fresh
-                # Read device data line by line
-                data = client.readline()
+                # Read all of the complete messages received so far
+                records = client.readlines()
             except Exception as e:
                 # Log the error and reconnect to the device
                 logging.error(e)
+                if batch:
+                    send(queue, batch)
+                    batch = []
                 client.connect()
                 continue
 
-            # Get the current time for the received message. In a rare event that
-            # multiple messages have been received over the socket at once, the
-            # timestamps for individual messages will be very close to each other,
-            # but not the same.
-            timestamp = time.time()
+            received = client.timestamp
+            if received is not None:
+                metrics.observe("timestamp_delay", time.time() - received)
+
+            for data in records:
+                # Get the current time for the received message. In a rare event that
+                # multiple messages have been received over the socket at once, the
+                # timestamps for individual messages will be very close to each other,
+                # but not the same. Kernel timestamps are the same for the messages
+                # received in one TCP segment.
+                timestamp = received if received is not None else time.time()
+
+                # Send the received data, the timestamp, and the connection state to
+                # the second process for parsing. Only the first of the messages read
+                # at once can be the first one received over a connection.
+                item = Item(data, timestamp, fresh_connection)
+                fresh_connection = False
+                if journal is not None:
+                    journal.append(item)
+                if batch_size <= 1:
+                    send(queue, item)
+                    continue
+
+                if not batch:
+                    deadline = time.monotonic() + batch_latency
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    send(queue, batch)
+                    batch = []
+
+        # Send the remaining messages before shutting down
+        if batch:
+            send(queue, batch)
+        if journal is not None:
+            journal.close()
+
+
+def parse_items(
+    parser: Parser, items: Sequence[Item], first_seq: Optional[int] = None
+) -> None:
+    """Parse the messages and write the extracted variables to the parser buffer.
+    Messages that cannot be parsed are skipped (the errors are logged by the parser).
+
+    Args:
+        parser: an instance of Parser
+        items: the messages to process, in the order they were received
+        first_seq: the journal sequence number of the first message, if any
+            (default: None)
+    """
+    if len(items) > 1:
+        columns, failed = parser.extract_many(items)
+        seqs = None
+        if first_seq is not None:
+            seqs = first_seq + np.delete(np.arange(len(items)), failed)
+        try:
+            parser.write_many(columns, seqs)
+        except ParseError:
+            pass
+        return
 
-            # Send the received data, the timestamp, and the connection state to the
-            # second process for parsing
-            try:
-                item = Item(data, timestamp, fresh_connection)
-                queue.put(item, block=False)
-            except Full:
-                logging.error(
-                    "Queue is full, real-time data collection impossible. Exiting."
-                )
-                shutdown.set()
+    for i, item in enumerate(items):
+        seq = first_seq + i if first_seq is not None else None
+        try:
+            variables = parser.extract(item)
+            parser.write(variables, seq)
+        except ParseError:
+            continue
 
 
 def process_data(
-    queue: Queue, regex: bytes, group: Group, pack_length: int, dest: Union[str, Path]
+    queue: Queue, conf: argparse.Namespace, journal: Optional[Journal] = None
 ) -> None:
     """Take messages from the queue, parse them and periodically save to disk.
 
     Args:
         queue: a multiprocessing queue to read messages from
-        regex: regular expression for variable extraction
-        group: an instance of Group, containing group_by related settings
-        pack_length: the number of records to save in each file
-        dest: the target filename where to save the data, with an optional
-            "{date}" placeholder for the current date and time.
+        conf: all of the loaded config file settings for the device
+        journal: if set, replay the messages journaled before a restart, and commit
+            the journal as the data is saved (default: None)
     """
-    parser = Parser(regex, group, pack_length, dest)
+    parser = Parser.from_config(conf)
+
+    if isinstance(queue, SharedRing):
+        metrics.watch("ring_occupancy", lambda: queue.occupancy)
+    if conf.pending_packs:
+        metrics.watch("pending_packs", lambda: parser.pending_packs)
+
+    seq = committed = None
+    if journal is not None:
+        # The listener starts journaling from next_seq, so everything before it
+        # comes from the previous run
+        count = 0
+        for seq, item in journal.replay(journal.next_seq):
+            parse_items(parser, [item], seq)
+            count += 1
+        if count:
+            logging.info(f"Replayed {count:,} messages from the journal")
+        seq = journal.next_seq
+        committed = time.monotonic()
 
     # Loop until a shutdown flag is set and all items in the queue have been received
     while not (shutdown.is_set() and queue.empty()):
+        metrics.report()
+        if journal is not None and time.monotonic() - committed >= 1:
+            # Delete the parts of the journal that have been saved to disk
+            journal.commit(seq if parser.watermark is None else parser.watermark)
+            committed = time.monotonic()
+
         try:
             item = queue.get(timeout=1)
         except Empty:
-            # If the queue is empty, wait for messages that might arrive in the future
+            # If the queue is empty, wait for messages that might arrive in the future,
+            # saving the packs that have reached pack_duration meanwhile
+            parser.flush()
             continue
 
+        # The listener sends either individual messages or batches of messages
+        items = item if isinstance(item, list) else [item]
+        parse_items(parser, items, seq)
+        if seq is not None:
+            seq += len(items)
+
+    # Save the partially filled packs before exiting
+    parser.flush(partial=True)
+    parser.close()
+    if journal is not None:
+        journal.commit(seq if parser.watermark is None else parser.watermark)
+
+
+async def receive_lines(
+    lines: asyncio.Queue, host: str, port: int, timeout: Optional[float] = None
+) -> None:
+    """Receive messages from the device over a TCP socket and put them into an
+    asyncio queue. The coroutine counterpart of listen_device().
+
+    Args:
+        lines: an asyncio queue to send data to
+        host: IP address of the device
+        port: integer port number to listen to
+        timeout: a timeout in seconds for connecting and reading data (default: None)
+    """
+    while not shutdown.is_set():
+        logging.info(f"Attempting to connect to socket at {host}:{port}...")
+        while not shutdown.is_set():
+            try:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(host, port), timeout
+                )
+            except (OSError, asyncio.TimeoutError):
+                await asyncio.sleep(1)
+            else:
+                break
+        else:
+            # Shutting down before connection could be established
+            return
+
+        logging.info(f"Connected to {host}:{port}. Ready to receive device data...")
+        fresh_connection = True
+        idle = 0.0
         try:
-            variables = parser.extract(item)
-            parser.write(variables)
-        except ParseError:
+            while not shutdown.is_set():
+                try:
+                    # Wake up periodically to check the shutdown flag. Cancelling
+                    # readline() keeps the partially received message in the buffer.
+                    data = await asyncio.wait_for(reader.readline(), POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    idle += POLL_INTERVAL
+                    if timeout is not None and idle >= timeout:
+                        raise OSError(
+                            f"Read timed out. No messages received in {timeout} seconds."
+                        )
+                    continue
+
+                if not data:
+                    raise ConnectionResetError("The device has closed the connection")
+
+                lines.put_nowait(Item(data, time.time(), fresh_connection))
+                fresh_connection = False
+                idle = 0.0
+        except Exception as e:
+            # Log the error and reconnect to the device
+            logging.error(e)
+        finally:
+            writer.close()
+
+
+async def process_lines(lines: asyncio.Queue, parser: Parser, pool: Executor) -> None:
+    """Take all of the messages accumulated in the asyncio queue and parse them in the
+    worker pool, one batch at a time to preserve the order of the messages. The
+    coroutine counterpart of process_data().
+
+    Args:
+        lines: an asyncio queue to read messages from. None signals the end of data.
+        parser: an instance of Parser dedicated to the device
+        pool: a pool of workers shared by all devices
+    """
+    loop = asyncio.get_event_loop()
+    done = False
+    while not done:
+        parser.metrics.report()
+        try:
+            items = [await asyncio.wait_for(lines.get(), POLL_INTERVAL)]
+        except asyncio.TimeoutError:
+            # Save the packs that have reached pack_duration while the device is idle
+            await loop.run_in_executor(pool, parser.flush)
             continue
+        while not lines.empty():
+            items.append(lines.get_nowait())
+
+        if items[-1] is None:
+            done = True
+            items.pop()
+
+        await loop.run_in_executor(pool, parse_items, parser, items)
+
+    # Save the partially filled packs
+    await loop.run_in_executor(pool, partial(parser.flush, partial=True))
+
+
+async def serve_device(conf: argparse.Namespace, pool: Executor) -> None:
+    """Listen to the device, parse and save incoming data until shutdown
+
+    Args:
+        conf: all of the loaded config file settings for the device
+        pool: a pool of workers shared by all devices
+    """
+    # Each device reports its own measurements
+    device = f"{conf.host}:{conf.port}"
+    parser = Parser.from_config(
+        conf, measurements=Metrics(conf.metrics_interval, name=device)
+    )
+    if conf.pending_packs:
+        parser.metrics.watch("pending_packs", lambda: parser.pending_packs)
+    lines = asyncio.Queue()
+    consumer = asyncio.ensure_future(process_lines(lines, parser, pool))
+    try:
+        await receive_lines(lines, conf.host, conf.port, conf.timeout)
+    finally:
+        # Let the consumer parse the remaining messages and exit
+        lines.put_nowait(None)
+        await consumer
+        await asyncio.get_event_loop().run_in_executor(pool, parser.close)
+
+
+async def supervise(confs: List[argparse.Namespace], pool: Executor) -> None:
+    """Serve all of the devices concurrently in a single event loop
+
+    Args:
+        confs: the loaded settings, one per device
+        pool: a pool of workers shared by all devices
+    """
+    await asyncio.gather(*(serve_device(conf, pool) for conf in confs))
 
 
 def read_cmdline() -> argparse.Namespace:
@@ -507,8 +3672,27 @@ def read_cmdline() -> argparse.Namespace:
   Parse and save device data to NumPy archives:
     $ ./readport.py --config readport_4001.conf
     
+  Serve all of the devices configured in a directory from a single process:
+    $ ./readport.py --config-dir ./configs/
+
   Save binary messages from the device to a file. Useful when the format isn't yet known:
     $ ./readport.py --echo 192.168.192.48:4001 > data.bin
+
+  Record timestamped messages to compressed hourly files:
+    $ ./readport.py --echo 192.168.192.48:4001 --capture-format ts --compress \\
+        --output "capture/{date:%Y-%m-%d_%H}.cap" --rotate-interval 3600
+
+  Parse the saved messages as if they were received at 20 messages per second:
+    $ ./readport.py --config readport_4001.conf --replay data.bin --rate 20
+
+  Compare the compression codecs on the recently saved files:
+    $ ./readport.py --benchmark-codecs ./data/
+
+  Train the zlib dictionary of the device on its recently saved files:
+    $ ./readport.py --config readport_4001.conf --train-dictionary
+
+  ...or on the files already uploaded by send_data.sh:
+    $ ./readport.py --config readport_4001.conf --train-dictionary /backup/4001/
 """,
     )
     # For better clarity, add a required block in the description
@@ -519,17 +3703,101 @@ def read_cmdline() -> argparse.Namespace:
         "--config",
         help="path to the configuration file",
     )
+    either.add_argument(
+        "--config-dir",
+        metavar="DIR",
+        help=(
+            "serve every *.conf file in the directory from a single process, "
+            "logging to their common log file, or readport.log"
+        ),
+    )
     either.add_argument(
         "--echo",
         metavar="IP:PORT",
         help="print messages coming from a specified address to stdout",
     )
+    either.add_argument(
+        "--benchmark-codecs",
+        metavar="FILE",
+        nargs="+",
+        help=(
+            "compress the saved .npz files (or the latest 20 files in a directory) "
+            "with each codec, and print the speed and the compression ratio"
+        ),
+    )
+    capture = parser.add_argument_group("recording options for --echo")
+    capture.add_argument(
+        "--capture-format",
+        choices=["raw", "ts"],
+        default="raw",
+        help=(
+            "raw: the messages as they are; ts: length-prefixed messages with "
+            "their receive timestamps, for use with --replay (default: raw)"
+        ),
+    )
+    capture.add_argument(
+        "--output",
+        metavar="FILE",
+        help=(
+            "write to a file instead of stdout, with an optional {date} placeholder. "
+            "Existing files get a sequence number instead of being overwritten"
+        ),
+    )
+    capture.add_argument(
+        "--rotate-size",
+        metavar="MB",
+        type=float,
+        help="start a new --output file after this many megabytes",
+    )
+    capture.add_argument(
+        "--rotate-interval",
+        metavar="SECONDS",
+        type=float,
+        help="start a new --output file after this many seconds",
+    )
+    capture.add_argument(
+        "--compress",
+        action="store_true",
+        help="compress the ts format with zlib",
+    )
+    parser.add_argument(
+        "--replay",
+        metavar="FILE",
+        help="parse messages recorded with --echo instead of connecting to the device",
+    )
+    parser.add_argument(
+        "--rate",
+        help="messages per second in raw recordings for --replay (default: 20)",
+        default=20,
+        type=float,
+    )
+    parser.add_argument(
+        "--train-dictionary",
+        metavar="FILE",
+        nargs="*",
+        help=(
+            "train the zlib dictionary (zdict) of the device on the latest 50 .npz "
+            "files given, or in the directories given, or saved in dest_dir by default"
+        ),
+    )
+    parser.add_argument(
+        "--workers",
+        help="number of worker threads shared by devices with --config-dir (default: 2)",
+        default=2,
+        type=int,
+    )
     parser.add_argument(
         "--debug",
         help="turn on DEBUG logging (overrides the setting in the config file)",
         action="store_true",
     )
     args = parser.parse_args()
+    if args.replay and not args.config:
+        parser.error("--replay requires --config")
+    if args.train_dictionary is not None and not args.config:
+        parser.error("--train-dictionary requires --config")
+    if (args.rotate_size or args.rotate_interval) and not args.output:
+        parser.error("--rotate-size and --rotate-interval require --output")
     return args
 
 
@@ -548,14 +3816,49 @@ def load_config(f: TextIO) -> argparse.Namespace:
     )
     config.read_file(f)
 
-    # Read regex as a byte-string
-    regex = literal_eval("b'{}'".format(config.get("parser", "regex", raw=True)))
-    variables = validate_regex(regex)
+    # The regex is only needed for the regex format
+    message_format = Format.from_config(
+        config.get("parser", "format", fallback="regex"),
+        config.get("parser", "fields", fallback=None),
+        config.get("parser", "delimiter", raw=True, fallback=None),
+        config.get("parser", "separator", raw=True, fallback=None),
+    )
+    if message_format.kind == "regex":
+        # Read regex as a byte-string
+        regex = literal_eval("b'{}'".format(config.get("parser", "regex", raw=True)))
+        variables = validate_regex(regex)
+    else:
+        regex = b""
+        variables = message_format.fields.keys()
+        validate_names(variables)
 
     # Load group_by related options
     group = Group.from_config(config.get("parser", "group_by", fallback=None))
     group.validate(variables)
 
+    dtypes = parse_dtypes(config.get("parser", "dtypes", fallback=None), variables)
+    decimals = parse_decimals(
+        config.get("parser", "decimals", fallback=None), variables
+    )
+
+    missing = config.get("parser", "missing", fallback="reject")
+    if missing not in ("reject", "fill"):
+        raise ConfigurationError("missing must be set to either reject or fill")
+    if missing == "fill" and len(variables) - (group.by is not None) > 64:
+        raise ConfigurationError("missing = fill supports up to 64 variables")
+    if group.by in dtypes:
+        raise ConfigurationError(
+            "the group_by variable is not saved, don't set its type in dtypes"
+        )
+    if group.by in decimals:
+        raise ConfigurationError(
+            "the group_by variable is not saved, don't set its decimals"
+        )
+    if set(dtypes) & set(decimals):
+        raise ConfigurationError(
+            "the fixed-point variables are saved as integers, don't set their dtypes"
+        )
+
     # Hardcode the filename template, with {group} and {date} to be substituted when
     # writing to disk.
     config["DEFAULT"][
@@ -569,21 +3872,171 @@ def load_config(f: TextIO) -> argparse.Namespace:
         host=config.get("device", "host"),
         port=config.getint("device", "port"),
         timeout=config.getint("device", "timeout", fallback=None),
+        kernel_timestamps=config.getboolean(
+            "device", "kernel_timestamps", fallback=False
+        ),
+        batch_size=config.getint("transport", "batch_size", fallback=1),
+        batch_latency=config.getfloat("transport", "batch_latency", fallback=0.1),
+        ring_size=config.getint("transport", "ring_size", fallback=0),
+        queue_size=config.getint("transport", "queue_size", fallback=10000),
+        journal_dir=config.get("transport", "journal_dir", fallback=None),
+        journal_segment_size=config.getint(
+            "transport", "journal_segment_size", fallback=4194304
+        ),
+        journal_sync_interval=config.getfloat(
+            "transport", "journal_sync_interval", fallback=1.0
+        ),
+        spill_file=config.get("transport", "spill_file", fallback=None) or None,
         regex=regex,
+        format=message_format,
         group=group,
         pack_length=config.getint("parser", "pack_length"),
+        pack_duration=config.getfloat("parser", "pack_duration", fallback=None),
+        coalesce=config.get("parser", "coalesce", fallback=None),
+        sample_rate=config.getfloat("parser", "sample_rate", fallback=None),
+        columnar=config.getboolean("parser", "columnar", fallback=False),
+        deferred=config.getboolean("parser", "deferred", fallback=False),
+        checkpoint_dir=config.get("parser", "checkpoint_dir", fallback=None),
+        pending_packs=config.getint("parser", "pending_packs", fallback=0),
+        compress_workers=config.getint("parser", "compress_workers", fallback=1),
+        compression=Compression.from_config(
+            config.get("parser", "compression", fallback="zlib")
+        ),
+        zdict=config.get("parser", "zdict", fallback=None),
+        dtypes=dtypes,
+        decimals=decimals,
+        missing=missing,
         dest_dir=config.get("parser", "destination"),
         filename=config.get("DEFAULT", "filename"),
         log_level=config.get("logging", "level"),
         log_file=config.get("logging", "file"),
+        metrics_interval=config.getfloat("logging", "metrics_interval", fallback=60),
     )
 
+    if conf["coalesce"] and conf["coalesce"] not in Coalescer.periods:
+        raise ConfigurationError(
+            f"coalesce must be one of: {', '.join(Coalescer.periods)}"
+        )
+    if conf["pack_duration"] is not None and conf["pack_duration"] <= 0:
+        raise ConfigurationError("pack_duration must be positive")
+    if conf["pending_packs"] < 0:
+        raise ConfigurationError("pending_packs can't be negative")
+    if conf["compress_workers"] < 1:
+        raise ConfigurationError("compress_workers must be at least 1")
+
+    if conf["deferred"] and conf["columnar"]:
+        raise ConfigurationError("deferred can't be combined with columnar")
+    if conf["checkpoint_dir"]:
+        # The journal would replay the records resumed from the checkpoint, and the
+        # packs in flight wouldn't be in the checkpoint
+        for option in ["deferred", "journal_dir", "pending_packs", "decimals"]:
+            if conf[option]:
+                raise ConfigurationError(
+                    f"checkpoint_dir can't be combined with {option}"
+                )
+
+    if conf["zdict"]:
+        if conf["compression"].codec != "zlib":
+            raise ConfigurationError("zdict requires compression = zlib")
+        # The dictionary is trained with --train-dictionary after the first files
+        # have been saved without it
+        conf["compression"].zdict = find_zdict(conf["zdict"])
+
+    if conf["ring_size"] and shared_memory is None:
+        raise ConfigurationError("ring_size requires Python 3.8 or later")
+
     # Convert the dictionary to a Namespace object, to enable .attribute access
     conf = argparse.Namespace(**conf)
 
     return conf
 
 
+def parse_dtypes(
+    dtypes: Optional[str], variables: AbstractSet[str]
+) -> Dict[str, np.dtype]:
+    """Parse the data types of the saved variables from the configuration file value
+
+    Args:
+        dtypes: the option value from the config, e.g. "u:float32, STATUS:uint8"
+        variables: the set of known variable names extracted by the regex
+
+    Returns:
+        dtypes: a dict of variable-dtype pairs
+
+    Raises:
+        ConfigurationError: in case of ill-formatted values, unknown variables, or
+            unsupported data types
+    """
+    parsed = {}
+    for entry in (dtypes or "").split(","):
+        if not entry.strip():
+            continue
+        try:
+            var, name = (part.strip() for part in entry.split(":"))
+        except ValueError:
+            raise ConfigurationError(
+                "dtypes must be in the format <variable>:<type>, <variable>:<type>, ..."
+            )
+        if var not in variables and var != "time":
+            raise ConfigurationError(
+                f"dtypes variable must be one of: {', '.join(variables)}, time"
+            )
+        try:
+            dtype = np.dtype(name)
+        except TypeError:
+            raise ConfigurationError(f"dtypes: unknown data type '{name}'")
+        if dtype.kind not in "iuf":
+            raise ConfigurationError(
+                f"dtypes: '{name}' must be an integer or a floating-point type"
+            )
+        if var == "time" and dtype not in (np.float64, np.int64):
+            raise ConfigurationError(
+                "time can only be saved as float64 (seconds) or int64 (nanoseconds)"
+            )
+        parsed[var] = dtype
+    return parsed
+
+
+def parse_decimals(
+    decimals: Optional[str], variables: AbstractSet[str]
+) -> Dict[str, Optional[int]]:
+    """Parse the decimals of the fixed-point variables from the configuration file value
+
+    Args:
+        decimals: the option value from the config, e.g. "u:3, temp:auto"
+        variables: the set of known variable names extracted by the regex
+
+    Returns:
+        decimals: a dict of variable-decimals pairs, None for the decimals to count
+
+    Raises:
+        ConfigurationError: in case of ill-formatted values or unknown variables
+    """
+    parsed = {}
+    for entry in (decimals or "").split(","):
+        if not entry.strip():
+            continue
+        try:
+            var, places = (part.strip() for part in entry.split(":"))
+        except ValueError:
+            raise ConfigurationError(
+                "decimals must be in the format <variable>:<decimals>, ..."
+            )
+        if var not in variables:
+            raise ConfigurationError(
+                f"decimals variable must be one of: {', '.join(variables)}"
+            )
+        if places == "auto":
+            parsed[var] = None
+        elif places.isdigit() and int(places) <= 9:
+            parsed[var] = int(places)
+        else:
+            raise ConfigurationError(
+                f"decimals of {var} must be from 0 to 9, or auto to count them"
+            )
+    return parsed
+
+
 def validate_regex(regex: bytes) -> AbstractSet[str]:
     """Check if the regular expression is valid
 
@@ -610,14 +4063,36 @@ def validate_regex(regex: bytes) -> AbstractSet[str]:
     if pattern.groups != len(pattern.groupindex):
         raise ConfigurationError("all of the regex capture groups must be named")
 
+    validate_names(pattern.groupindex.keys())
+    return pattern.groupindex.keys()
+
+
+def validate_names(variables: AbstractSet[str]) -> None:
+    """Check that the variable names don't clash with the variables added by the parser
+
+    Args:
+        variables: a set of variable names from the config
+
+    Raises:
+        ConfigurationError: if any of the names are reserved
+    """
     # Ensure that "time" isn't used in the regex
-    if "time" in pattern.groupindex:
+    if "time" in variables:
         raise ConfigurationError(
-            "don't use 'time' as a regex variable, "
-            "it is reserved for the message timestamp"
+            "don't use 'time' as a variable, it is reserved for the message timestamp"
+        )
+    reserved = [name for name in variables if name.startswith("time_")]
+    if reserved:
+        raise ConfigurationError(
+            f"don't use {', '.join(reserved)} as variables, "
+            f"the 'time_' prefix is reserved for the time statistics"
+        )
+    reserved = [name for name in variables if name.startswith("_")]
+    if reserved:
+        raise ConfigurationError(
+            f"don't use {', '.join(reserved)} as variables, "
+            f"names starting with '_' are reserved for metadata"
         )
-
-    return pattern.groupindex.keys()
 
 
 def configure_logging(
@@ -668,29 +4143,367 @@ def configure_logging(
     logging.config.dictConfig(logging_conf)
 
 
-def echo(host: str, port: int) -> None:
+class CaptureWriter:
+    """Records messages to a file, or stdout, in large buffered blocks. Supports two
+    formats: "raw" writes the messages as they are, while "ts" writes length-prefixed
+    records with the receive timestamp, optionally compressed with zlib.
+
+    A "ts" file starts with CAPTURE_MAGIC and a flags byte (1 = zlib-compressed),
+    followed by records consisting of the timestamp (float64), the length of the
+    message (uint32) and the message itself.
+    """
+
+    _record = struct.Struct("<dI")
+
+    def __init__(
+        self,
+        output: Optional[str] = None,
+        fmt: str = "raw",
+        compress: bool = False,
+        rotate_size: Optional[int] = None,
+        rotate_interval: Optional[float] = None,
+        flush_interval: float = 1.0,
+        buffer_size: int = 1048576,
+    ) -> None:
+        """Initialize the writer. Files are opened on the first write.
+
+        Args:
+            output: the target filename, with an optional "{date}" placeholder for the
+                time the file is opened. Existing files are never overwritten: a
+                sequence number is added to the name instead, e.g. "data.1.cap".
+                None writes to stdout (default: None)
+            fmt: "raw" or "ts" (default: "raw")
+            compress: compress "ts" files with zlib (default: False)
+            rotate_size: start a new file after this many bytes of messages
+                (default: None)
+            rotate_interval: start a new file after this many seconds (default: None)
+            flush_interval: the maximum number of seconds the messages are kept in
+                memory before being written out (default: 1.0)
+            buffer_size: the size of the write buffer in bytes (default: 1048576)
+        """
+        self.output = output
+        self.fmt = fmt
+        self.compress = compress and fmt == "ts"
+        self.rotate_size = rotate_size
+        self.rotate_interval = rotate_interval
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+        self._file = None
+        self._zlib = None
+        self._written = 0
+        self._opened = self._flushed = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _open(self) -> None:
+        """Open the next output file and write the header"""
+        if self.output is None:
+            self._file = sys.stdout.buffer
+        else:
+            path = Path(self.output.format(date=datetime.utcnow()))
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # E.g. when rotating more often than the {date} placeholder changes
+            candidate, sequence = path, 0
+            while True:
+                try:
+                    self._file = open(candidate, "xb", buffering=self.buffer_size)
+                    break
+                except FileExistsError:
+                    sequence += 1
+                    candidate = path.with_name(f"{path.stem}.{sequence}{path.suffix}")
+            logging.info(f"Recording to '{candidate}'")
+
+        if self.fmt == "ts":
+            self._file.write(CAPTURE_MAGIC + bytes([int(self.compress)]))
+            if self.compress:
+                self._zlib = zlib.compressobj()
+        self._written = 0
+        self._opened = time.monotonic()
+
+    def write(self, records: List[bytes], timestamp: float) -> None:
+        """Record the messages received at the same time
+
+        Args:
+            records: a list of binary messages
+            timestamp: the receive time of the messages
+        """
+        if self._file is None:
+            self._open()
+
+        if self.fmt == "ts":
+            data = b"".join(
+                self._record.pack(timestamp, len(record)) + record for record in records
+            )
+        else:
+            data = b"".join(records)
+        self._written += len(data)
+        self._file.write(self._zlib.compress(data) if self._zlib else data)
+        self.tick()
+
+    def tick(self) -> None:
+        """Rotate the file or write out the buffered messages when it's time, also
+        while no messages arrive"""
+        if self._file is None:
+            return
+        now = time.monotonic()
+        if self.output is not None and (
+            (self.rotate_size and self._written >= self.rotate_size)
+            or (self.rotate_interval and now - self._opened >= self.rotate_interval)
+        ):
+            self.close()
+        elif now - self._flushed >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write out the buffered messages, keeping compressed files readable"""
+        if self._zlib:
+            self._file.write(self._zlib.flush(zlib.Z_SYNC_FLUSH))
+        if self._file is not None:
+            self._file.flush()
+        self._flushed = time.monotonic()
+
+    def close(self) -> None:
+        """Write out the buffered messages and close the current file"""
+        if self._file is None:
+            return
+        if self._zlib:
+            self._file.write(self._zlib.flush())
+            self._zlib = None
+        self.flush()
+        if self._file is not sys.stdout.buffer:
+            self._file.close()
+        self._file = None
+
+
+def echo(host: str, port: int, writer: Optional[CaptureWriter] = None) -> None:
     """Connect to the device and print incoming messages to stdout
 
     Args:
         host: IP address of the device
         port: integer port number to listen to
+        writer: where and how to record the messages (default: raw messages to stdout)
     """
-    with TCPClient(host, port) as client:
+    with TCPClient(host, port) as client, (writer or CaptureWriter()) as writer:
         # Establish socket connection to the device
         client.connect()
 
         while True:
+            if not client.wait(POLL_INTERVAL):
+                # Don't keep the messages of a quiet device in memory
+                writer.tick()
+                continue
             try:
-                # Read device data line by line
-                data = client.readline()
+                # Read all of the complete messages received so far
+                records = client.readlines()
             except Exception as e:
                 logging.error(e)
                 return
             else:
                 # Ideally, the user will redirect stdout to a file to record binary
                 # messages and avoid corrupting the terminal
-                sys.stdout.buffer.write(data)
-                sys.stdout.buffer.flush()
+                writer.write(records, time.time())
+
+
+def read_lines(f: BinaryIO, chunk_size: int = 1048576) -> Iterator[List[bytes]]:
+    """Read a file in large chunks, splitting them into newline-delimited messages
+
+    Args:
+        f: a file opened in binary mode
+        chunk_size: the number of bytes to read at once (default: 1048576)
+
+    Yields:
+        lines: a list of the complete messages in a chunk, including the newlines.
+            The last message of the file may be incomplete.
+    """
+    tail = b""
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        lines = (tail + chunk).split(b"\n")
+        tail = lines.pop()
+        if lines:
+            yield [line + b"\n" for line in lines]
+    if tail:
+        yield [tail]
+
+
+def read_capture(f: BinaryIO, chunk_size: int = 1048576) -> Iterator[List[Item]]:
+    """Read a file recorded in the "ts" format by CaptureWriter
+
+    Args:
+        f: a file opened in binary mode, positioned after CAPTURE_MAGIC
+        chunk_size: the number of bytes to read at once (default: 1048576)
+
+    Yields:
+        items: a list of the complete messages in a chunk, with their timestamps
+    """
+    record = CaptureWriter._record
+    decompressor = zlib.decompressobj() if f.read(1) == b"\x01" else None
+    tail = b""
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        data = tail + (decompressor.decompress(chunk) if decompressor else chunk)
+        items = []
+        pos = 0
+        while pos + record.size <= len(data):
+            timestamp, length = record.unpack_from(data, pos)
+            end = pos + record.size + length
+            if end > len(data):
+                break
+            items.append(Item(data[pos + record.size : end], timestamp, False))
+            pos = end
+        tail = data[pos:]
+        if items:
+            yield items
+
+
+def replay(conf: argparse.Namespace, path: Union[str, Path], rate: float = 20) -> None:
+    """Parse the messages recorded by --echo and save them to disk as fast as possible.
+    The timestamps are taken from "ts" recordings. For raw recordings, the messages are
+    assumed to arrive at a constant rate, and to end at the modification time of the
+    file.
+
+    Args:
+        conf: all of the loaded config file settings
+        path: the file with the recorded messages
+        rate: the number of messages per second in raw recordings (default: 20)
+    """
+    path = Path(path)
+    # The checkpoint and the coalescing containers belong to the running daemon
+    parser = Parser.from_config(
+        conf, date_from_data=True, checkpoint_dir=None, coalesce=None
+    )
+
+    started = time.monotonic()
+    count = 0
+    with path.open("rb") as f:
+        if f.read(len(CAPTURE_MAGIC)) == CAPTURE_MAGIC:
+            for items in read_capture(f):
+                parse_items(parser, items)
+                count += len(items)
+        else:
+            # Synthesize the timestamps, counting the messages first
+            f.seek(0)
+            total = sum(len(lines) for lines in read_lines(f))
+            start = path.stat().st_mtime - (total - 1) / rate
+
+            f.seek(0)
+            for lines in read_lines(f):
+                items = [
+                    Item(data, start + i / rate, False)
+                    for i, data in enumerate(lines, count)
+                ]
+                parse_items(parser, items)
+                count += len(lines)
+    parser.flush(partial=True)
+    parser.close()
+
+    elapsed = time.monotonic() - started
+    logging.info(
+        f"Replayed {count:,} messages in {elapsed:.1f} seconds "
+        f"({count / max(elapsed, 1e-9):,.0f} messages per second)"
+    )
+
+
+def benchmark_codecs(paths: List[Union[str, Path]]) -> None:
+    """Save a sample of the packs with each of the codecs, and print the throughput
+    and the compression ratio of each codec
+
+    Args:
+        paths: the .npz files saved by the parser, or directories with such files, of
+            which the latest 20 files are used. The files that can't be read, e.g.
+            those saved with a preset dictionary, are skipped.
+    """
+    files = []
+    for path in map(Path, paths):
+        files.extend(sorted(path.glob("*.npz"))[-20:] if path.is_dir() else [path])
+    packs = []
+    for file in files:
+        try:
+            packs.append(load_npz(file))
+        except (OSError, ValueError, zipfile.BadZipFile) as e:
+            logging.warning(f"Skipped '{file}': {e}")
+    if not packs:
+        logging.error("No .npz files to compress")
+        return
+    size = sum(array.nbytes for pack in packs for array in pack.values())
+
+    print(f"{'codec':<10}{'MB/s':>10}{'ratio':>8}")
+    for value in ["none", "zlib:1", "zlib:6", "zlib:9", "bz2:9", "lzma:0", "lzma:6"]:
+        compression = Compression.from_config(value)
+        compressed = 0
+        started = time.perf_counter()
+        for pack in packs:
+            with io.BytesIO() as f:
+                save_npz(f, pack, compression)
+                compressed += f.tell()
+        elapsed = time.perf_counter() - started
+        print(f"{value:<10}{size / elapsed / 1e6:>10.1f}{size / compressed:>8.2f}")
+
+
+def train_dictionary(
+    conf: argparse.Namespace,
+    paths: Optional[List[Union[str, Path]]] = None,
+    count: int = 50,
+) -> None:
+    """Train a zlib preset dictionary on the latest files saved for the device, and
+    save it to the zdict directory of the configuration, see save_zdict(). The latest
+    fifth of the files is held out to compare the file sizes with and without the
+    dictionary.
+
+    Args:
+        conf: all of the loaded config file settings
+        paths: the .npz files saved for the device, or directories with such files,
+            e.g. where send_data.sh uploads them, or None for the files in dest_dir
+            (default: None)
+        count: the number of files to use (default: 50)
+    """
+    if not conf.zdict:
+        logging.error("Set zdict in the [parser] section of the config file first")
+        return
+    if paths:
+        files = []
+        for path in map(Path, paths):
+            files.extend(path.glob("*.npz") if path.is_dir() else [path])
+        source = ", ".join(map(str, paths))
+    else:
+        source = saved_files(Path(conf.dest_dir) / conf.filename, bool(conf.group.by))
+        files = map(Path, glob.glob(source))
+    files = sorted(files, key=lambda f: f.stat().st_mtime)
+    packs = [load_npz(file, conf.zdict) for file in files[-count:]]
+    if len(packs) < 2:
+        logging.error(f"Not enough .npz files in '{source}' to train a dictionary")
+        return
+
+    held_out = max(len(packs) // 5, 1)
+    zdict = train_zdict(packs[:-held_out])
+    path = save_zdict(conf.zdict, zdict)
+    logging.info(
+        f"Saved a {len(zdict):,}-byte dictionary to '{path}', which is used after "
+        f"a restart"
+    )
+
+    records = sum(len(pack["time"]) for pack in packs[-held_out:])
+    for compression in [
+        Compression("zlib", conf.compression.level),
+        Compression("zlib", conf.compression.level, zdict),
+    ]:
+        size = 0
+        for pack in packs[-held_out:]:
+            with io.BytesIO() as f:
+                save_npz(f, pack, compression)
+                size += f.tell()
+        logging.info(
+            f"{'With' if compression.zdict else 'Without'} the dictionary: "
+            f"{size / records:.1f} bytes per record"
+        )
 
 
 def parse(conf: argparse.Namespace) -> None:
@@ -702,24 +4515,43 @@ def parse(conf: argparse.Namespace) -> None:
     # Ignore Ctrl-C in subprocesses
     signal.signal(signal.SIGINT, signal.SIG_IGN)
 
+    # Report the measurements from both processes at the same rate
+    metrics.interval = conf.metrics_interval
+
     # Create a communication queue between processes
-    queue = Queue()
+    # queue_size counts messages, and the queue holds batches of up to batch_size
+    if conf.ring_size:
+        queue = SharedRing(conf.ring_size)
+    else:
+        queue = Queue(max(conf.queue_size // max(conf.batch_size, 1), 1))
+
+    # Find where the write-ahead journal left off before the processes share it
+    journal = None
+    if conf.journal_dir:
+        journal = Journal(
+            conf.journal_dir, conf.journal_segment_size, conf.journal_sync_interval
+        )
+        journal.recover()
 
     # Launch the subprocesses
     p1 = Process(
         target=listen_device,
-        kwargs=dict(queue=queue, host=conf.host, port=conf.port, timeout=conf.timeout),
-    )
-    p2 = Process(
-        target=process_data,
         kwargs=dict(
             queue=queue,
-            regex=conf.regex,
-            group=conf.group,
-            pack_length=conf.pack_length,
-            dest=Path(conf.dest_dir) / conf.filename,
+            host=conf.host,
+            port=conf.port,
+            timeout=conf.timeout,
+            batch_size=conf.batch_size,
+            batch_latency=conf.batch_latency,
+            spill_file=conf.spill_file,
+            journal=journal,
+            kernel_timestamps=conf.kernel_timestamps,
         ),
     )
+    p2 = Process(
+        target=process_data,
+        kwargs=dict(queue=queue, conf=conf, journal=journal),
+    )
     global processes
     processes = [p1, p2]
     p1.start()
@@ -733,7 +4565,62 @@ def parse(conf: argparse.Namespace) -> None:
     p1.join()
     p2.join()
     queue.close()
-    queue.join_thread()
+    if not isinstance(queue, SharedRing):
+        queue.join_thread()
+
+
+def unsupported_options(conf: argparse.Namespace) -> List[str]:
+    """Find the settings of a device that parse_all() ignores, since they configure
+    the listening and parsing processes of parse()
+
+    Args:
+        conf: the loaded settings of the device
+
+    Returns:
+        options: the names of the options that differ from their defaults
+    """
+    defaults = dict(
+        kernel_timestamps=False,
+        batch_size=1,
+        ring_size=0,
+        queue_size=10000,
+        spill_file=None,
+        journal_dir=None,
+    )
+    return [
+        option
+        for option, default in defaults.items()
+        if (getattr(conf, option) or None) != (default or None)
+    ]
+
+
+def parse_all(confs: List[argparse.Namespace], workers: int = 2) -> None:
+    """Listen, parse, and save incoming data from several devices in a single process.
+    An asyncio event loop owns the device sockets, while parsing and saving to disk is
+    offloaded to a pool of worker threads shared by the devices.
+
+    Args:
+        confs: the loaded settings, one per device
+        workers: the number of worker threads (default: 2)
+    """
+    # Gracefully handle Ctrl-C and the TERM signal
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+
+    for conf in confs:
+        for option in unsupported_options(conf):
+            logging.warning(
+                f"{option} isn't supported with multiple devices, ignoring it "
+                f"for {conf.host}:{conf.port}"
+            )
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            loop.run_until_complete(supervise(confs, pool))
+    finally:
+        loop.close()
 
 
 def main() -> None:
@@ -754,12 +4641,55 @@ def main() -> None:
             logging.error(f"Failed to parse {args.echo!r} as IP:PORT: {e}")
             sys.exit(1)
 
+        writer = CaptureWriter(
+            output=args.output,
+            fmt=args.capture_format,
+            compress=args.compress,
+            rotate_size=int(args.rotate_size * 1e6) if args.rotate_size else None,
+            rotate_interval=args.rotate_interval,
+        )
         try:
             # Connect to the device and print incoming messages to stdout
-            echo(host, port)
+            echo(host, port, writer)
         except KeyboardInterrupt:
             pass
 
+    elif args.benchmark_codecs:
+        benchmark_codecs(args.benchmark_codecs)
+
+    elif args.config_dir:
+        # Load all of the config files in the directory
+        try:
+            paths = sorted(Path(args.config_dir).glob("*.conf"))
+            assert paths, f"no *.conf files found in {args.config_dir!r}"
+            confs = []
+            for path in paths:
+                with path.open() as f:
+                    confs.append(load_config(f))
+        except Exception as e:
+            logging.error(f"Failed to load configuration: {e}")
+            sys.exit(1)
+
+        # Use the most verbose of the logging levels, and a common log-file: the one
+        # of the config files if they agree
+        log_level = min(
+            ("DEBUG" if args.debug else conf.log_level for conf in confs),
+            key=logging.getLevelName,
+        )
+        log_files = {conf.log_file for conf in confs}
+        log_file = log_files.pop() if len(log_files) == 1 else "readport.log"
+        configure_logging(level=log_level, file=log_file)
+        logging.info(f"Serving {len(confs)} device(s). Logging to '{log_file}'")
+        for conf in confs:
+            if conf.log_file != log_file:
+                logging.warning(
+                    f"The log file '{conf.log_file}' of {conf.host}:{conf.port} is "
+                    f"ignored with multiple devices"
+                )
+
+        # Launch a single event loop that listens, parses, and saves data
+        parse_all(confs, workers=args.workers)
+
     else:
         # Load the config file
         try:
@@ -769,8 +4699,22 @@ def main() -> None:
             logging.error(f"Failed to load configuration: {e}")
             sys.exit(1)
 
-        # Set up logging to the console and the log-file
         log_level = "DEBUG" if args.debug else conf.log_level
+        if args.train_dictionary is not None:
+            configure_logging(level=log_level)
+            train_dictionary(conf, args.train_dictionary)
+            return
+
+        if args.replay:
+            # Log to the console only and parse the saved messages
+            configure_logging(level=log_level)
+            try:
+                replay(conf, args.replay, args.rate)
+            except KeyboardInterrupt:
+                pass
+            return
+
+        # Set up logging to the console and the log-file
         configure_logging(level=log_level, file=conf.log_file)
         logging.info(f"Logging to the file '{conf.log_file}'")
 
@@ -0,0 +1,41 @@
+import pytest
+from readport import load_config
+
+CONFIG = r"""
+[device]
+station = MSU
+name = Test
+host = {host}
+port = {port}
+
+[parser]
+regex = ^(?P<level>\S+) RH= *(?P<rh>\S+) %RH T= *(?P<temp>\S+) .C\s*$
+pack_length = 2
+destination = {destination}
+{options}
+
+[logging]
+level = DEBUG
+file = readport.log
+"""
+
+
+@pytest.fixture
+def make_conf(tmp_path):
+    """Load the settings of a test device with load_config(), so that the tests don't
+    depend on the full list of options. Extra [parser] options are given as text."""
+
+    def make(options="", destination=None, host="127.0.0.1", port=4001):
+        path = tmp_path / "test.conf"
+        path.write_text(
+            CONFIG.format(
+                host=host,
+                port=port,
+                destination=destination or tmp_path,
+                options=options,
+            )
+        )
+        with path.open() as f:
+            return load_config(f)
+
+    return make
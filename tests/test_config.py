@@ -1,9 +1,18 @@
 import configparser
 import importlib
 from io import StringIO
+import numpy as np
 import pytest
 import readport
-from readport import Group, load_config, ConfigurationError
+from readport import (
+    Compression,
+    Format,
+    Group,
+    load_config,
+    save_zdict,
+    unsupported_options,
+    ConfigurationError,
+)
 
 
 def test_load_config():
@@ -43,6 +52,7 @@ def test_load_config():
     assert conf.dest_dir == "./data/"
     assert conf.log_level == "DEBUG"
     assert conf.log_file == "readport_4001.log"
+    assert conf.spill_file is None
 
 
 def test_missing_setting():
@@ -243,3 +253,378 @@ def test_group_by_errors(group_by):
     with StringIO(config.format(group_by=group_by)) as f:
         with pytest.raises(ConfigurationError):
             load_config(f)
+
+
+def test_dtypes():
+    """Check that the data types of the variables are loaded"""
+    config = r"""
+        [device]
+        station = MSU
+        name = Test
+        host = 127.0.0.1
+        port = 4001
+
+        [parser]
+        regex = ^(?P<level>\S+) RH= *(?P<rh>\S+) %RH T= *(?P<temp>\S+) .C\s*$
+        dtypes = rh:float32, temp: int16,time:int64
+        pack_length = 12000
+        destination = ./data/
+
+        [logging]
+        level = DEBUG
+        file = readport_${device:port}.log
+    """
+    with StringIO(config) as f:
+        conf = load_config(f)
+
+    assert conf.dtypes == dict(rh=np.float32, temp=np.int16, time=np.int64)
+
+
+@pytest.mark.parametrize(
+    "dtypes",
+    [
+        "rh",
+        "something_else:int16",
+        "rh:float128x",
+        "rh:str",
+        "time:float32",
+        "level:int8",
+    ],
+    ids=[
+        "incorrect format",
+        "unknown variable",
+        "unknown type",
+        "not a number",
+        "imprecise time",
+        "group_by variable",
+    ],
+)
+def test_dtypes_errors(dtypes):
+    """Ensure that the data types are checked"""
+    config = r"""
+        [device]
+        station = MSU
+        name = Test
+        host = 127.0.0.1
+        port = 4001
+
+        [parser]
+        regex = ^(?P<level>\S+) RH= *(?P<rh>\S+) %RH T= *(?P<temp>\S+) .C\s*$
+        group_by = level:int
+        dtypes = {dtypes}
+        pack_length = 12000
+        destination = ./data/
+
+        [logging]
+        level = DEBUG
+        file = readport_${{device:port}}.log
+    """
+    with StringIO(config.format(dtypes=dtypes)) as f:
+        with pytest.raises(ConfigurationError):
+            load_config(f)
+
+
+def test_decimals():
+    """Check that the decimals of the fixed-point variables are loaded"""
+    config = r"""
+        [device]
+        station = MSU
+        name = Test
+        host = 127.0.0.1
+        port = 4001
+
+        [parser]
+        regex = ^(?P<level>\S+) RH= *(?P<rh>\S+) %RH T= *(?P<temp>\S+) .C\s*$
+        decimals = rh:1, temp: auto
+        pack_length = 12000
+        destination = ./data/
+
+        [logging]
+        level = DEBUG
+        file = readport_${device:port}.log
+    """
+    with StringIO(config) as f:
+        conf = load_config(f)
+
+    assert conf.decimals == dict(rh=1, temp=None)
+
+
+@pytest.mark.parametrize(
+    "decimals, dtypes",
+    [
+        ("rh", ""),
+        ("time:3", ""),
+        ("rh:-1", ""),
+        ("rh:10", ""),
+        ("level:0", ""),
+        ("rh:2", "rh:float32"),
+    ],
+    ids=[
+        "incorrect format",
+        "unknown variable",
+        "negative",
+        "too many",
+        "group_by variable",
+        "with dtypes",
+    ],
+)
+def test_decimals_errors(decimals, dtypes):
+    """Ensure that the decimals are checked"""
+    config = r"""
+        [device]
+        station = MSU
+        name = Test
+        host = 127.0.0.1
+        port = 4001
+
+        [parser]
+        regex = ^(?P<level>\S+) RH= *(?P<rh>\S+) %RH T= *(?P<temp>\S+) .C\s*$
+        group_by = level:int
+        decimals = {decimals}
+        dtypes = {dtypes}
+        pack_length = 12000
+        destination = ./data/
+
+        [logging]
+        level = DEBUG
+        file = readport_${{device:port}}.log
+    """
+    with StringIO(config.format(decimals=decimals, dtypes=dtypes)) as f:
+        with pytest.raises(ConfigurationError):
+            load_config(f)
+
+
+@pytest.mark.parametrize(
+    "regex",
+    [br"^(?P<time_lag>\S+)$", br"^(?P<_missing>\S+)$"],
+    ids=["time statistics", "metadata"],
+)
+def test_reserved_names(regex):
+    """Ensure that the names of the saved metadata can't be used in the regex"""
+    with pytest.raises(ConfigurationError):
+        readport.validate_regex(regex)
+
+
+def test_format():
+    """Check that the delimited message formats are loaded without a regex"""
+    config = r"""
+        [device]
+        station = MSU
+        name = Test
+        host = 127.0.0.1
+        port = 4001
+
+        [parser]
+        format = kv
+        fields = TA1:TA1, PM25: PM2.5
+        delimiter = \t
+        pack_length = 12000
+        destination = ./data/
+
+        [logging]
+        level = DEBUG
+        file = readport_${device:port}.log
+    """
+    with StringIO(config) as f:
+        conf = load_config(f)
+
+    assert conf.format == Format("kv", dict(TA1=b"TA1", PM25=b"PM2.5"), b"\t", b"=")
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        "format = xml",
+        "format = csv",
+        "format = csv\nfields = u:x",
+        "format = kv\nfields = u",
+        "format = kv\nfields = time:T",
+    ],
+    ids=["unknown format", "missing fields", "not a column", "no key", "reserved"],
+)
+def test_format_errors(options):
+    """Ensure that the message format settings are checked"""
+    config = f"""
+[device]
+station = MSU
+name = Test
+host = 127.0.0.1
+port = 4001
+
+[parser]
+{options}
+pack_length = 12000
+destination = ./data/
+
+[logging]
+level = DEBUG
+file = readport.log
+"""
+    with StringIO(config) as f:
+        with pytest.raises(ConfigurationError):
+            load_config(f)
+
+
+def test_deferred_columnar():
+    """Ensure that deferred conversion is rejected with the columnar buffer"""
+    config = """
+[device]
+station = MSU
+name = Test
+host = 127.0.0.1
+port = 4001
+
+[parser]
+regex = ^(?P<u>\\S+)
+pack_length = 12000
+destination = ./data/
+columnar = yes
+deferred = yes
+
+[logging]
+level = DEBUG
+file = readport.log
+"""
+    with StringIO(config) as f:
+        with pytest.raises(ConfigurationError, match="deferred"):
+            load_config(f)
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("none", Compression("none")),
+        ("zlib", Compression("zlib", 6)),
+        ("zlib:1", Compression("zlib", 1)),
+        ("bz2", Compression("bz2", 9)),
+        ("lzma:0", Compression("lzma", 0)),
+    ],
+)
+def test_compression(value, expected):
+    """Check that the codec and the level are parsed, with a default level"""
+    assert Compression.from_config(value) == expected
+
+
+@pytest.mark.parametrize("value", ["gzip", "zlib:10", "bz2:0", "lzma:x", "none:1"])
+def test_compression_errors(value):
+    """Ensure that unknown codecs and invalid levels are rejected"""
+    with pytest.raises(ConfigurationError):
+        Compression.from_config(value)
+
+
+@pytest.mark.parametrize(
+    "parser_option, transport_option",
+    [
+        ("deferred = yes", ""),
+        ("pending_packs = 2", ""),
+        ("", "journal_dir = ./j/"),
+        ("decimals = u:3", ""),
+    ],
+    ids=["deferred", "pending_packs", "journal_dir", "decimals"],
+)
+def test_checkpoint_errors(parser_option, transport_option):
+    """Ensure that the checkpoint is rejected with the options it can't work with"""
+    config = f"""
+[device]
+station = MSU
+name = Test
+host = 127.0.0.1
+port = 4001
+
+[parser]
+regex = ^(?P<u>\\S+)
+pack_length = 12000
+destination = ./data/
+checkpoint_dir = ./checkpoint/
+{parser_option}
+
+[transport]
+{transport_option}
+
+[logging]
+level = DEBUG
+file = readport.log
+"""
+    with StringIO(config) as f:
+        with pytest.raises(ConfigurationError, match="checkpoint_dir"):
+            load_config(f)
+
+
+@pytest.mark.parametrize("compression", ["zlib:1", "lzma"])
+def test_zdict(tmp_path, compression):
+    """Check that the current preset dictionary is loaded if there is one, for zlib
+    only"""
+    zdict = tmp_path / "zdict_4001"
+    config = f"""
+[device]
+station = MSU
+name = Test
+host = 127.0.0.1
+port = 4001
+
+[parser]
+regex = ^(?P<u>\\S+)
+pack_length = 12000
+destination = ./data/
+compression = {compression}
+zdict = {zdict}
+
+[logging]
+level = DEBUG
+file = readport.log
+"""
+    if compression == "lzma":
+        with StringIO(config) as f:
+            with pytest.raises(ConfigurationError, match="zdict"):
+                load_config(f)
+        return
+
+    with StringIO(config) as f:
+        assert load_config(f).compression == Compression("zlib", 1)
+    save_zdict(zdict, b"old dictionary")
+    save_zdict(zdict, b"dictionary")
+    with StringIO(config) as f:
+        conf = load_config(f)
+    assert conf.zdict == str(zdict)
+    assert conf.compression == Compression("zlib", 1, b"dictionary")
+    assert len(list(zdict.glob("*.zdict"))) == 2
+
+
+def test_unsupported_options():
+    """Check that the settings ignored by --config-dir are found, unless they are left
+    at their defaults"""
+    config = r"""
+        [device]
+        station = MSU
+        name = Test
+        host = 127.0.0.1
+        port = 4001
+        {device}
+
+        [parser]
+        regex = ^(?P<u>\S+)
+        pack_length = 12000
+        destination = ./data/
+
+        [transport]
+        {transport}
+
+        [logging]
+        level = DEBUG
+        file = readport.log
+        {logging}
+    """
+    with StringIO(config.format(device="", transport="", logging="")) as f:
+        assert unsupported_options(load_config(f)) == []
+
+    options = dict(
+        device="kernel_timestamps = yes",
+        transport="batch_size = 100\n        spill_file = test.spill",
+        logging="metrics_interval = 10",
+    )
+    with StringIO(config.format(**options)) as f:
+        assert unsupported_options(load_config(f)) == [
+            "kernel_timestamps",
+            "batch_size",
+            "spill_file",
+        ]
@@ -1,10 +1,36 @@
+import os
 import random
+import threading
 import time
+import zipfile
+import zlib
 from collections import defaultdict
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import numpy as np
 import pytest
-from readport import Buffer, Group, Item, Parser, ParseError
+from readport import (
+    Buffer,
+    Coalescer,
+    ColumnarBuffer,
+    Compression,
+    Format,
+    Group,
+    Item,
+    MappedBuffer,
+    Parser,
+    ParseError,
+    benchmark_codecs,
+    decode_fixed,
+    regularize_time,
+    load_npz,
+    replay,
+    save_npz,
+    save_zdict,
+    train_dictionary,
+    train_zdict,
+)
 
 
 @pytest.mark.parametrize(
@@ -24,7 +50,15 @@ def test_parser_extract(regex):
 
     item = Item(data, timestamp, False)
     parser = Parser(regex, group=Group(), pack_length=0, dest="")
-    got = parser.extract(item)
+    if "extra" in parser.variables:
+        # A capture group that doesn't participate in the match is a missing value
+        with pytest.raises(ParseError):
+            parser.extract(item)
+        parser = Parser(regex, Group(), pack_length=0, dest="", missing="fill")
+        got = parser.extract(item)
+        assert np.isnan(got.pop("extra")) and got.pop("_missing") == 0b10000
+    else:
+        got = parser.extract(item)
     assert got == expected
 
 
@@ -150,6 +184,34 @@ def test_buffer_put_clear():
     )
 
 
+def test_columnar_buffer_put_clear():
+    """Check that the records are written into arrays which are reused for each pack"""
+    data = [
+        dict(level=1, rh=1.23, temp=14.94, time=100.0),
+        dict(level=2, rh=2.23, temp=11.85, time=100.5),
+        dict(level=1, rh=1.35, temp=14.85, time=101.0),
+        dict(level=1, rh=1.47, temp=14.70, time=102.0),
+        dict(level=1, rh=1.60, temp=14.56, time=103.0),
+    ]
+    buffer = ColumnarBuffer(pack_length=2, group_by="level")
+    for extracted in data[:3]:
+        buffer.put(extracted)
+
+    ((group_value, vectors),) = buffer.full()
+    assert group_value == 1
+    assert vectors.keys() == {"rh", "temp", "time"}
+    assert np.array_equal(vectors["rh"], [1.23, 1.35])
+    assert vectors["time"].dtype == np.float64
+    rh = vectors["rh"]
+
+    buffer.clear(group_value=1)
+    buffer.put(data[3])
+    buffer.put(data[4])
+    ((group_value, vectors),) = buffer.full()
+    assert np.array_equal(vectors["temp"], [14.70, 14.56])
+    assert vectors["rh"] is rh
+
+
 @pytest.mark.parametrize(
     "data",
     [
@@ -169,15 +231,17 @@ def test_buffer_put_clear():
     ],
     ids=["inconsistent", "missing time", "buffer full"],
 )
-def test_buffer_errors(data):
-    buffer = Buffer(pack_length=2, group_by="level")
+@pytest.mark.parametrize("buffer_type", [Buffer, ColumnarBuffer])
+def test_buffer_errors(data, buffer_type):
+    buffer = buffer_type(pack_length=2, group_by="level")
 
     with pytest.raises(AssertionError):
         for extracted in data:
             buffer.put(extracted)
 
 
-def test_parser_write_ok(tmp_path):
+@pytest.mark.parametrize("columnar", [False, True], ids=["lists", "columnar"])
+def test_parser_write_ok(tmp_path, columnar):
     """Ensure that files are written properly"""
     all_vars = ["u", "v", "w", "temp", "time"]
     pack_length = 2
@@ -190,7 +254,9 @@ def test_parser_write_ok(tmp_path):
     n_iter = 2
     buffers = [defaultdict(list) for _ in range(n_iter)]
 
-    parser = Parser(regex=b"", group=Group(), pack_length=pack_length, dest=dest)
+    parser = Parser(
+        regex=b"", group=Group(), pack_length=pack_length, dest=dest, columnar=columnar
+    )
 
     for i in range(n_iter):
         for _ in range(pack_length):
@@ -293,3 +359,880 @@ def test_parser_write_group_by(tmp_path):
                 expected = np.array(buffers[level][var])
                 assert np.array_equal(data[var], expected)
                 assert data[var].dtype == expected.dtype
+
+
+def test_parser_watermark(tmp_path):
+    """Check that the watermark points at the oldest message not yet saved to disk"""
+    dest = tmp_path / "MSU_Test{group}_{date:%H-%M-%S-%f}.npz"
+    parser = Parser(
+        regex=b"", group=Group(by="level", dtype="int"), pack_length=2, dest=dest
+    )
+    assert parser.watermark is None
+
+    parser.write(dict(level=1, rh=1.23, time=100.0), seq=10)
+    parser.write(dict(level=2, rh=2.23, time=101.0), seq=11)
+    assert parser.watermark == 10
+
+    # Saving the first group moves the watermark to the second one
+    parser.write(dict(level=1, rh=1.35, time=102.0), seq=12)
+    assert parser.watermark == 11
+
+    parser.write(dict(level=2, rh=2.35, time=103.0), seq=13)
+    assert parser.watermark is None
+
+
+def test_replay(tmp_path, make_conf):
+    """Check that a recorded file is parsed with synthesized timestamps"""
+    capture = tmp_path / "data.bin"
+    capture.write_bytes(
+        b"01 RH= 1.23 %RH T= 14.94 'C \r\n"
+        b"01 RH= 1.35 %RH T= 14.85 'C \r\n"
+        b"garbage\r\n"
+        b"01 RH= 1.47 %RH T= 14.70 'C \r\n"
+        b"01 RH= 1.60 %RH T= 14.56 'C \r\n"
+        b"01 RH= 1.72"
+    )
+    end = 1610713847.0
+    os.utime(capture, (end, end))
+    conf = make_conf(destination=tmp_path / "data")
+
+    replay(conf, capture, rate=2)
+
+    files = sorted(p.name for p in (tmp_path / "data").glob("*.npz"))
+    assert files == [
+        "MSU_Test_2021-01-15_12-30-45.npz",
+        "MSU_Test_2021-01-15_12-30-46.npz",
+    ]
+    with np.load(tmp_path / "data" / files[1]) as data:
+        assert np.array_equal(data["rh"], [1.47, 1.60])
+        assert np.array_equal(data["time"], [end - 1.0, end - 0.5])
+
+
+def test_replay_isolated(tmp_path, make_conf):
+    """Ensure that a replay leaves the checkpoint and the open coalescing containers of
+    the running daemon alone"""
+    capture = tmp_path / "data.bin"
+    capture.write_bytes(b"01 RH= 1.23 %RH T= 14.94 'C \r\n" * 3)
+    os.utime(capture, (1610713847.0, 1610713847.0))
+    conf = make_conf(
+        f"checkpoint_dir = {tmp_path / 'checkpoint'}\ncoalesce = hour",
+        destination=tmp_path / "data",
+    )
+
+    # The daemon has an open container with a pack, and a record in the checkpoint
+    daemon = Parser.from_config(conf)
+    for i in range(3):
+        item = Item(b"01 RH= 1.00 %RH T= 10.00 'C", 100.0 + i, False)
+        daemon.write(daemon.extract(item))
+    (checkpoint,) = (tmp_path / "checkpoint").glob("*.buf")
+    (container,) = (tmp_path / "data").glob("*.npz.tmp")
+    buffered, contained = checkpoint.read_bytes(), container.read_bytes()
+
+    replay(conf, capture, rate=2)
+    assert checkpoint.read_bytes() == buffered
+    assert container.read_bytes() == contained
+    assert len(list((tmp_path / "data").glob("*.npz"))) == 2
+
+
+def test_regularize_time():
+    """Check that the sampling times are recovered from jittery receive times"""
+    rate = 20
+    rng = np.random.default_rng(0)
+    # A device clock running 500 ppm fast, with 3 samples lost
+    sampled = 1610713847.0 + np.arange(1003) / rate / (1 + 500e-6)
+    sampled = np.delete(sampled, [100, 101, 500])
+    received = sampled + 0.01 + rng.exponential(0.005, len(sampled))
+    # Delayed messages arriving in a burst
+    received[700:704] = received[704]
+
+    result = regularize_time(received, rate)
+
+    assert result["time_gaps"] == 3
+    assert abs(result["time_drift"] - 500) < 50
+    assert 0 < result["time_jitter"] < 0.01
+    # Only the mean delay remains
+    assert np.ptp(result["time_regular"] - sampled) < 0.001
+
+
+def test_parser_write_sample_rate(tmp_path):
+    """Ensure that the regularized time is saved next to the raw time"""
+    dest = tmp_path / "MSU_Test{group}_{date:%H-%M-%S-%f}.npz"
+    parser = Parser(regex=b"", group=Group(), pack_length=4, dest=dest, sample_rate=2)
+
+    for t in [100.0, 100.6, 101.0, 101.5]:
+        parser.write(dict(u=1.0, time=t))
+
+    (file,) = tmp_path.glob("*.npz")
+    with np.load(file) as data:
+        assert np.array_equal(data["time"], [100.0, 100.6, 101.0, 101.5])
+        assert np.allclose(np.diff(data["time_regular"]), 0.5, atol=0.01)
+        assert data["time_gaps"] == 0
+
+
+@pytest.mark.parametrize("columnar", [False, True], ids=["lists", "columnar"])
+def test_parser_dtypes(tmp_path, columnar):
+    """Ensure that the variables are saved with the configured data types"""
+    regex = br"^(?P<u>\S+) (?P<status>\S+)$"
+    dest = tmp_path / "MSU_Test{group}_{date:%H-%M-%S-%f}.npz"
+    dtypes = dict(
+        u=np.dtype("float32"), status=np.dtype("uint8"), time=np.dtype("int64")
+    )
+    parser = Parser(
+        regex, Group(), pack_length=2, dest=dest, columnar=columnar, dtypes=dtypes
+    )
+
+    items = [
+        Item(b"1.5 255", 1610713847.25, False),
+        Item(b"2.5 256", 1610713847.5, False),  # out of range
+        Item(b"3.5 1.5", 1610713847.5, False),  # not an integer
+        Item(b"4.5 7", 1610713847.75, False),
+    ]
+    for item in items:
+        try:
+            parser.write(parser.extract(item))
+        except ParseError:
+            pass
+
+    (file,) = tmp_path.glob("*.npz")
+    with np.load(file) as data:
+        assert data["u"].dtype == np.float32
+        assert np.array_equal(data["status"], np.array([255, 7], dtype=np.uint8))
+        assert np.array_equal(data["time"], [1610713847250000000, 1610713847750000000])
+
+
+@pytest.mark.parametrize("columnar", [False, True], ids=["lists", "columnar"])
+def test_parser_missing_fill(tmp_path, columnar):
+    """Ensure that the records with missing values are saved with a bitmask"""
+    regex = br"^(?P<level>\d+) SO2=(?P<so2>\S+) PM10=(?P<pm10>\S+)( ID=(?P<id>\d+))?$"
+    dest = tmp_path / "MSU_Test{group}_{date:%H-%M-%S-%f}.npz"
+    parser = Parser(
+        regex,
+        Group(by="level", dtype="int"),
+        pack_length=3,
+        dest=dest,
+        columnar=columnar,
+        dtypes=dict(id=np.dtype("uint16")),
+        missing="fill",
+    )
+
+    items = [
+        Item(b"1 SO2=0.5 PM10=12 ID=7", 100.0, False),
+        Item(b"1 SO2=/// PM10=11", 101.0, False),
+        Item(b"1 SO2=/// PM10=/// ID=9", 102.0, False),
+    ]
+    for item in items:
+        parser.write(parser.extract(item))
+
+    (file,) = tmp_path.glob("*.npz")
+    with np.load(file) as data:
+        assert list(data["_missing_vars"]) == ["so2", "pm10", "id"]
+        assert np.array_equal(data["_missing"], [0b000, 0b101, 0b011])
+        assert data["_missing"].dtype == np.uint8
+        assert np.array_equal(data["so2"], [0.5, np.nan, np.nan], equal_nan=True)
+        assert np.array_equal(data["id"], [7, 0, 9])
+        assert "level" not in data
+
+
+@pytest.mark.parametrize(
+    "regex, expected",
+    [
+        (br"^T= *(?P<temp>\S+)", dict(temp=14.94)),
+        (br"^T= *\S+", dict()),
+        # Rejected, since the optional variable is missing
+        (br"^T= *(?P<temp>\S+)( RH= *(?P<rh>\S+))?", None),
+    ],
+    ids=["single variable", "no variables", "optional variable"],
+)
+def test_parser_extract_converter(regex, expected):
+    """Check the generated conversion of unusual sets of variables"""
+    item = Item(b"T= 14.94 'C\r\n", 100.0, False)
+    parser = Parser(regex, group=Group(), pack_length=0, dest="")
+    if expected is None:
+        with pytest.raises(ParseError):
+            parser.extract(item)
+    else:
+        assert parser.extract(item) == dict(expected, time=100.0)
+
+
+@pytest.mark.parametrize(
+    "message_format, data",
+    [
+        (
+            Format("csv", dict(u=1, v=2, w=3, temp=5), b","),
+            b"\x02Q,+000.079,-000.102,+000.095,M,+014.94,0000001,\x030F\r\n",
+        ),
+        (
+            Format("csv", dict(u=1, v=3, w=5, temp=7)),
+            b"x= 0.079 y= -0.102 z= 0.095 T= 14.94\r\n",
+        ),
+        (
+            Format("kv", dict(u=b"U", v=b"V", w=b"W", temp=b"T"), b","),
+            b"U=0.079,V=-0.102,W=0.095,STATUS=0,T=14.94\r\n",
+        ),
+    ],
+    ids=["csv", "whitespace", "kv"],
+)
+def test_parser_extract_format(message_format, data):
+    """Check that delimited messages are parsed without a regex"""
+    item = Item(data, 100.0, False)
+    parser = Parser(
+        b"", group=Group(), pack_length=0, dest="", message_format=message_format
+    )
+    assert parser.extract(item) == dict(
+        u=0.079, v=-0.102, w=0.095, temp=14.94, time=100.0
+    )
+
+
+def test_parser_extract_format_errors():
+    """Ensure that incomplete delimited messages are rejected or filled"""
+    csv = Format("csv", dict(u=1, v=2), b",")
+    kv = Format("kv", dict(so2=b"SO2", pm25=b"PM2.5"), b",")
+    parser = Parser(b"", group=Group(), pack_length=0, dest="", message_format=csv)
+    with pytest.raises(ParseError) as exc_info:
+        parser.extract(Item(b"Q,1.5\r\n", 100.0, False))
+    assert isinstance(exc_info.value.args[0], IndexError)
+
+    parser = Parser(b"", group=Group(), pack_length=0, dest="", message_format=kv)
+    with pytest.raises(ParseError) as exc_info:
+        parser.extract(Item(b"garbage\r\n", 100.0, False))
+    assert isinstance(exc_info.value.args[0], KeyError)
+
+    parser = Parser(
+        b"", Group(), pack_length=0, dest="", missing="fill", message_format=kv
+    )
+    extracted = parser.extract(Item(b"SO2=///,CO=1.0\r\n", 100.0, False))
+    assert np.isnan(extracted["so2"]) and np.isnan(extracted["pm25"])
+    assert extracted["_missing"] == 0b11
+
+
+@pytest.mark.parametrize(
+    "regex, message_format",
+    [
+        (
+            br"^(?P<level>\S+) RH= *(?P<rh>\S+) %RH T= *(?P<temp>\S+) .C (?P<id>\d+)\s*$",
+            None,
+        ),
+        (
+            br"(?P<level>\S+) RH= *(?P<rh>\S+) %RH T= *(?P<temp>\S+) .C (?P<id>\S+)",
+            None,
+        ),
+        (b"", Format("csv", dict(level=0, rh=2, temp=5, id=7))),
+    ],
+    ids=["regex", "unanchored", "csv"],
+)
+@pytest.mark.parametrize("missing", ["reject", "fill"])
+def test_parser_extract_many(regex, message_format, missing):
+    """Check that a batch is parsed the same way as the individual messages"""
+    data = [
+        b"01 RH= 1.23 %RH T= 14.94 'C 1\r\n",
+        b"H= 1.35 %RH T= 14.85 'C 2\r\n",
+        b"02 RH= 2.35 %RH T= 11.97 'C 3\r\n",
+        b"02 RH= /// %RH T= 11.98 'C 4\r\n",
+        b"01 RH= 1.47 %RH T= abc 'C 5\r\n",
+        b"01 RH= 1.60 %RH T= 14.56 'C 300\r\n",
+        b"02 RH= 2.60 %RH T= 11.56 'C 7\r\n",
+    ]
+    items = [Item(line, 100.0 + i, i == 0) for i, line in enumerate(data)]
+    parser = Parser(
+        regex,
+        Group(by="level", dtype="int"),
+        pack_length=0,
+        dest="",
+        dtypes=dict(id=np.dtype("uint8")),
+        missing=missing,
+        message_format=message_format,
+    )
+
+    columns, failed = parser.extract_many(items)
+
+    expected = []
+    for item in items:
+        try:
+            expected.append(parser.extract(item))
+        except ParseError:
+            expected.append(None)
+    assert failed == [i for i, extracted in enumerate(expected) if extracted is None]
+
+    expected = [extracted for extracted in expected if extracted is not None]
+    assert columns.keys() == expected[0].keys()
+    for var, column in columns.items():
+        np.testing.assert_array_equal(
+            column, [extracted[var] for extracted in expected]
+        )
+
+
+@pytest.mark.parametrize(
+    "message_format, line",
+    [
+        (Format("csv", dict(u=1, v=2), b","), line)
+        for line in [b"Q,1.5,2", b"Q,,2", b"Q,1.5,", b"Q,///,2", b"Q,1.5", b"Q,x,2"]
+    ]
+    + [
+        (Format("kv", dict(u=b"U", v=b"V"), b","), line)
+        for line in [b"U=1.5,V=2", b"U=,V=2", b"V=2", b"U=///,V=2", b"W=1", b"U=x"]
+    ],
+)
+@pytest.mark.parametrize("missing", ["reject", "fill"])
+def test_parser_extract_parity(message_format, line, missing):
+    """Ensure that a message is parsed the same way alone and in a batch"""
+    parser = Parser(
+        b"",
+        Group(),
+        pack_length=0,
+        dest="",
+        missing=missing,
+        message_format=message_format,
+    )
+    item = Item(line, 100.0, False)
+    columns, failed = parser.extract_many([item])
+    try:
+        extracted = parser.extract(item)
+    except ParseError:
+        assert failed == [0]
+    else:
+        assert failed == []
+        assert columns.keys() == extracted.keys()
+        for var, column in columns.items():
+            np.testing.assert_array_equal(column, [extracted[var]])
+
+
+@pytest.mark.parametrize("columnar", [False, True], ids=["lists", "columnar"])
+def test_parser_write_many(tmp_path, columnar):
+    """Ensure that batches are saved in the same packs as the individual records"""
+    regex = br"^(?P<level>\S+) (?P<u>\S+)$"
+    items = [Item(b"%d %d\n" % (i % 2, i), 100.0 + i, False) for i in range(11)]
+
+    saved = []
+    for batch in [False, True]:
+        dest = tmp_path / str(batch) / "MSU_Test{group}_{date:%Y-%m-%d_%H-%M-%S}.npz"
+        parser = Parser(
+            regex,
+            Group(by="level", dtype="int"),
+            pack_length=2,
+            dest=dest,
+            date_from_data=True,
+            columnar=columnar,
+        )
+        if batch:
+            parser.write_many(*parser.extract_many(items)[:1], seqs=np.arange(11))
+        else:
+            for seq, item in enumerate(items):
+                parser.write(parser.extract(item), seq)
+        assert parser.watermark == 9
+        saved.append(sorted((tmp_path / str(batch)).glob("*.npz")))
+
+    assert [p.name for p in saved[0]] == [p.name for p in saved[1]]
+    for single, batch in zip(*saved):
+        with np.load(single) as expected, np.load(batch) as data:
+            assert np.array_equal(expected["u"], data["u"])
+            assert np.array_equal(expected["time"], data["time"])
+
+
+@pytest.mark.parametrize("batch", [False, True], ids=["write", "write_many"])
+@pytest.mark.parametrize("missing", ["reject", "fill"])
+def test_parser_deferred(tmp_path, missing, batch):
+    """Ensure that deferred conversion drops the invalid records at flush time"""
+    regex = br"^(?P<level>\d+) (?P<u>\S+) (?P<status>\S+)$"
+    dest = tmp_path / "MSU_Test{group}_{date:%H-%M-%S-%f}.npz"
+    parser = Parser(
+        regex,
+        Group(by="level", dtype="int"),
+        pack_length=4,
+        dest=dest,
+        dtypes=dict(status=np.dtype("uint8")),
+        missing=missing,
+        deferred=True,
+    )
+
+    items = [
+        Item(b"1 0.5 7", 100.0, False),
+        Item(b"1 abc 7", 101.0, False),
+        Item(b"1 /// 300", 102.0, False),
+        Item(b"1 /// 8", 103.0, False),
+    ]
+    if batch:
+        parser.write_many(parser.extract_many(items)[0])
+    else:
+        for item in items:
+            parser.write(parser.extract(item))
+
+    (file,) = tmp_path.glob("*.npz")
+    with np.load(file) as data:
+        if missing == "fill":
+            assert np.array_equal(data["u"], [0.5, np.nan], equal_nan=True)
+            assert np.array_equal(data["status"], [7, 8])
+            assert np.array_equal(data["time"], [100.0, 103.0])
+            assert np.array_equal(data["_missing"], [0b00, 0b01])
+        else:
+            assert np.array_equal(data["u"], [0.5])
+            assert np.array_equal(data["time"], [100.0])
+        assert "level" not in data
+
+
+@pytest.mark.parametrize("batch", [False, True], ids=["write", "write_many"])
+@pytest.mark.parametrize(
+    "mode", ["lists", "columnar", "deferred"], ids=["lists", "columnar", "deferred"]
+)
+def test_parser_fixed_point(tmp_path, mode, batch):
+    """Ensure that the fixed-point variables are saved as scaled integers, which decode
+    to the values of the messages, and that the values with more decimals are rejected
+    """
+    regex = br"^(?P<u>\S+) (?P<temp>\S+) (?P<p>\S+)$"
+    dest = tmp_path / "MSU_Test{group}_{date:%H-%M-%S-%f}.npz"
+    parser = Parser(
+        regex,
+        Group(),
+        pack_length=5,
+        dest=dest,
+        missing="fill",
+        columnar=mode == "columnar",
+        deferred=mode == "deferred",
+        decimals=dict(u=3, temp=None, p=None),
+    )
+
+    items = [
+        Item(b"+000.079 /// 1013.25", 100.0, False),
+        Item(b"-000.102 +014.94 99000.5", 101.0, False),
+        Item(b"+000.0795 +014.94 1000", 102.0, False),
+        Item(b"+001.000 -002.50 1013", 103.0, False),
+        Item(b"+000.001 +015.00 1013.2", 104.0, False),
+    ]
+    if batch:
+        parser.write_many(parser.extract_many(items)[0])
+    else:
+        for item in items:
+            try:
+                parser.write(parser.extract(item))
+            except ParseError:
+                pass
+    parser.flush(partial=True)
+
+    # The decimals of temp are counted in the second message
+    assert parser.decimals == dict(u=3, temp=2, p=2)
+    (file,) = tmp_path.glob("*.npz")
+    with np.load(file) as data:
+        assert data["u"].dtype == data["p"].dtype == np.int32
+        assert np.array_equal(data["u"], [79, -102, 1000, 1])
+        assert list(data["_fixed_vars"]) == ["u", "temp", "p"]
+        assert list(data["_fixed_decimals"]) == [3, 2, 2]
+        decoded = decode_fixed(data)
+
+    assert "_fixed_vars" not in decoded and "_fixed_decimals" not in decoded
+    assert np.array_equal(decoded["u"], [0.079, -0.102, 1.0, 0.001])
+    assert np.array_equal(decoded["temp"], [np.nan, 14.94, -2.5, 15.0], equal_nan=True)
+    assert np.array_equal(decoded["p"], [1013.25, 99000.5, 1013.0, 1013.2])
+    assert np.array_equal(decoded["time"], [100.0, 101.0, 103.0, 104.0])
+
+
+@pytest.mark.parametrize("batch", [False, True], ids=["write", "write_many"])
+@pytest.mark.parametrize("mode", ["lists", "deferred", "background", "coalesce"])
+def test_parser_fixed_point_auto(tmp_path, mode, batch):
+    """Ensure that the decimals counted in the values grow with them, and that the
+    records buffered until then are saved with the previous decimals"""
+    parser = Parser(
+        br"^(?P<u>\S+)",
+        Group(),
+        pack_length=10,
+        dest=tmp_path / "MSU_Test{group}_{date:%H-%M-%S}.npz",
+        date_from_data=True,
+        deferred=mode == "deferred",
+        pending_packs=2 if mode == "background" else None,
+        coalesce="hour" if mode == "coalesce" else None,
+        decimals=dict(u=None),
+    )
+    batches = [
+        [b"1.5", b"2"],
+        [b"30000.25", b"-4.5"],
+        [b"5.1", b"0.0000001234", b"7.125"],
+    ]
+    timestamp = 1610712000.0  # 2021-01-15 12:00:00
+    for batch_data in batches:
+        items = []
+        for data in batch_data:
+            items.append(Item(data, timestamp, False))
+            timestamp += 1
+        if batch:
+            parser.write_many(parser.extract_many(items)[0])
+        else:
+            for item in items:
+                try:
+                    parser.write(parser.extract(item))
+                except ParseError:
+                    pass
+    parser.flush(partial=True)
+    parser.close()
+
+    assert parser.decimals == dict(u=3)
+    values, scales = [], []
+    for file in sorted(tmp_path.glob("*.npz")):
+        with np.load(file) as data:
+            assert data["u"].dtype == np.int32
+            scales.extend(data["_fixed_decimals"].tolist())
+            values.extend(decode_fixed(data)["u"].tolist())
+    assert values == [1.5, 2.0, 30000.25, -4.5, 5.1, 7.125]
+    assert scales == [1, 2, 3]
+
+
+@pytest.mark.parametrize("columnar", [False, True], ids=["lists", "columnar"])
+def test_parser_background_writer(tmp_path, monkeypatch, columnar):
+    """Ensure that the packs saved in the background are held by the watermark"""
+    saving = threading.Event()
+    savez_compressed = np.savez_compressed
+
+    def blocked_savez(*args, **kwargs):
+        saving.wait(5)
+        savez_compressed(*args, **kwargs)
+
+    monkeypatch.setattr(np, "savez_compressed", blocked_savez)
+    dest = tmp_path / "MSU_Test{group}_{date:%H-%M-%S-%f}.npz"
+    parser = Parser(
+        br"^(?P<u>\S+)",
+        Group(),
+        pack_length=2,
+        dest=dest,
+        date_from_data=True,
+        columnar=columnar,
+        pending_packs=2,
+    )
+    for seq in range(5):
+        parser.write(parser.extract(Item(b"%d" % seq, 100.0 + seq, False)), seq)
+
+    # Both full packs are in flight, while the parser goes on with the next one
+    assert parser.pending_packs == 2
+    assert parser.watermark == 0
+    assert not list(tmp_path.glob("*.npz"))
+
+    saving.set()
+    parser.close()
+    assert parser.pending_packs == 0
+    assert parser.watermark == 4
+    files = sorted(tmp_path.glob("*.npz"))
+    assert len(files) == 2
+    for i, file in enumerate(files):
+        with np.load(file) as data:
+            assert np.array_equal(data["u"], [2 * i, 2 * i + 1])
+            assert np.array_equal(data["time"], [100.0 + 2 * i, 101.0 + 2 * i])
+
+
+@pytest.mark.parametrize("codec", ["none", "zlib", "bz2", "lzma"])
+@pytest.mark.parametrize("workers", [1, 2])
+def test_save_npz(tmp_path, codec, workers):
+    """Ensure that the arrays are saved as a standard npz with any of the codecs"""
+    arrays = dict(
+        u=np.random.default_rng(0).normal(size=12000).cumsum(),
+        status=np.arange(12000, dtype=np.uint8),
+        time=np.arange(12000, dtype=np.int64),
+        _missing_vars=np.array(["u", "status"]),
+    )
+    file = tmp_path / "data.npz"
+    with ThreadPoolExecutor(max_workers=workers) as pool, file.open("wb") as f:
+        save_npz(f, arrays, Compression(codec), pool if workers > 1 else None)
+
+    with zipfile.ZipFile(file) as z:
+        assert z.testzip() is None
+        assert z.namelist() == [f"{name}.npy" for name in arrays]
+        methods = {info.compress_type for info in z.infolist()}
+        assert methods == {Compression.methods[codec][0]}
+    with np.load(file) as data:
+        assert list(data.keys()) == list(arrays)
+        for name, array in arrays.items():
+            assert data[name].dtype == array.dtype
+            assert np.array_equal(data[name], array)
+
+
+def test_save_npz_zdict(tmp_path):
+    """Ensure that the files saved with a preset dictionary are valid zip files, which
+    load_npz() reads with the same dictionary only"""
+    rng = np.random.default_rng(0)
+    packs = [
+        dict(
+            temp=np.round(20 + rng.normal(size=10).cumsum() / 10, 2),
+            time=1.6e9 + np.arange(10) + 10 * i,
+        )
+        for i in range(5)
+    ]
+    zdict = train_zdict(packs[:-1])
+    assert 0 < len(zdict) <= 32768
+    assert len(train_zdict(packs, size=100)) == 100
+
+    file = tmp_path / "data.npz"
+    with file.open("wb") as f:
+        save_npz(f, packs[-1], Compression("zlib", 6, zdict))
+    with zipfile.ZipFile(file) as z:
+        assert z.testzip() is None
+        assert z.namelist() == ["temp.npy.z", "time.npy.z"]
+        assert z.comment == b"zdict=%08x" % zlib.adler32(zdict)
+
+    # The dictionary is looked up by its id, after another one has been trained
+    save_zdict(tmp_path / "zdict", zdict)
+    save_zdict(tmp_path / "zdict", train_zdict(packs[:1]))
+    for zdicts in [zdict, {zlib.adler32(zdict): zdict}, tmp_path / "zdict"]:
+        data = load_npz(file, zdicts)
+        assert list(data) == list(packs[-1])
+        for name, array in packs[-1].items():
+            assert np.array_equal(data[name], array)
+    for wrong in [None, zdict[1:], {}, tmp_path / "nowhere"]:
+        with pytest.raises(ValueError, match="dictionary"):
+            load_npz(file, wrong)
+
+
+@pytest.mark.parametrize("columnar", [False, True], ids=["lists", "columnar"])
+def test_parser_pack_duration(tmp_path, columnar):
+    """Ensure that the packs are saved after pack_duration, and on a partial flush"""
+    dest = tmp_path / "MSU_Test{group}_{date:%H-%M-%S-%f}.npz"
+    parser = Parser(
+        br"^(?P<u>\S+)",
+        Group(),
+        pack_length=10,
+        dest=dest,
+        date_from_data=True,
+        columnar=columnar,
+        pack_duration=0.05,
+    )
+    for i in range(2):
+        parser.write(parser.extract(Item(b"%d" % i, 100.0 + i, False)))
+    parser.flush()
+    assert not list(tmp_path.glob("*.npz"))
+
+    time.sleep(0.05)
+    parser.flush()
+    parser.write(parser.extract(Item(b"2", 102.0, False)))
+    parser.flush(partial=True)
+    parser.flush(partial=True)
+
+    files = sorted(tmp_path.glob("*.npz"))
+    assert len(files) == 2
+    for file, expected in zip(files, [[0, 1], [2]]):
+        with np.load(file) as data:
+            assert np.array_equal(data["u"], expected)
+
+
+def test_parser_checkpoint(tmp_path):
+    """Ensure that the buffered records are resumed from the checkpoint files"""
+    regex = br"^(?P<level>\d+) (?P<u>\S+)$"
+    dest = tmp_path / "data" / "MSU_Test{group}_{date:%H-%M-%S-%f}.npz"
+    options = dict(
+        dest=dest,
+        date_from_data=True,
+        missing="fill",
+        checkpoint_dir=tmp_path / "checkpoint",
+    )
+    items = [Item(b"1 0.5", 100.0, False), Item(b"2 ///", 101.0, False)]
+    items += [Item(b"1 1.5", 102.0, False)]
+
+    parser = Parser(regex, Group(by="level", dtype="int"), 3, **options)
+    parser.write_many(parser.extract_many(items)[0])
+    del parser  # without saving, like a crash
+    assert len(list((tmp_path / "checkpoint").glob("*.buf"))) == 2
+    assert not (tmp_path / "data").exists()
+
+    # The pack of the first group is completed after a restart
+    parser = Parser(regex, Group(by="level", dtype="int"), 3, **options)
+    parser.write(parser.extract(Item(b"1 2.5", 103.0, False)))
+    (file,) = (tmp_path / "data").glob("*.npz")
+    with np.load(file) as data:
+        assert np.array_equal(data["u"], [0.5, 1.5, 2.5])
+        assert np.array_equal(data["time"], [100.0, 102.0, 103.0])
+    del parser
+
+    # The second group is saved right away, since pack_length has changed
+    file.unlink()
+    parser = Parser(regex, Group(by="level", dtype="int"), 5, **options)
+    (file,) = (tmp_path / "data").glob("*.npz")
+    with np.load(file) as data:
+        assert np.array_equal(data["u"], [np.nan], equal_nan=True)
+        assert np.array_equal(data["_missing"], [1])
+    assert len(list((tmp_path / "checkpoint").glob("*.buf"))) == 0
+
+
+def test_parser_checkpoint_full(tmp_path):
+    """Ensure that a full pack resumed from the checkpoint is saved right away, e.g.
+    after a power loss between saving and clearing it"""
+    checkpoint = tmp_path / "checkpoint"
+    buffer = MappedBuffer(checkpoint, 3)
+    buffer.put_many(dict(u=np.array([0.5, 1.5, 2.5]), time=np.arange(100.0, 103.0)))
+    del buffer
+
+    dest = tmp_path / "data" / "MSU_Test{group}_{date:%H-%M-%S-%f}.npz"
+    parser = Parser(
+        br"^(?P<u>\S+)$",
+        Group(),
+        3,
+        dest=dest,
+        date_from_data=True,
+        checkpoint_dir=checkpoint,
+    )
+    (file,) = (tmp_path / "data").glob("*.npz")
+    with np.load(file) as data:
+        assert np.array_equal(data["u"], [0.5, 1.5, 2.5])
+
+    # Parsing goes on into the cleared buffer
+    for i in range(3):
+        parser.write(parser.extract(Item(b"%d" % i, 200.0 + i, False)))
+    assert len(list((tmp_path / "data").glob("*.npz"))) == 2
+
+
+def test_parser_checkpoint_new_variable(tmp_path):
+    """Ensure that the records buffered before a variable is added are saved right
+    away"""
+    options = dict(
+        dest=tmp_path / "data" / "MSU_Test{group}_{date:%H-%M-%S-%f}.npz",
+        date_from_data=True,
+        checkpoint_dir=tmp_path / "checkpoint",
+    )
+    parser = Parser(br"^(?P<u>\S+) (?P<v>\S+)", Group(), 3, **options)
+    parser.write(parser.extract(Item(b"1 2 3", 100.0, False)))
+    del parser  # without saving, like a crash
+
+    parser = Parser(br"^(?P<u>\S+) (?P<v>\S+) (?P<w>\S+)", Group(), 3, **options)
+    (file,) = (tmp_path / "data").glob("*.npz")
+    with np.load(file) as data:
+        assert sorted(data.files) == ["time", "u", "v"]
+    assert not list((tmp_path / "checkpoint").glob("*.buf"))
+    parser.write(parser.extract(Item(b"1 2 3", 101.0, False)))
+
+
+def test_parser_coalesce(tmp_path):
+    """Ensure that the packs of an hour are sealed into a single file"""
+    start = 1610712000.0  # 2021-01-15 12:00:00
+    options = dict(
+        dest=tmp_path / "MSU_Test{group}_{date:%Y-%m-%d_%H-%M-%S}.npz",
+        date_from_data=True,
+        sample_rate=0.1,
+        missing="fill",
+        coalesce="hour",
+    )
+    parser = Parser(br"^(?P<u>\S+)", Group(), 2, **options)
+    for i, offset in enumerate([0, 10, 20, 30, 3600, 3610, 3620]):
+        parser.write(parser.extract(Item(b"%d" % i, start + offset, False)))
+
+    # The container of the first hour is sealed once a pack of the next hour arrives
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "MSU_Test_2021-01-15_12-00-10.npz",
+        "MSU_Test_2021-01-15_13-00-10.npz.tmp",
+    ]
+    with np.load(tmp_path / "MSU_Test_2021-01-15_12-00-10.npz") as data:
+        assert np.array_equal(data["u"], [0, 1, 2, 3])
+        assert np.array_equal(data["time"], start + np.array([0, 10, 20, 30]))
+        assert np.array_equal(data["_pack_lengths"], [2, 2])
+        assert data["time_gaps"].shape == (2,)
+        assert list(data["_missing_vars"]) == ["u"]
+
+    # A container left over by a crash is sealed by the next run, and the
+    # partially filled pack is lost
+    del parser
+    Parser(br"^(?P<u>\S+)", Group(), 2, **options)
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "MSU_Test_2021-01-15_12-00-10.npz",
+        "MSU_Test_2021-01-15_13-00-10.npz",
+    ]
+    with np.load(tmp_path / "MSU_Test_2021-01-15_13-00-10.npz") as data:
+        assert np.array_equal(data["u"], [4, 5])
+        assert np.array_equal(data["_pack_lengths"], [2])
+
+
+def test_coalescer_unique_names(tmp_path):
+    """Ensure that neither sealed files nor containers are overwritten"""
+    coalescer = Coalescer("hour", lambda target, vectors: np.savez(target, **vectors))
+    target = tmp_path / "data.npz"
+    target.write_bytes(b"sealed")
+    date = datetime(2021, 1, 15, 12)
+    coalescer.add(None, target, date, {"time": np.array([1.0])})
+    coalescer.seal_all()
+    assert target.read_bytes() == b"sealed"
+    with np.load(tmp_path / "data.1.npz") as data:
+        assert np.array_equal(data["time"], [1.0])
+
+    # A container of the same name was sealed while this one was open
+    coalescer.add(None, target, date, {"time": np.array([2.0])})
+    (tmp_path / "data.2.npz").write_bytes(b"sealed")
+    coalescer.seal_all()
+    assert (tmp_path / "data.2.npz").read_bytes() == b"sealed"
+    with np.load(tmp_path / "data.2.1.npz") as data:
+        assert np.array_equal(data["time"], [2.0])
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_coalescer_damaged(tmp_path):
+    """Ensure that a container torn by a crash is truncated to its complete packs,
+    that a failed append is rolled back, and that unreadable containers are set aside
+    """
+    coalescer = Coalescer("hour", lambda target, vectors: np.savez(target, **vectors))
+    date = datetime(2021, 1, 15, 12)
+    for i in range(3):
+        vectors = {"time": np.array([float(i)]), "u": np.array([i])}
+        coalescer.add(None, tmp_path / "data.npz", date, vectors)
+
+    # An append that fails halfway leaves the previous packs intact
+    with pytest.raises(ValueError):
+        vectors = {"time": np.array([3.0]), "u": np.array([None])}
+        coalescer.add(None, tmp_path / "data.npz", date, vectors)
+    vectors = {"time": np.array([4.0]), "u": np.array([4])}
+    coalescer.add(None, tmp_path / "data.npz", date, vectors)
+
+    # A crash while the last pack is written, after its first variable
+    container = tmp_path / "data.npz.tmp"
+    data = container.read_bytes()
+    with zipfile.ZipFile(container) as z:
+        (info,) = [info for info in z.infolist() if info.filename == "3/u.npy"]
+    container.write_bytes(data[: info.header_offset + 40])
+    coalescer._containers.clear()
+
+    # Empty or unreadable containers
+    (tmp_path / "empty.npz.tmp").write_bytes(b"")
+    (tmp_path / "bad.npz.tmp").write_bytes(b"PK\x03\x04" + bytes(100))
+
+    coalescer.recover(str(tmp_path / "*.npz.tmp"))
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "bad.npz.bad.tmp",
+        "data.npz",
+        "empty.npz.bad.tmp",
+    ]
+    with np.load(tmp_path / "data.npz") as data:
+        assert np.array_equal(data["time"], [0.0, 1.0, 2.0])
+        assert np.array_equal(data["u"], [0, 1, 2])
+        assert np.array_equal(data["_pack_lengths"], [1, 1, 1])
+
+
+def test_train_dictionary(tmp_path, make_conf):
+    """Ensure that the dictionary is trained on the files given, e.g. after they have
+    been uploaded, or on those in dest_dir"""
+    zdict_dir = tmp_path / "zdict"
+    conf = make_conf(
+        f"compression = zlib\nzdict = {zdict_dir}", destination=tmp_path / "data"
+    )
+    uploaded = tmp_path / "uploaded"
+    uploaded.mkdir()
+    rng = np.random.default_rng(0)
+    for i in range(5):
+        pack = dict(temp=np.round(20 + rng.normal(size=10).cumsum() / 10, 2))
+        np.savez(uploaded / f"MSU_Test_{i}.npz", time=1.6e9 + np.arange(10), **pack)
+
+    train_dictionary(conf)
+    assert not zdict_dir.exists()
+
+    train_dictionary(conf, [uploaded])
+    (path,) = zdict_dir.glob("*.zdict")
+    assert (zdict_dir / "current").read_text() == path.stem
+
+
+def test_benchmark_codecs(tmp_path, capsys, caplog):
+    """Ensure that the files saved with a preset dictionary are skipped"""
+    packs = [dict(temp=np.arange(100) / 10, time=1.6e9 + np.arange(100))] * 2
+    np.savez(tmp_path / "plain.npz", **packs[0])
+    with (tmp_path / "zdict.npz").open("wb") as f:
+        save_npz(f, packs[1], Compression("zlib", 6, train_zdict(packs)))
+
+    benchmark_codecs([tmp_path])
+    assert "Skipped" in caplog.text and "zdict.npz" in caplog.text
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].split() == ["codec", "MB/s", "ratio"]
+    assert [line.split()[0] for line in lines[1:]] == [
+        "none",
+        "zlib:1",
+        "zlib:6",
+        "zlib:9",
+        "bz2:9",
+        "lzma:0",
+        "lzma:6",
+    ]
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import queue
 import re
@@ -7,8 +8,19 @@ from concurrent.futures import ThreadPoolExecutor
 from contextlib import ExitStack
 from typing import List
 
+import numpy as np
 import pytest
-from readport import echo, listen_device, shutdown
+from readport import (
+    CAPTURE_MAGIC,
+    CaptureWriter,
+    Journal,
+    TCPClient,
+    echo,
+    listen_device,
+    read_capture,
+    shutdown,
+    supervise,
+)
 
 HOST, PORT = "127.0.0.1", 9999
 
@@ -131,14 +143,22 @@ def store():
     class Store:
         def __init__(self):
             self.queue = queue.Queue()
+            self.batches = []
             self._received = []
 
         def __getattr__(self, name):
             while not self.queue.empty():
-                self._received.append(self.queue.get())
+                obj = self.queue.get()
+                # Unpack the batches of items
+                if isinstance(obj, list):
+                    self.batches.append(obj)
+                    self._received.extend(obj)
+                else:
+                    self._received.append(obj)
             return [getattr(item, name) for item in self._received]
 
         def reset(self):
+            self.batches = []
             self._received = []
 
     yield Store()
@@ -220,6 +240,142 @@ def test_listen_device_readline(server, store):
     assert all(t1 < t2 for t1, t2 in zip(store.timestamp, store.timestamp[1:]))
 
 
+def test_listen_device_spill_replay(server, tmp_path):
+    """Ensure that the spilled messages are replayed while the device is quiet"""
+    full_queue = queue.Queue(maxsize=1)
+    received = []
+
+    def consume():
+        # Let the messages that don't fit into the queue spill
+        time.sleep(0.3)
+        while len(received) < 3:
+            try:
+                obj = full_queue.get(timeout=5)
+            except queue.Empty:
+                break
+            # The spilled messages are replayed in batches
+            received.extend(
+                item.data for item in (obj if isinstance(obj, list) else [obj])
+            )
+        server.send([b"<shutdown>"])
+
+    server.send([b"message 1\nmessage 2\nmessage 3\n"])
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(consume)
+        listen_device(full_queue, HOST, PORT, spill_file=tmp_path / "test.spill")
+        future.result()
+    assert received == [b"message 1\n", b"message 2\n", b"message 3\n"]
+
+
+def test_listen_device_journal_sync(server, store, tmp_path):
+    """Ensure that the journal is flushed while the device is quiet, rather than with
+    the next message"""
+    journal = Journal(tmp_path, sync_interval=0.1)
+    journal.recover()
+    unsynced = []
+
+    def check():
+        time.sleep(0.5)
+        try:
+            unsynced.append(journal.unsynced)
+        finally:
+            server.send([b"<shutdown>"])
+
+    server.send([b"message 1\nmessage 2\n"])
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(check)
+        listen_device(store.queue, HOST, PORT, journal=journal)
+        future.result()
+    assert store.data == [b"message 1\n", b"message 2\n"]
+    assert unsynced == [False]
+
+
+def test_client_readlines(server):
+    """Check that joined messages are split into batches and that messages longer than
+    the receive buffer are reassembled"""
+    instructions = [
+        b"message 1\nmessage 2\nmess",
+        b"age 3\n",
+        b"a long message that does not fit\n",
+        b"<shutdown>",
+    ]
+    server.send(instructions)
+
+    batches = []
+    with TCPClient(HOST, PORT, timeout=5, bufsize=32) as client:
+        client.connect()
+        while True:
+            try:
+                batches.append(client.readlines())
+            except OSError:
+                break
+
+    received = [data for batch in batches for data in batch]
+    assert received == [
+        b"message 1\n",
+        b"message 2\n",
+        b"message 3\n",
+        b"a long message that does not fit\n",
+    ]
+    # The first two messages are sent together and should be received in one batch
+    assert batches[0][:2] == [b"message 1\n", b"message 2\n"]
+
+
+def test_listen_device_batched(server, store):
+    """Ensure that batching preserves the order of messages and the connection state"""
+    outgoing = [
+        b"message 1\nmessage 2\nmessage 3\nmessage 4\n",
+        b"<timeout 0.5>",
+        b"message 5\n",
+        b"<shutdown>",
+    ]
+    expected = [
+        b"message 1\n",
+        b"message 2\n",
+        b"message 3\n",
+        b"message 4\n",
+        b"message 5\n",
+    ]
+    expected_fresh_conn = [True, False, False, False, True]
+    server.send(outgoing)
+    listen_device(store.queue, HOST, PORT, batch_size=3, batch_latency=0.1)
+
+    assert store.data == expected
+    assert store.fresh_connection == expected_fresh_conn
+    # A full batch, then a partial one sent due to the latency limit
+    assert [len(batch) for batch in store.batches] == [3, 1, 1]
+
+
+def test_listen_device_kernel_timestamps(server, store):
+    """Check that the messages are stamped with the time the kernel received them"""
+    outgoing = [
+        b"message 1\nmessage 2\n",
+        b"<timeout 0.2>",
+        b"message 3\n",
+        b"<shutdown>",
+    ]
+    server.send(outgoing)
+    started = time.time()
+    listen_device(store.queue, HOST, PORT, kernel_timestamps=True)
+
+    assert store.data == [b"message 1\n", b"message 2\n", b"message 3\n"]
+    assert all(started <= t <= time.time() for t in store.timestamp)
+    # The messages received at once share the timestamp of their TCP segment
+    assert store.timestamp[0] == store.timestamp[1] < store.timestamp[2]
+
+
+def test_client_no_kernel_timestamp():
+    """Ensure that the data received without a kernel timestamp don't keep the
+    timestamp of an earlier read"""
+    local, remote = socket.socketpair()
+    with remote, TCPClient(HOST, PORT, kernel_timestamps=True) as client:
+        client._sock = local
+        client._timestamp = 1.0
+        remote.sendall(b"message 1\n")
+        assert client.readlines() == [b"message 1\n"]
+        assert client.timestamp is None
+
+
 def test_listen_device_timeout(server, store, caplog):
     """Check that the timeout triggers reconnection and receives the follow-up messages"""
     instructions = [
@@ -256,3 +412,134 @@ def test_echo(server, capsysbinary):
 
     captured = capsysbinary.readouterr()
     assert captured.out == expected
+
+
+def read_captures(paths):
+    """Read the messages from a sequence of timestamped recordings"""
+    received = []
+    for path in paths:
+        with path.open("rb") as f:
+            assert f.read(len(CAPTURE_MAGIC)) == CAPTURE_MAGIC
+            for items in read_capture(f):
+                received.extend(items)
+    return received
+
+
+@pytest.mark.parametrize("compress", [False, True], ids=["plain", "compressed"])
+def test_echo_capture(server, tmp_path, compress):
+    """Check that the timestamped recordings can be read back"""
+    instructions = [
+        b"message 1\n",
+        b"message 2\nmessage 3\n",
+        b"message 4\n",
+        b"<shutdown>",
+    ]
+    server.send(instructions)
+    writer = CaptureWriter(
+        output=str(tmp_path / "{date:%H-%M-%S-%f}.cap"), fmt="ts", compress=compress
+    )
+    echo(HOST, PORT, writer)
+
+    received = read_captures(sorted(tmp_path.glob("*.cap")))
+    assert [item.data for item in received] == [
+        b"message 1\n",
+        b"message 2\n",
+        b"message 3\n",
+        b"message 4\n",
+    ]
+    timestamps = [item.timestamp for item in received]
+    assert all(t1 <= t2 for t1, t2 in zip(timestamps, timestamps[1:]))
+
+
+@pytest.mark.parametrize("output", ["{date:%H-%M-%S-%f}.cap", "data.cap"])
+def test_capture_rotation(tmp_path, output):
+    """Ensure that the recordings are rotated by size, without overwriting the files
+    of the same name"""
+    batches = [[b"message 1\n"], [b"message 2\n", b"message 3\n"], [b"message 4\n"]]
+    with CaptureWriter(
+        output=str(tmp_path / output),
+        fmt="ts",
+        compress=True,
+        rotate_size=20,
+    ) as writer:
+        for i, records in enumerate(batches):
+            writer.write(records, float(i))
+            time.sleep(0.001)
+
+    # E.g. data.cap, data.1.cap, data.2.cap
+    files = sorted(tmp_path.glob("*.cap"), key=lambda f: (len(f.suffixes), f.name))
+    assert len(files) == len(batches)
+    received = read_captures(files)
+    assert [item.data for item in received] == [r for b in batches for r in b]
+    assert [item.timestamp for item in received] == [0.0, 1.0, 1.0, 2.0]
+
+
+def test_capture_tick(tmp_path):
+    """Ensure that the recordings are written out and rotated in time, even if no
+    more messages arrive"""
+    path = tmp_path / "data.cap"
+    with CaptureWriter(
+        output=str(path),
+        fmt="ts",
+        compress=True,
+        rotate_interval=0.2,
+        flush_interval=0.1,
+    ) as writer:
+        writer.write([b"message 1\n"], 1.0)
+        writer.tick()
+        assert path.stat().st_size == 0
+
+        time.sleep(0.1)
+        writer.tick()
+        assert [item.data for item in read_captures([path])] == [b"message 1\n"]
+
+        time.sleep(0.1)
+        writer.tick()
+        writer.write([b"message 2\n"], 2.0)
+    assert [item.data for item in read_captures([tmp_path / "data.1.cap"])] == [
+        b"message 2\n"
+    ]
+
+
+def test_supervise(server, tmp_path, make_conf, caplog):
+    """Check that the single-process event loop parses and saves the device data, and
+    reports the metrics of the device"""
+    instructions = [
+        b"01 RH= 1.23 %RH T= 14.94 'C \r\n",
+        b"01 RH= 1.35 %RH T= 14.85 'C \r\n",
+        b"<disconnect>",
+        b"01 RH= 1.47 %RH T= 14.70 'C \r\n",
+        b"01 RH= 1.60 %RH T= 14.56 'C \r\n",
+        b"01 RH= 1.72 %RH T= 14.41 'C \r\n",
+        b"<shutdown>",
+    ]
+    conf = make_conf(
+        "columnar = yes\n"
+        "missing = fill\n"
+        "pending_packs = 2\n"
+        "compress_workers = 2\n"
+        "compression = lzma:0",
+        host=HOST,
+        port=PORT,
+    )
+    conf.filename = "MSU_Test{group}_{date:%H-%M-%S-%f}.npz"
+    conf.metrics_interval = 1e-6
+
+    server.send(instructions)
+    loop = asyncio.new_event_loop()
+    try:
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            loop.run_until_complete(supervise([conf], pool))
+    finally:
+        loop.close()
+
+    # The partially filled pack is saved on shutdown
+    files = sorted(tmp_path.glob("*.npz"))
+    assert len(files) == 3
+    with np.load(files[0]) as data:
+        assert np.array_equal(data["rh"], [1.23, 1.35])
+    with np.load(files[1]) as data:
+        assert np.array_equal(data["temp"], [14.70, 14.56])
+    with np.load(files[2]) as data:
+        assert np.array_equal(data["rh"], [1.72])
+    assert f"Metrics of {HOST}:{PORT}: " in caplog.text
@@ -0,0 +1,173 @@
+import queue
+import time
+from multiprocessing import Process
+from queue import Empty, Full
+
+import pytest
+from readport import Item, Journal, SharedRing, SpillQueue
+
+
+@pytest.fixture
+def ring():
+    """Create a small shared memory ring buffer and release it after the test"""
+    ring = SharedRing(size=64, slots=4)
+    yield ring
+    ring.close()
+
+
+def test_ring_put_get(ring):
+    """Check that messages come out of the ring in order and unchanged"""
+    items = [Item(b"message %d\r\n" % i, time.time(), i == 0) for i in range(10)]
+
+    assert ring.empty()
+    received = []
+    for item in items:
+        ring.put(item)
+        received.append(ring.get(timeout=1))
+
+    assert received == items
+    assert ring.empty()
+    assert ring.occupancy == 0
+
+
+def test_ring_full(ring):
+    """Ensure that the ring rejects messages it has no room for"""
+    ring.put([Item(b"x" * 20, 1.0, False), Item(b"y" * 20, 2.0, False)])
+    assert ring.occupancy == pytest.approx(40 / 64)
+
+    # Out of data space
+    with pytest.raises(Full):
+        ring.put(Item(b"z" * 30, 3.0, False))
+
+    # Out of index entries
+    ring.put([Item(b"a", 4.0, False), Item(b"b", 5.0, False)])
+    with pytest.raises(Full):
+        ring.put(Item(b"c", 6.0, False))
+
+    # Wrap around the end of the data region after making room
+    assert ring.get(timeout=1).data == b"x" * 20
+    assert ring.get(timeout=1).data == b"y" * 20
+    ring.put(Item(b"z" * 30, 3.0, False))
+    assert [ring.get(timeout=1).data for _ in range(3)] == [b"a", b"b", b"z" * 30]
+
+    with pytest.raises(Empty):
+        ring.get(timeout=0.1)
+
+
+def produce(ring, n):
+    for i in range(n):
+        while True:
+            try:
+                ring.put(Item(b"%d\n" % i, float(i), False))
+                break
+            except Full:
+                time.sleep(0.001)
+
+
+def test_ring_processes(ring):
+    """Pass messages from another process"""
+    n = 1000
+    p = Process(target=produce, args=(ring, n))
+    p.start()
+    received = [ring.get(timeout=5) for _ in range(n)]
+    p.join()
+
+    assert [item.data for item in received] == [b"%d\n" % i for i in range(n)]
+    assert [item.timestamp for item in received] == [float(i) for i in range(n)]
+
+
+def drain(q):
+    """Take all of the items from a queue, unpacking the batches"""
+    items = []
+    while not q.empty():
+        obj = q.get()
+        items.extend(obj if isinstance(obj, list) else [obj])
+    return items
+
+
+def test_spill_queue(tmp_path):
+    """Check that the overflow is spilled to disk and replayed in order"""
+    items = [Item(b"message %d\r\n" % i, float(i), i == 0) for i in range(10)]
+    inner = queue.Queue(maxsize=2)
+    q = SpillQueue(inner, tmp_path / "test.spill", replay_batch=3)
+
+    q.put(items[0])
+    q.put(items[1:3])
+    q.put(items[3])
+    assert q.spilled > 0
+    # Spilled messages keep newer messages from jumping the queue
+    received = drain(inner)
+    q.put(items[4:6])
+
+    received += drain(inner)
+    for item in items[6:]:
+        q.put(item)
+        received += drain(inner)
+
+    assert received == items
+    assert q.spilled == 0
+    assert (tmp_path / "test.spill").stat().st_size == 0
+
+
+def test_spill_queue_restart(tmp_path):
+    """Ensure that messages spilled before a restart are replayed first"""
+    items = [Item(b"message %d\r\n" % i, float(i), False) for i in range(5)]
+    path = tmp_path / "test.spill"
+
+    q = SpillQueue(queue.Queue(maxsize=1), path)
+    for item in items[:4]:
+        q.put(item)
+    assert q.spilled > 0
+
+    # Start over with a new queue, losing the message that was kept in memory
+    inner = queue.Queue(maxsize=1)
+    q = SpillQueue(inner, path)
+    received = []
+    q.put(items[4])
+    while q.spilled or not inner.empty():
+        received += drain(inner)
+        q.replay()
+
+    assert received == items[1:]
+
+
+def test_journal_recover(tmp_path):
+    """Check that journaled messages survive a restart and are replayed in order"""
+    items = [Item(b"message %d\r\n" % i, float(i), i == 0) for i in range(10)]
+
+    journal = Journal(tmp_path, segment_size=100)
+    assert journal.recover() == 0
+    for item in items:
+        journal.append(item)
+    journal.close()
+    assert len(journal.segments()) > 1
+
+    # A restart
+    journal = Journal(tmp_path, segment_size=100)
+    assert journal.recover() == len(items)
+    assert list(journal.replay(journal.next_seq)) == list(enumerate(items))
+
+    # Save the first half of the messages to disk
+    journal.commit(5)
+    assert list(journal.replay(journal.next_seq)) == list(enumerate(items))[5:]
+    assert journal.segments()[0][0] <= 5
+
+
+def test_journal_truncated(tmp_path):
+    """Ensure that a message cut short by a crash ends the replay"""
+    journal = Journal(tmp_path)
+    journal.recover()
+    journal.append(Item(b"message 1\n", 1.0, False))
+    journal.append(Item(b"message 2\n", 2.0, False))
+    journal.close()
+
+    # Corrupt the last byte of the second message
+    path = journal.segments()[0][1]
+    data = bytearray(path.read_bytes())
+    end = data.index(b"message 2\n") + len(b"message 2\n")
+    data[end - 1] = 0
+    path.write_bytes(data)
+
+    journal = Journal(tmp_path)
+    assert journal.recover() == 1
+    assert [item.data for _, item in journal.replay(1)] == [b"message 1\n"]